@@ -0,0 +1,125 @@
+"""
+Tests of `workflows.name_resolver`, with names one letter apart.
+"""
+import json
+import pathlib
+import tempfile
+import unittest
+from typing import Any, Dict
+
+from workflows.name_resolver import BKTree, LocalNameResolver, levenshtein
+
+
+def best_result(record_id: str, name: str) -> Dict[str, Any]:
+    return {"recordId": record_id, "matchedCanonicalSimple": name}
+
+
+VERIFIED = {
+    "101": "Aaptos aaptos",
+    "201": "Bathycrinus gracilis",
+    "202": "Bathycrinus aldrichianus",
+    # Different genera one letter apart
+    "300": "Pecten",
+    "400": "Pectan",
+    "501": "Terebratula vitrea",
+}
+
+
+def resolver(fuzzy: bool) -> LocalNameResolver:
+    name_resolver = LocalNameResolver(fuzzy)
+    for record_id, name in VERIFIED.items():
+        name_resolver.add(best_result(record_id, name))
+    return name_resolver
+
+
+def record_id(name_resolver: LocalNameResolver, name: str) -> Any:
+    verification = name_resolver.resolve(name)
+    return verification and verification["bestResult"]["recordId"]
+
+
+class LocalNameResolverTest(unittest.TestCase):
+    def test_exact_names_are_resolved(self) -> None:
+        name_resolver = resolver(fuzzy=False)
+
+        self.assertEqual(record_id(name_resolver, "Aaptos  aaptos"), "101")
+        self.assertEqual(record_id(name_resolver, "bathycrinus GRACILIS"), "201")
+        verification = name_resolver.resolve("Pecten")
+        assert verification is not None
+        self.assertEqual(verification["matchType"], "Exact")
+
+    def test_names_one_letter_apart_are_not_resolved_by_default(self) -> None:
+        name_resolver = resolver(fuzzy=False)
+
+        self.assertIsNone(name_resolver.resolve("Aaptos aaptus"))
+        self.assertIsNone(name_resolver.resolve("Bathycrinus graciIis"))
+        self.assertIsNone(name_resolver.resolve("Terebratula vitraa"))
+        self.assertEqual((name_resolver.hits, name_resolver.misses), (0, 3))
+
+    def test_fuzzy_single_nearest_name_is_resolved(self) -> None:
+        name_resolver = resolver(fuzzy=True)
+
+        with self.assertLogs("Name Resolver") as logs:
+            verification = name_resolver.resolve("Bathycrinus graciIis")
+        assert verification is not None
+        self.assertEqual(verification["bestResult"]["recordId"], "201")
+        self.assertEqual(verification["matchType"], "Fuzzy")
+        self.assertEqual(verification["editDistance"], 1)
+        self.assertIn("Bathycrinus graciIis -> Bathycrinus gracilis", logs.output[0])
+        self.assertEqual(name_resolver.fuzzy_hits, 1)
+
+    def test_fuzzy_ambiguous_names_are_not_resolved(self) -> None:
+        # "Pectin" is one letter from both "Pecten" and "Pectan".
+        self.assertIsNone(resolver(fuzzy=True).resolve("Pectin"))
+
+    def test_fuzzy_binomials_keep_their_genus(self) -> None:
+        name_resolver = resolver(fuzzy=True)
+
+        # "Terebratulla vitrea" is only one letter from "Terebratula vitrea", but its
+        # genus differs.
+        self.assertIsNone(name_resolver.resolve("Terebratulla vitrea"))
+        self.assertEqual(record_id(name_resolver, "Terebratula vitraa"), "501")
+
+    def test_from_files(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = pathlib.Path(tmp_dir) / "species.json"
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "species": {
+                            "101": {
+                                **best_result("101", "Aaptos aaptos"),
+                                "matchedName": "Aaptos aaptos (Schmidt, 1864)",
+                            }
+                        }
+                    },
+                    f,
+                )
+            name_resolver = LocalNameResolver.from_files([path, path.with_name("x")])
+
+        self.assertEqual(len(name_resolver), 1)
+        self.assertEqual(record_id(name_resolver, "Aaptos aaptos"), "101")
+        self.assertIsNone(name_resolver.resolve("Aaptos aaptus"))
+
+
+class BKTreeTest(unittest.TestCase):
+    def test_search_finds_the_names_within_the_distance(self) -> None:
+        words = ["pecten", "pectan", "pectinaria", "aaptos", "aaptos aaptos", "a"]
+        tree = BKTree()
+        for word in words:
+            tree.add(word)
+
+        for word in ("pectin", "aaptus", "b"):
+            for distance in range(4):
+                with self.subTest(word=word, distance=distance):
+                    self.assertEqual(
+                        tree.search(word, distance),
+                        sorted(
+                            (levenshtein(word, w), w)
+                            for w in words
+                            if levenshtein(word, w) <= distance
+                        ),
+                    )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests of `workflows.pipeline`, in a temporary project root.
+"""
+import json
+import os
+import pathlib
+import subprocess
+import tempfile
+import unittest
+from typing import Any, List
+from unittest import mock
+
+from workflows import pipeline
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+class PipelineProfileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.root = pathlib.Path(tmp_dir.name)
+        self.state_path = self.root / "data" / "tmp" / "pipeline_state.json"
+
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+
+    def run_commands(self, profile: bool) -> List[List[str]]:
+        """
+        Run all the stages with a stub of `subprocess.run`, and return their commands.
+        """
+        commands: List[List[str]] = []
+
+        def run(command: List[str], *args: Any, **kwargs: Any) -> Any:
+            commands.append(command)
+            return subprocess.CompletedProcess(command, 0)
+
+        with mock.patch.object(pipeline.subprocess, "run", run):
+            statuses = pipeline.run_pipeline(
+                force=True, state_path=self.state_path, profile=profile
+            )
+        self.assertEqual(set(statuses.values()), {"done"})
+        return commands
+
+    def test_profile_is_forwarded_to_every_stage(self) -> None:
+        commands = self.run_commands(profile=True)
+
+        self.assertEqual(len(commands), len(pipeline.STAGES))
+        for command in commands:
+            self.assertEqual(command[-1], "--profile")
+
+    def test_profile_is_not_forwarded_by_default(self) -> None:
+        for command in self.run_commands(profile=False):
+            self.assertNotIn("--profile", command)
+
+    def test_profile_does_not_change_the_state(self) -> None:
+        self.run_commands(profile=True)
+        with open(self.state_path, "r") as f:
+            profiled_state = json.load(f)["stages"]
+
+        self.run_commands(profile=False)
+        with open(self.state_path, "r") as f:
+            self.assertEqual(json.load(f)["stages"].keys(), profiled_state.keys())
+
+    def test_second_run_is_up_to_date(self) -> None:
+        # Every stage writes the same outputs in every run, and the stages that
+        # share outputs (e.g. index_species_verified.json) write them differently.
+        outputs = {tuple(s.command): s.outputs for s in pipeline.STAGES}
+
+        def run(command: List[str], *args: Any, **kwargs: Any) -> Any:
+            for output in outputs[tuple(command)]:
+                path = pathlib.Path(output)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(" ".join(command[2:]))
+            return subprocess.CompletedProcess(command, 0)
+
+        with mock.patch.object(pipeline.subprocess, "run", run):
+            pipeline.run_pipeline(state_path=self.state_path)
+            statuses = pipeline.run_pipeline(state_path=self.state_path)
+
+        self.assertEqual(statuses.pop("update_data_sources"), "done")
+        self.assertEqual(set(statuses.values()), {"up to date"})
+
+    def test_stage_saves_its_profile(self) -> None:
+        # inverted_indexes only needs numpy, so it runs here for real.
+        oceans_path = self.root / "data" / "Oceans1876"
+        oceans_path.mkdir(parents=True)
+        with open(oceans_path / "index_species.json", "w") as f:
+            json.dump(
+                {"species": [{"matched_species": "1", "pages": ["5"], "species": []}]},
+                f,
+            )
+        with open(oceans_path / "stations.json", "w") as f:
+            json.dump([{"Station": "1", "Species": [{"recordId": "1"}]}], f)
+
+        inverted_indexes = next(
+            s for s in pipeline.STAGES if s.name == "inverted_indexes"
+        )
+        with mock.patch.dict(os.environ, {"PYTHONPATH": str(PROJECT_ROOT)}):
+            status = pipeline.run_stage(
+                inverted_indexes,
+                pipeline.PipelineState(self.state_path),
+                force=True,
+                dry_run=False,
+                profile=True,
+            )
+
+        self.assertEqual(status, "done")
+        profiles = list((self.root / "data" / "tmp" / "profiles").glob("*.pstats"))
+        self.assertEqual([p.name.split("-")[0] for p in profiles], ["inverted_indexes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
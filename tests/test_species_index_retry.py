@@ -0,0 +1,201 @@
+"""
+Offline tests of the `verify-species` (pipeline stage `species_index_verify`) and
+`process-text` subcommands of `workflows.process_summary_report_species_index`,
+which reload `index_species.json` and `index_species_verified.json`.
+
+gnverifier is replaced by a stub, and the extra info is not requested.
+"""
+import json
+import pathlib
+import tempfile
+import unittest
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+from workflows import process_summary_report_species_index as species_index
+from workflows.utils import PydanticJSONEncoder
+
+GNVERIFIER_VERSION = "gnverifier version: v1.0.0"
+
+
+def best_result(record_id: str, name: str) -> Dict[str, Any]:
+    """
+    Return a gnverifier `bestResult` of `name`.
+    """
+    return {
+        "dataSourceId": 9,
+        "dataSourceTitleShort": "WoRMS",
+        "curation": "Curated",
+        "recordId": record_id,
+        "outlink": f"https://www.marinespecies.org/aphia.php?id={record_id}",
+        "entryDate": "2022-11-01",
+        "sortScore": 9.0,
+        "matchedNameID": record_id,
+        "matchedName": name,
+        "matchedCardinality": len(name.split()),
+        "matchedCanonicalSimple": name,
+        "matchedCanonicalFull": name,
+        "currentRecordId": record_id,
+        "currentNameId": record_id,
+        "currentName": name,
+        "currentCardinality": len(name.split()),
+        "currentCanonicalSimple": name,
+        "currentCanonicalFull": name,
+        "isSynonym": False,
+        "classificationPath": f"Animalia|{name}",
+        "classificationRanks": "kingdom|genus",
+        "classificationIds": f"2|{record_id}",
+        "editDistance": 0,
+        "stemEditDistance": 0,
+        "matchType": "Exact",
+    }
+
+
+# name -> record id of the names known to the gnverifier stub
+VERIFIED_NAMES = {
+    "Aaptos": "100",
+    "Aaptos aaptos": "101",
+    "Bathycrinus": "200",
+    "Bathycrinus gracilis": "201",
+}
+
+
+class GNamesStub:
+    def __init__(self) -> None:
+        self.app_versions = {
+            "gnfinder": "gnfinder version: v1.0.0",
+            "gnverifier": GNVERIFIER_VERSION,
+        }
+        self.verified: List[str] = []
+
+    def verify(self, name: str) -> Dict[str, Any]:
+        self.verified.append(name)
+        if name not in VERIFIED_NAMES:
+            return {"name": name, "matchType": "NoMatch"}
+        return {
+            "name": name,
+            "matchType": "Exact",
+            "bestResult": best_result(VERIFIED_NAMES[name], name),
+        }
+
+
+def debug_info(page: int, line: int, texts: List[str]) -> Any:
+    return species_index.SpeciesIndexDebug(
+        texts=texts,
+        page=page,
+        column=0,
+        line=line,
+        bounding_box=(0, 0, 10, 10),
+        message="",
+        need_verification=False,
+    )
+
+
+def genus(
+    name: str, matched_species: Optional[str], species: List[Any], line: int
+) -> Any:
+    return species_index.SpeciesIndexGenus(
+        genus=name,
+        synonym=None,
+        matched_species=matched_species,
+        pages=["1"],
+        species=species,
+        debug=debug_info(739, line, [f"{name}, 1"]),
+    )
+
+
+def species(name: str, matched_species: Optional[str], line: int) -> Any:
+    return species_index.SpeciesIndexSpecies(
+        species=name,
+        matched_species=matched_species,
+        pages=["2"],
+        genus_synonym=None,
+        debug=debug_info(739, line, [f"{name}, 2"]),
+    )
+
+
+class SpeciesIndexRetryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.output_path = pathlib.Path(tmp_dir.name)
+        data_sources_path = self.output_path / "data_sources.json"
+        data_sources_path.write_text("{}")
+
+        self.gnames = GNamesStub()
+        patchers: List[Any] = [
+            mock.patch.object(species_index, "OUTPUT_PATH", self.output_path),
+            mock.patch.object(
+                species_index, "DATA_SOURCES_FILE_PATH", data_sources_path
+            ),
+            mock.patch.object(species_index, "GNames", lambda: self.gnames),
+            mock.patch.object(
+                species_index.SpeciesProcessor, "get_verified_species_extra"
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Aaptos was verified, Bathycrinus (and its species) was not.
+        genera = [
+            genus("Aaptos", "100", [species("aaptos", "101", 2)], 1),
+            genus("Bathycrinus", None, [species("gracilis", None, 4)], 3),
+        ]
+        self.write("index_species.json", {"species": genera})
+        self.write(
+            "index_species_verified.json",
+            {
+                "species": {
+                    record_id: best_result(record_id, name)
+                    for name, record_id in VERIFIED_NAMES.items()
+                    if record_id in ("100", "101")
+                }
+            },
+        )
+
+    def write(self, name: str, document: Dict[str, Any]) -> None:
+        document = {
+            "metadata": species_index.GNMetadata(gnverifier=GNVERIFIER_VERSION),
+            **document,
+        }
+        with open(self.output_path / name, "w") as f:
+            json.dump(document, f, indent=2, cls=PydanticJSONEncoder)
+
+    def read(self, name: str) -> Dict[str, Any]:
+        with open(self.output_path / name, "r") as f:
+            return json.load(f)
+
+    def assert_all_verified(self) -> None:
+        genera = self.read("index_species.json")["species"]
+        self.assertEqual(
+            [taxon["matched_species"] for g in genera for taxon in [g, *g["species"]]],
+            ["100", "101", "200", "201"],
+        )
+        self.assertEqual(
+            list(self.read("index_species_verified.json")["species"]),
+            ["100", "101", "200", "201"],
+        )
+
+    def test_verify_species(self) -> None:
+        species_index.SpeciesProcessor(
+            local_resolver=False
+        ).retry_missing_verifications()
+
+        # Only the names without a match are verified again, and the previous
+        # verifications are kept.
+        self.assertEqual(self.gnames.verified, ["Bathycrinus", "Bathycrinus gracilis"])
+        self.assert_all_verified()
+
+    def test_process_text(self) -> None:
+        species_index.SpeciesProcessor(local_resolver=False).retry_text_processing()
+
+        self.assertEqual(
+            sorted(self.gnames.verified),
+            sorted(VERIFIED_NAMES),
+        )
+        self.assert_all_verified()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests of `workflows.taxonomy_store`: the files exported from the store are the
+files it was updated from, byte for byte.
+"""
+import csv
+import json
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+from typing import Any, Dict
+
+from workflows.json_stream import JSONStreamWriter
+from workflows.taxonomy_store import TaxonomyStore
+
+
+def verification(record_id: str, name: str) -> Dict[str, Any]:
+    return {
+        "recordId": record_id,
+        "matchedName": name,
+        "matchedCanonicalSimple": name,
+        "currentCanonicalSimple": name,
+        "sortScore": 9.5,
+        "isSynonym": False,
+    }
+
+
+SPECIES = {
+    "100": verification("100", "Aaptos aaptos"),
+    "200": verification("200", "Bathycrinus gracilis"),
+}
+
+INDEX_SPECIES = {
+    "metadata": {"gnverifier": "v1.0.0"},
+    "species": [
+        {
+            "genus": "Aaptos",
+            "matched_species": "100",
+            "pages": ["1"],
+            "species": [{"species": "aaptos", "matched_species": "101"}],
+        },
+        {"genus": "Müllerina", "matched_species": None, "species": None},
+    ],
+}
+
+EXTRA_INFO = {
+    "metadata": {},
+    "species": {
+        "100": {
+            "records": [{"id": 100, "scientificname": "Aaptos aaptos"}],
+            "synonyms": [],
+            "common_names": [{"vernacular": "Schwamm", "language_code": "ger"}],
+        },
+        "200": {"records": None, "synonyms": None, "common_names": None},
+    },
+}
+
+PLYMOUTH_ROWS = [
+    ["Genus", "Species", "WoRMS ID"],
+    ["Aaptos", "aaptos", "100"],
+    ["Bathycrinus", "gracilis, var. 1", ""],
+]
+
+
+class TaxonomyStoreExportTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.root = pathlib.Path(tmp_dir.name)
+        self.sources_path = self.root / "sources"
+        self.sources_path.mkdir()
+        self.store_path = self.root / "taxonomy.db"
+
+        # species.json is written by remove_invalid_species (indent 4)
+        with open(self.sources_path / "species.json", "w") as f:
+            writer = JSONStreamWriter(f)
+            writer.begin_object()
+            writer.value({"gnverifier": "v1.0.0"}, "metadata")
+            writer.begin_object("species")
+            for record_id, sp in SPECIES.items():
+                writer.value(sp, record_id)
+            writer.end()
+            writer.end()
+        with open(self.sources_path / "index_species.json", "w") as f:
+            json.dump(INDEX_SPECIES, f, indent=2)
+        with open(
+            self.sources_path / "index_species_verified_extra.json",
+            "w",
+            encoding="utf-8",
+        ) as f:
+            json.dump(EXTRA_INFO, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        with open(self.sources_path / "all_species_updated.csv", "w", newline="") as f:
+            csv.writer(f, lineterminator="\n").writerows(PLYMOUTH_ROWS)
+
+        self.sources = {
+            "species": self.sources_path / "species.json",
+            "index_species": self.sources_path / "index_species.json",
+            "index_species_verified_extra": self.sources_path
+            / "index_species_verified_extra.json",
+            "plymouth_all_species": self.sources_path / "all_species_updated.csv",
+        }
+
+    def export(self) -> pathlib.Path:
+        export_path = self.root / "export"
+        with TaxonomyStore(self.store_path) as store:
+            store.update(self.sources)
+            store.export(export_path)
+        return export_path
+
+    def assert_exported_as_imported(self, export_path: pathlib.Path) -> None:
+        for path in self.sources.values():
+            with self.subTest(path.name):
+                self.assertEqual(
+                    (export_path / path.name).read_bytes(), path.read_bytes()
+                )
+
+    def test_export_is_the_imported_files(self) -> None:
+        self.assert_exported_as_imported(self.export())
+
+    def test_store_without_formats_is_updated(self) -> None:
+        # A store created before the format column: the same files are read
+        # again for their format.
+        with TaxonomyStore(self.store_path) as store:
+            store.update(self.sources)
+        connection = sqlite3.connect(self.store_path)
+        with connection:
+            connection.execute("ALTER TABLE sources DROP COLUMN format")
+        connection.close()
+
+        self.assert_exported_as_imported(self.export())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Offline tests of `workflows.update_data_sources`, against a local HTTP stub of the
+Global Names API data sources endpoint.
+
+Run from the project root with `python -m unittest discover tests`.
+"""
+import json
+import pathlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional
+
+from workflows import update_data_sources
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Tue, 01 Nov 2022 00:00:00 GMT"
+
+REMOTE_DATA_SOURCE = {
+    "id": 1,
+    "title": "Catalogue of Life",
+    "titleShort": "Catalogue of Life",
+    "curation": "Curated",
+    "recordCount": 4000000,
+    "updatedAt": "2022-11-01",
+    "isOutlinkReady": True,
+}
+
+
+def local_data_sources(**fields: Any) -> Dict[str, dict]:
+    """
+    Return the data sources file of the remote data source, with `fields` replaced.
+    """
+    data_source = {
+        update_data_sources.camelcase_to_snakecase(k): v
+        for k, v in REMOTE_DATA_SOURCE.items()
+    }
+    data_source.update(fields)
+    return {str(REMOTE_DATA_SOURCE["id"]): data_source}
+
+
+class DataSourcesStub(BaseHTTPRequestHandler):
+    """
+    Serves the data sources, or 304 if the request's ETag matches.
+    The headers of the requests are saved in `requests`.
+    """
+
+    requests: List[Dict[str, str]] = []
+
+    def do_GET(self) -> None:
+        DataSourcesStub.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps([REMOTE_DATA_SOURCE]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class UpdateDataSourcesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = HTTPServer(("127.0.0.1", 0), DataSourcesStub)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.uri = f"http://127.0.0.1:{self.server.server_port}/data_sources"
+        DataSourcesStub.requests = []
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.data_sources_path = pathlib.Path(tmp_dir.name) / "data_sources.json"
+        self.http_cache_path = pathlib.Path(tmp_dir.name) / "http_cache.json"
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update(self, force: bool = False) -> None:
+        update_data_sources.update_data_sources(
+            self.uri, force, self.data_sources_path, self.http_cache_path
+        )
+
+    def write_data_sources(self, data_sources: Dict[str, dict]) -> None:
+        with open(self.data_sources_path, "w") as f:
+            json.dump(data_sources, f, indent=2)
+
+    def write_http_cache(self) -> None:
+        with open(self.http_cache_path, "w") as f:
+            json.dump(
+                {self.uri: {"etag": ETAG, "last_modified": LAST_MODIFIED}}, f, indent=2
+            )
+
+    def read_http_cache(self) -> Optional[dict]:
+        if not self.http_cache_path.exists():
+            return None
+        with open(self.http_cache_path, "r") as f:
+            return json.load(f)
+
+    def test_changed_data_sources_are_saved(self) -> None:
+        self.write_data_sources(local_data_sources(record_count=1))
+
+        self.update()
+
+        with open(self.data_sources_path, "r") as f:
+            data_sources = json.load(f)
+        self.assertEqual(
+            data_sources["1"]["record_count"], REMOTE_DATA_SOURCE["recordCount"]
+        )
+        self.assertEqual(
+            self.read_http_cache(),
+            {self.uri: {"etag": ETAG, "last_modified": LAST_MODIFIED}},
+        )
+
+    def test_unchanged_data_sources_are_not_rewritten(self) -> None:
+        self.write_data_sources(local_data_sources())
+        content = self.data_sources_path.read_bytes()
+        mtime = self.data_sources_path.stat().st_mtime_ns
+
+        self.update()
+
+        self.assertEqual(self.data_sources_path.read_bytes(), content)
+        self.assertEqual(self.data_sources_path.stat().st_mtime_ns, mtime)
+        self.assertEqual(
+            self.read_http_cache(),
+            {self.uri: {"etag": ETAG, "last_modified": LAST_MODIFIED}},
+        )
+
+    def test_not_modified_returns_early(self) -> None:
+        # The data sources file is missing, so it must not be read.
+        self.write_http_cache()
+
+        self.update()
+
+        self.assertEqual(DataSourcesStub.requests[0]["If-None-Match"], ETAG)
+        self.assertEqual(
+            DataSourcesStub.requests[0]["If-Modified-Since"], LAST_MODIFIED
+        )
+        self.assertFalse(self.data_sources_path.exists())
+
+    def test_force_skips_conditional_headers(self) -> None:
+        self.write_data_sources(local_data_sources(record_count=1))
+        self.write_http_cache()
+
+        self.update(force=True)
+
+        self.assertNotIn("If-None-Match", DataSourcesStub.requests[0])
+        self.assertNotIn("If-Modified-Since", DataSourcesStub.requests[0])
+        with open(self.data_sources_path, "r") as f:
+            data_sources = json.load(f)
+        self.assertEqual(
+            data_sources["1"]["record_count"], REMOTE_DATA_SOURCE["recordCount"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+`python -m workflows run` runs the outdated workflows in dependency order
+(see `workflows.pipeline`).
+"""
+import argparse
+import logging
+import os
+import sys
+
+from .pipeline import STAGES, TIMINGS_PATH, log_statuses, run_pipeline
+from .profiling import add_profile_argument, profile
+from .timing import timings
+
+logging.basicConfig(level=logging.INFO)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m workflows")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Run the outdated stages and the stages that depend on them"
+    )
+    status_parser = subparsers.add_parser(
+        "status", help="Show which stages are outdated"
+    )
+    for subparser in (run_parser, status_parser):
+        subparser.add_argument(
+            "stages",
+            nargs="*",
+            metavar="STAGE",
+            help="Stages to run, with the stages they depend on (default: all). "
+            f"One of: {', '.join(s.name for s in STAGES)}",
+        )
+    run_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run the stages even if they are up to date",
+    )
+    run_parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of stages that can run in parallel",
+    )
+    add_profile_argument(run_parser)
+    args = parser.parse_args()
+
+    unknown_stages = set(args.stages) - {s.name for s in STAGES}
+    if unknown_stages:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown_stages))}")
+
+    if args.command == "status":
+        log_statuses(run_pipeline(args.stages, dry_run=True))
+    else:
+        with profile("pipeline", args.profile):
+            statuses = run_pipeline(
+                args.stages, args.force, args.workers, profile=args.profile
+            )
+        log_statuses(statuses)
+        timings.save(TIMINGS_PATH)
+        if "failed" in statuses.values():
+            sys.exit("Some stages failed")
@@ -3,10 +3,33 @@ This script handles the following:
 - Extracts a subset of data from the `species.json` and `stations.json` files.
 - Loads this data into separate `.json` files in `Oceans1876_subset` so that it can
 be used for the test database in `challenger-api`.
+
+The stations are streamed and selected by one of the following modes:
+- first: the first N stations (reading stops once they are found)
+- random: N random stations, with a seed (reservoir sampling)
+- stratified: N random stations spread evenly over the values of a column,
+  e.g. `Water body` or `FAOarea`
+- bbox: the first N stations within a bounding box (reading stops once they are found),
+  which crosses the antimeridian if its minimum longitude is greater than its maximum
+
+The species of the selected stations are then collected in one pass over `species.json`.
 """
+import argparse
+import itertools
 import json
+import logging
 import pathlib
+import random
 from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .json_stream import JSONStreamReader
+from .jsonl import iter_records
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Create Test Data")
 
 WORK_DIR = pathlib.Path("./data")
 INPUT_DIR = WORK_DIR / "Oceans1876"
@@ -19,32 +42,234 @@ STATIONS_JSON = INPUT_DIR / "stations.json"
 OUTPUT_SPECIES_JSON = OUTPUT_DIR / "species.json"
 OUTPUT_STATIONS_JSON = OUTPUT_DIR / "stations.json"
 
+SELECTION_MODES = ["first", "random", "stratified", "bbox"]
+STRATIFY_COLUMNS = ["Water body", "FAOarea"]
 
-def create_subset(stations_count: int = 15) -> None:
-    with open(SPECIES_JSON) as f:
-        species_data = json.load(f)
+# (min latitude, min longitude, max latitude, max longitude)
+BoundingBox = Tuple[float, float, float, float]
 
-    with open(STATIONS_JSON) as f:
-        stations_data = json.load(f)
 
-    subset_stations = stations_data[:stations_count]
+def select_first(stations: Iterable[dict], count: int) -> List[dict]:
+    return list(itertools.islice(stations, count))
+
+
+def select_random(stations: Iterable[dict], count: int, seed: int) -> List[dict]:
+    """
+    Select `count` stations uniformly at random (reservoir sampling),
+    keeping their original order.
+    """
+    rng = random.Random(seed)
+    reservoir: List[Tuple[int, dict]] = []
+    for idx, station in enumerate(stations):
+        if idx < count:
+            reservoir.append((idx, station))
+        else:
+            replace_idx = rng.randint(0, idx)
+            if replace_idx < count:
+                reservoir[replace_idx] = (idx, station)
+    return [station for _, station in sorted(reservoir, key=lambda s: s[0])]
+
+
+def select_stratified(
+    stations: Iterable[dict], count: int, seed: int, column: str
+) -> List[dict]:
+    """
+    Select `count` random stations spread as evenly as possible over the values
+    of `column`, keeping their original order.
+    Each value gets one station in turn (in the order the values first appear),
+    until `count` stations are selected or all the stations of a value are taken.
+    """
+    rng = random.Random(seed)
+    # Reservoir of (index, station) and the number of stations seen, for each value
+    strata: Dict[Any, Tuple[List[Tuple[int, dict]], int]] = {}
+    for idx, station in enumerate(stations):
+        reservoir, seen = strata.setdefault(station.get(column), ([], 0))
+        if seen < count:
+            reservoir.append((idx, station))
+        else:
+            replace_idx = rng.randint(0, seen)
+            if replace_idx < count:
+                reservoir[replace_idx] = (idx, station)
+        strata[station.get(column)] = (reservoir, seen + 1)
+
+    reservoirs = [reservoir for reservoir, _ in strata.values()]
+    for reservoir in reservoirs:
+        rng.shuffle(reservoir)
+
+    selected: List[Tuple[int, dict]] = []
+    for round_idx in range(count):
+        for reservoir in reservoirs:
+            if len(selected) < count and round_idx < len(reservoir):
+                selected.append(reservoir[round_idx])
+    return [station for _, station in sorted(selected, key=lambda s: s[0])]
+
+
+def in_lon_range(lon: float, min_lon: float, max_lon: float) -> bool:
+    """
+    Whether `lon` is between `min_lon` and `max_lon`, eastwards, i.e. across the
+    antimeridian if `min_lon` > `max_lon` (e.g. from 170 to -170).
+    """
+    if min_lon <= max_lon:
+        return min_lon <= lon <= max_lon
+    return lon >= min_lon or lon <= max_lon
 
-    subset_species = {"metadata": species_data["metadata"], "species": {}}
-    subset_species["metadata"]["date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+def select_bbox(stations: Iterable[dict], count: int, bbox: BoundingBox) -> List[dict]:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return select_first(
+        (
+            station
+            for station in stations
+            if station.get("Decimal Latitude") is not None
+            and station.get("Decimal Longitude") is not None
+            and min_lat <= station["Decimal Latitude"] <= max_lat
+            and in_lon_range(station["Decimal Longitude"], min_lon, max_lon)
+        ),
+        count,
+    )
+
+
+def load_species(species_path: pathlib.Path, record_ids: Sequence[str]) -> dict:
+    """
+    Load the metadata and the given species from `species.json` in one pass,
+    which stops once all of them are found. The species keep the order of
+    `record_ids`.
+    """
+    remaining = set(record_ids)
+    metadata: Optional[dict] = None
+    species: Dict[str, dict] = {}
+
+    with open(species_path, "r") as f:
+        reader = JSONStreamReader(f)
+        for key in reader.iter_object():
+            if key == "species":
+                for record_id in reader.iter_object():
+                    sp = reader.value()
+                    if record_id in remaining:
+                        species[record_id] = sp
+                        remaining.remove(record_id)
+                        if metadata is not None and not remaining:
+                            break
+            else:
+                value = reader.value()
+                if key == "metadata":
+                    metadata = value
+            if metadata is not None and not remaining:
+                break
+
+    for record_id in remaining:
+        logger.warning(f"Species {record_id} is missing from {species_path}")
+
+    return {
+        "metadata": metadata if metadata is not None else {},
+        "species": {
+            record_id: species[record_id]
+            for record_id in record_ids
+            if record_id in species
+        },
+    }
+
+
+def create_subset(
+    stations_count: int = 15,
+    mode: str = "first",
+    seed: int = 0,
+    stratify_by: str = "Water body",
+    bbox: Optional[BoundingBox] = None,
+    stations_path: pathlib.Path = STATIONS_JSON,
+    species_path: pathlib.Path = SPECIES_JSON,
+) -> None:
+    with stage("stations select"):
+        stations = iter_records(stations_path)
+        if mode == "random":
+            subset_stations = select_random(stations, stations_count, seed)
+        elif mode == "stratified":
+            subset_stations = select_stratified(
+                stations, stations_count, seed, stratify_by
+            )
+        elif mode == "bbox":
+            if bbox is None:
+                raise ValueError("The bbox mode requires a bounding box")
+            subset_stations = select_bbox(stations, stations_count, bbox)
+        else:
+            subset_stations = select_first(stations, stations_count)
+
+    logger.info(f"Selected {len(subset_stations)} stations ({mode})")
+
+    record_ids: Dict[str, None] = {}
     for station in subset_stations:
-        for sp in station["Species"]:
-            if "recordId" in sp and sp["recordId"] not in subset_species["species"]:
-                subset_species["species"][sp["recordId"]] = species_data["species"][
-                    sp["recordId"]
-                ]
+        for sp in station["Species"] or []:
+            if "recordId" in sp:
+                record_ids.setdefault(sp["recordId"])
+
+    with stage("species select"):
+        subset_species = load_species(species_path, list(record_ids))
+    subset_species["metadata"]["date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    with open(OUTPUT_STATIONS_JSON, "w") as f:
-        json.dump(subset_stations, f, indent=2)
+    with stage("json write"):
+        with open(OUTPUT_STATIONS_JSON, "w") as f:
+            json.dump(subset_stations, f, indent=2)
 
-    with open(OUTPUT_SPECIES_JSON, "w") as f:
-        json.dump(subset_species, f, indent=2)
+        with open(OUTPUT_SPECIES_JSON, "w") as f:
+            json.dump(subset_species, f, indent=2)
 
 
 if __name__ == "__main__":
-    create_subset()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--count", "-n", type=int, default=15, help="Number of stations to select"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=SELECTION_MODES,
+        default="first",
+        help="How the stations are selected",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the random and stratified modes"
+    )
+    parser.add_argument(
+        "--stratify-by",
+        choices=STRATIFY_COLUMNS,
+        default="Water body",
+        help="Column whose values the stratified mode spreads the stations over",
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("MIN_LAT", "MIN_LON", "MAX_LAT", "MAX_LON"),
+        help="Bounding box of the bbox mode, in decimal degrees "
+        "(it crosses the antimeridian if MIN_LON > MAX_LON)",
+    )
+    parser.add_argument(
+        "--stations",
+        type=pathlib.Path,
+        default=STATIONS_JSON,
+        help="Stations file, either a JSON array or JSON lines (optionally gzipped)",
+    )
+    parser.add_argument(
+        "--species",
+        type=pathlib.Path,
+        default=SPECIES_JSON,
+        help="Species file",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    if args.mode == "bbox" and args.bbox is None:
+        parser.error("--mode bbox requires --bbox")
+
+    with profile("create_test_data", args.profile):
+        create_subset(
+            args.count,
+            args.mode,
+            args.seed,
+            args.stratify_by,
+            (args.bbox[0], args.bbox[1], args.bbox[2], args.bbox[3])
+            if args.bbox
+            else None,
+            args.stations,
+            args.species,
+        )
+    timings.save(TIMINGS_PATH / "create_test_data_timings.json")
@@ -3,12 +3,19 @@ import logging
 import re
 import subprocess
 import sys
-from typing import Dict, List, Optional
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from .timing import stage, timed, timings
 
 logger = logging.getLogger("GNames")
 
 SUPPORTED_GNAMES_VERSIONS = {"gnfinder": 1.0, "gnverifier": 1.0}
 
+# Number of names sent to each gnverifier call in `verify_batch`
+VERIFY_BATCH_SIZE = 200
+
 
 class GNames:
     def __init__(self) -> None:
@@ -63,6 +70,7 @@ class GNames:
                 "Make sure you have the right version on your system."
             )
 
+    @timed("gnfinder")
     def extract(self, text: str) -> List[dict]:
         # Use gnfinder to parse species from text without verification
         with subprocess.Popen(["echo", text], stdout=subprocess.PIPE) as echo_proc:
@@ -77,6 +85,7 @@ class GNames:
 
     def verify(self, species_name: str, sources: Optional[List[str]] = None) -> dict:
         if species_name in self.species_cache:
+            timings.count("gnverifier cache hits")
             return self.species_cache[species_name]
 
         cmd = ["gnverifier", "-f", "compact", species_name]
@@ -85,7 +94,7 @@ class GNames:
 
         verified_species = {}
 
-        with subprocess.Popen(
+        with stage("gnverifier"), subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
         ) as gnverifier_proc:
@@ -99,3 +108,74 @@ class GNames:
                 self.species_cache[species_name] = verified_species
 
         return verified_species
+
+    def verify_batch(
+        self,
+        species_names: Iterable[str],
+        sources: Optional[List[str]] = None,
+        workers: int = 1,
+    ) -> Dict[str, dict]:
+        """
+        Verify many names at once. The names that are not already cached
+        are split into batches of `VERIFY_BATCH_SIZE`, and each batch is verified
+        with one gnverifier call. Up to `workers` batches run in parallel.
+
+        Parameters
+        ----------
+        species_names: names to verify (duplicates are verified once)
+        sources: Global Names data source ids to verify against
+        workers: maximum number of parallel gnverifier calls
+
+        Returns
+        -------
+        name -> verification result (empty if the name could not be verified)
+        """
+        names = list(dict.fromkeys(species_names))
+        missing_names = [name for name in names if name not in self.species_cache]
+        timings.count("gnverifier cache hits", len(names) - len(missing_names))
+
+        batches = [
+            missing_names[i : i + VERIFY_BATCH_SIZE]
+            for i in range(0, len(missing_names), VERIFY_BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max(1, workers)) as executor:
+            for batch, results in zip(
+                batches,
+                executor.map(lambda b: self._verify_names(b, sources), batches),
+            ):
+                for name in batch:
+                    if name not in results:
+                        logger.warning(f"Could not verify {name}")
+                    self.species_cache[name] = results.get(name, {})
+
+        return {name: self.species_cache[name] for name in names}
+
+    def _verify_names(
+        self, species_names: List[str], sources: Optional[List[str]] = None
+    ) -> Dict[str, dict]:
+        """
+        Verify a list of names with one gnverifier call.
+        gnverifier outputs one JSON result per line, with the input name in `name`.
+        """
+        results = {}
+
+        with stage("gnverifier batch"), tempfile.NamedTemporaryFile(
+            "w", suffix=".txt"
+        ) as names_file:
+            names_file.write("\n".join(species_names))
+            names_file.flush()
+
+            cmd = ["gnverifier", "-f", "compact", names_file.name]
+            if sources:
+                cmd.extend(["-s", ",".join(sources)])
+
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE) as gnverifier_proc:
+                if gnverifier_proc.stdout:
+                    for line in gnverifier_proc.stdout:
+                        try:
+                            result = json.loads(line)
+                        except json.decoder.JSONDecodeError:
+                            continue
+                        results[result.get("name")] = result
+
+        return results
@@ -0,0 +1,222 @@
+"""
+Packs the OCRed HathiTrust pages (`data/HathiTrust/<section>/texts/<page>.txt`)
+into one corpus file, which is memory-mapped when it is read.
+
+The pages of each section are stored back to back, separated by a newline,
+and an index maps every page to its byte offset and length in the corpus.
+A range of pages is therefore one contiguous slice of the corpus, and its text is
+the same as joining the text of its pages with newlines.
+
+The corpus is rebuilt automatically when the source pages change.
+It can also be rebuilt manually with `python -m workflows.hathitrust_corpus`.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pathlib
+from types import TracebackType
+from typing import Dict, List, Optional, Tuple, Type
+
+from .profiling import add_profile_argument, profile
+from .timing import stage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("HathiTrust Corpus")
+
+WORK_DIR = pathlib.Path("./data")
+HATHITRUST_PATH = WORK_DIR / "HathiTrust"
+CORPUS_PATH = WORK_DIR / "tmp" / "hathitrust" / "corpus.txt"
+CORPUS_INDEX_PATH = WORK_DIR / "tmp" / "hathitrust" / "corpus_index.json"
+
+PAGE_SEPARATOR = b"\n"
+
+# (offset, length) of a page or a range of pages in the corpus, in bytes
+Span = Tuple[int, int]
+
+
+def parse_pages_range(pages: str) -> Tuple[int, int]:
+    """
+    Parse a section page range, which is a string
+    in the following format: "<start>-<end>" or "<page>".
+    Returns the start and end pages (inclusive).
+    """
+    pages_range = [int(p) for p in pages.split("-")]
+    return pages_range[0], pages_range[-1]
+
+
+def list_page_files(
+    hathitrust_path: pathlib.Path = HATHITRUST_PATH,
+) -> Dict[str, List[pathlib.Path]]:
+    """
+    List the page files of each section, sorted by page number.
+    """
+    sections = {}
+    for texts_path in sorted(hathitrust_path.glob("*/texts")):
+        sections[texts_path.parent.name] = sorted(
+            (p for p in texts_path.glob("*.txt") if p.stem.isdigit()),
+            key=lambda p: int(p.stem),
+        )
+    return sections
+
+
+def fingerprint_pages(sections: Dict[str, List[pathlib.Path]]) -> str:
+    """
+    Hash the names, sizes and modification times of the page files.
+    Any added, removed or edited page changes the fingerprint.
+    """
+    sha = hashlib.sha256()
+    for section, page_files in sections.items():
+        for page_file in page_files:
+            stat = os.stat(page_file)
+            page_key = f"{section}/{page_file.name}"
+            sha.update(f"{page_key}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()
+
+
+def build_corpus(
+    hathitrust_path: pathlib.Path = HATHITRUST_PATH,
+    corpus_path: pathlib.Path = CORPUS_PATH,
+    index_path: pathlib.Path = CORPUS_INDEX_PATH,
+) -> None:
+    """
+    Pack the pages of all sections into `corpus_path`
+    and save the page offsets in `index_path`.
+    """
+    sections = list_page_files(hathitrust_path)
+    index: Dict[str, Dict[str, Span]] = {}
+    offset = 0
+
+    corpus_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(corpus_path, "wb") as corpus:
+        for section, page_files in sections.items():
+            logger.info(f"Packing {len(page_files)} pages of {section}")
+            section_index = index.setdefault(section, {})
+            for page_file in page_files:
+                # Read in text mode, so line endings are normalized
+                # the same way as when the pages are read individually.
+                with open(page_file, "r") as f:
+                    page = f.read().encode("utf-8")
+                corpus.write(page)
+                corpus.write(PAGE_SEPARATOR)
+                section_index[str(int(page_file.stem))] = (offset, len(page))
+                offset += len(page) + len(PAGE_SEPARATOR)
+
+    with open(index_path, "w") as f:
+        json.dump({"fingerprint": fingerprint_pages(sections), "sections": index}, f)
+
+    logger.info(f"Saved the HathiTrust corpus ({offset} bytes) to {corpus_path}")
+
+
+class HathiTrustCorpus:
+    """
+    Read-only, memory-mapped view of the packed HathiTrust pages.
+    Pages are identified by their section and file number, i.e. `<page>.txt`.
+    """
+
+    def __init__(
+        self,
+        corpus_path: pathlib.Path = CORPUS_PATH,
+        index_path: pathlib.Path = CORPUS_INDEX_PATH,
+    ):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+
+        self.pages: Dict[str, Dict[int, Span]] = {
+            section: {int(page): (span[0], span[1]) for page, span in pages.items()}
+            for section, pages in index["sections"].items()
+        }
+
+        self._file = open(corpus_path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap: Optional[mmap.mmap] = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+            self.buffer = memoryview(self._mmap)
+        else:
+            # Empty files cannot be memory-mapped.
+            self._mmap = None
+            self.buffer = memoryview(b"")
+
+    @classmethod
+    def load(
+        cls,
+        hathitrust_path: pathlib.Path = HATHITRUST_PATH,
+        corpus_path: pathlib.Path = CORPUS_PATH,
+        index_path: pathlib.Path = CORPUS_INDEX_PATH,
+    ) -> "HathiTrustCorpus":
+        """
+        Open the corpus, building it first if it is missing or out of date.
+        """
+        with stage("corpus check"):
+            up_to_date = False
+            if corpus_path.exists() and index_path.exists():
+                with open(index_path, "r") as f:
+                    fingerprint = json.load(f).get("fingerprint")
+                up_to_date = fingerprint == fingerprint_pages(
+                    list_page_files(hathitrust_path)
+                )
+
+        if not up_to_date:
+            with stage("corpus build"):
+                build_corpus(hathitrust_path, corpus_path, index_path)
+
+        return cls(corpus_path, index_path)
+
+    def close(self) -> None:
+        self.buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "HathiTrustCorpus":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def page_span(self, section: str, page: int) -> Optional[Span]:
+        return self.pages.get(section, {}).get(page)
+
+    def page_spans(self, section: str, start: int, end: int) -> List[Span]:
+        """
+        Return the spans of the existing pages between `start` and `end` (inclusive).
+        """
+        section_pages = self.pages.get(section, {})
+        return [section_pages[p] for p in range(start, end + 1) if p in section_pages]
+
+    def range_span(self, section: str, start: int, end: int) -> Optional[Span]:
+        """
+        Return the span of the existing pages between `start` and `end` (inclusive),
+        or None if none of them exist.
+        """
+        spans = self.page_spans(section, start, end)
+        if not spans:
+            return None
+        return spans[0][0], spans[-1][0] + spans[-1][1] - spans[0][0]
+
+    def slice(self, span: Span) -> memoryview:
+        """
+        Zero-copy view of the given span.
+        """
+        offset, length = span
+        return self.buffer[offset : offset + length]
+
+    def text(self, span: Span) -> str:
+        return str(self.slice(span), "utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile("hathitrust_corpus", args.profile):
+        build_corpus()
@@ -0,0 +1,235 @@
+"""
+Inverted indexes of the species found in the summary report index and the stations.
+
+`python -m workflows.inverted_indexes` reads the pages of every genus and species
+of `index_species.json` and the species of every station of `stations.json`, and
+saves the following maps in `data/Oceans1876/inverted_indexes.npz`:
+- page -> record ids
+- record id -> pages
+- record id -> stations
+- station -> record ids
+
+Record ids and stations are numbered by their sorted position in `record_ids` and
+`stations`, and each map is saved in compressed sparse row form: the values of
+key `k` are `values[offsets[k]:offsets[k + 1]]`, sorted.
+"""
+import argparse
+import json
+import logging
+import pathlib
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from .jsonl import iter_records
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Inverted Indexes")
+
+WORK_DIR = pathlib.Path("./data")
+INDEX_SPECIES_PATH = WORK_DIR / "Oceans1876" / "index_species.json"
+STATIONS_PATH = WORK_DIR / "Oceans1876" / "stations.json"
+INVERTED_INDEXES_PATH = WORK_DIR / "Oceans1876" / "inverted_indexes.npz"
+
+MAPS = ["page_records", "record_pages", "record_stations", "station_records"]
+
+
+def csr(
+    keys: np.ndarray, values: np.ndarray, keys_count: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group the distinct (key, value) pairs by key, with keys in `range(keys_count)`.
+
+    Returns
+    -------
+    offsets (of length `keys_count + 1`) and sorted values
+    """
+    pairs = np.unique(np.stack((keys, values), axis=1), axis=0).reshape(-1, 2)
+    offsets = np.searchsorted(pairs[:, 0], np.arange(keys_count + 1))
+    return offsets.astype(np.int32), pairs[:, 1].astype(np.int32)
+
+
+def index_species_pages(
+    path: pathlib.Path = INDEX_SPECIES_PATH,
+) -> List[Tuple[int, str]]:
+    """
+    Return the (page, record id) pairs of the matched genera and species
+    of the summary report index.
+    """
+    with open(path, "r") as f:
+        genera = json.load(f)["species"]
+
+    pairs = []
+    for genus in genera:
+        for taxon in [genus, *(genus.get("species") or [])]:
+            if taxon.get("matched_species"):
+                for page in taxon.get("pages") or []:
+                    pairs.append((int(page), taxon["matched_species"]))
+    return pairs
+
+
+def stations_records(stations: Iterable[dict]) -> List[Tuple[str, str]]:
+    """
+    Return the (station, record id) pairs of the stations' verified species.
+    """
+    return [
+        (station["Station"], sp["recordId"])
+        for station in stations
+        for sp in station.get("Species") or []
+        if sp.get("recordId")
+    ]
+
+
+class InvertedIndexes:
+    """
+    Page, record id and station lookups (see the module docstring for the layout).
+    """
+
+    def __init__(
+        self,
+        record_ids: np.ndarray,
+        stations: np.ndarray,
+        pages: np.ndarray,
+        maps: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    ):
+        self.record_ids = record_ids
+        self.stations = stations
+        self.pages = pages
+        self.maps = maps
+
+    @classmethod
+    def build(
+        cls,
+        page_records: List[Tuple[int, str]],
+        station_records: List[Tuple[str, str]],
+    ) -> "InvertedIndexes":
+        page_numbers = np.array([p for p, _ in page_records], dtype=np.int32)
+        page_record_ids = np.array([r for _, r in page_records], dtype=str)
+        station_names = np.array([s for s, _ in station_records], dtype=str)
+        station_record_ids = np.array([r for _, r in station_records], dtype=str)
+
+        record_ids = np.union1d(page_record_ids, station_record_ids)
+        stations = np.unique(station_names)
+        pages = np.unique(page_numbers)
+
+        page_keys = np.searchsorted(pages, page_numbers)
+        page_records_keys = np.searchsorted(record_ids, page_record_ids)
+        station_keys = np.searchsorted(stations, station_names)
+        station_records_keys = np.searchsorted(record_ids, station_record_ids)
+
+        return cls(
+            record_ids,
+            stations,
+            pages,
+            {
+                "page_records": csr(page_keys, page_records_keys, len(pages)),
+                "record_pages": csr(page_records_keys, page_keys, len(record_ids)),
+                "record_stations": csr(
+                    station_records_keys, station_keys, len(record_ids)
+                ),
+                "station_records": csr(
+                    station_keys, station_records_keys, len(stations)
+                ),
+            },
+        )
+
+    @classmethod
+    def load(cls, path: pathlib.Path = INVERTED_INDEXES_PATH) -> "InvertedIndexes":
+        with np.load(path) as indexes:
+            return cls(
+                indexes["record_ids"],
+                indexes["stations"],
+                indexes["pages"],
+                {
+                    name: (indexes[f"{name}_offsets"], indexes[f"{name}_values"])
+                    for name in MAPS
+                },
+            )
+
+    def save(self, path: pathlib.Path = INVERTED_INDEXES_PATH) -> None:
+        arrays = {}
+        for name, (offsets, values) in self.maps.items():
+            arrays[f"{name}_offsets"] = offsets
+            arrays[f"{name}_values"] = values
+        np.savez_compressed(
+            path,
+            record_ids=self.record_ids,
+            stations=self.stations,
+            pages=self.pages,
+            **arrays,
+        )
+
+    def _lookup(self, name: str, keys: np.ndarray, key: Union[int, str]) -> np.ndarray:
+        """
+        Return the values of `key` in map `name`, whose keys are `keys`,
+        as indices (empty if `key` is not in `keys`).
+        """
+        offsets, values = self.maps[name]
+        position = int(np.searchsorted(keys, key))
+        if position == len(keys) or keys[position] != key:
+            return values[:0]
+        return values[offsets[position] : offsets[position + 1]]
+
+    def page_records(self, page: int) -> np.ndarray:
+        """
+        Return the record ids of the genera and species mentioned on `page`.
+        """
+        return self.record_ids[self._lookup("page_records", self.pages, page)]
+
+    def record_pages(self, record_id: str) -> np.ndarray:
+        """
+        Return the pages of the summary report where `record_id` is mentioned.
+        """
+        return self.pages[self._lookup("record_pages", self.record_ids, record_id)]
+
+    def record_stations(self, record_id: str) -> np.ndarray:
+        """
+        Return the stations where `record_id` was found.
+        """
+        return self.stations[
+            self._lookup("record_stations", self.record_ids, record_id)
+        ]
+
+    def station_records(self, station: str) -> np.ndarray:
+        """
+        Return the record ids of the species found in `station`.
+        """
+        return self.record_ids[self._lookup("station_records", self.stations, station)]
+
+
+def build_inverted_indexes(
+    index_species_path: pathlib.Path = INDEX_SPECIES_PATH,
+    stations_path: pathlib.Path = STATIONS_PATH,
+) -> None:
+    with stage("json read"):
+        page_records = index_species_pages(index_species_path)
+        station_records = stations_records(iter_records(stations_path))
+
+    with stage("index build"):
+        indexes = InvertedIndexes.build(page_records, station_records)
+
+    with stage("index write"):
+        indexes.save()
+
+    logger.info(
+        f"Indexed {len(indexes.record_ids)} record ids over {len(indexes.pages)} "
+        f"pages and {len(indexes.stations)} stations"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stations",
+        type=pathlib.Path,
+        default=STATIONS_PATH,
+        help="Stations file, either a JSON array or JSON lines (optionally gzipped)",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile("inverted_indexes", args.profile):
+        build_inverted_indexes(stations_path=args.stations)
+    timings.save(TIMINGS_PATH / "inverted_indexes_timings.json")
@@ -0,0 +1,173 @@
+"""
+Streaming reader and writer for large JSON files, e.g. `stations.json` and
+`species.json`, so they can be processed record by record with bounded memory.
+
+`JSONStreamReader` walks the top levels of a document (arrays and objects) and
+decodes their members one at a time. `JSONStreamWriter` writes the same layout as
+`json.dump(..., indent=...)`, one member at a time.
+"""
+import json
+from typing import Any, Iterator, List, TextIO, Tuple
+
+CHUNK_SIZE = 1 << 16
+
+NUMBER_DELIMITERS = ",]} \t\r\n"
+
+_decoder = json.JSONDecoder()
+
+
+class JSONStreamReader:
+    """
+    Reads a JSON document incrementally from a text file.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Read the next chunk into the buffer, dropping what has been consumed.
+        Returns False at the end of the file.
+        """
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Return the next non-whitespace character without consuming it,
+        or "" at the end of the file.
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return self._buffer[self._pos : self._pos + 1]
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r}, found {found!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """
+        Decode the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk.
+                if not self._fill():
+                    raise
+                continue
+            # A number is only complete if it is followed by a delimiter,
+            # e.g. "2." may continue as "2.5" in the next chunk.
+            incomplete = end == len(self._buffer) or (
+                isinstance(value, (int, float))
+                and self._buffer[end] not in NUMBER_DELIMITERS
+            )
+            if incomplete and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _members(self, closing: str) -> Iterator[None]:
+        """
+        Yield before each member of the current array or object,
+        and consume the separators and the closing bracket.
+        """
+        if self.peek() == closing:
+            self._pos += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self._pos += 1
+            if separator == closing:
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or {closing!r}, found {separator!r}")
+
+    def iter_array(self) -> Iterator[Any]:
+        """
+        Decode the items of the next array one at a time.
+        """
+        self.expect("[")
+        for _ in self._members("]"):
+            yield self.value()
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Yield the keys of the next object. The caller must consume the value of
+        each key (e.g. with `value` or `iter_object`) before asking for the next one.
+        """
+        self.expect("{")
+        for _ in self._members("}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+
+class JSONStreamWriter:
+    """
+    Writes a JSON document incrementally, with the same layout
+    as `json.dump(..., indent=indent)`.
+    """
+
+    def __init__(self, f: TextIO, indent: int = 4):
+        self._file = f
+        self._indent = " " * indent
+        # (closing bracket, number of members written) of the open containers
+        self._stack: List[Tuple[str, int]] = []
+
+    def _start_member(self, key: Any = None) -> None:
+        if not self._stack:
+            return
+        closing, count = self._stack[-1]
+        self._stack[-1] = (closing, count + 1)
+        self._file.write(("," if count else "") + "\n")
+        self._file.write(self._indent * len(self._stack))
+        if closing == "}":
+            self._file.write(f"{json.dumps(key)}: ")
+
+    def begin_array(self, key: Any = None) -> None:
+        self._start_member(key)
+        self._file.write("[")
+        self._stack.append(("]", 0))
+
+    def begin_object(self, key: Any = None) -> None:
+        self._start_member(key)
+        self._file.write("{")
+        self._stack.append(("}", 0))
+
+    def end(self) -> None:
+        closing, count = self._stack.pop()
+        if count:
+            self._file.write("\n" + self._indent * len(self._stack))
+        self._file.write(closing)
+
+    def value(self, value: Any, key: Any = None) -> None:
+        """
+        Write a member of the current container (`key` is required in objects),
+        or the whole document if no container is open.
+        """
+        self._start_member(key)
+        # Strings are escaped, so the only newlines are the ones added by `indent`.
+        self._file.write(
+            json.dumps(value, indent=len(self._indent)).replace(
+                "\n", "\n" + self._indent * len(self._stack)
+            )
+        )
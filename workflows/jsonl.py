@@ -0,0 +1,152 @@
+"""
+JSON lines files with a side index, for streaming or random access by key.
+
+`<name>.jsonl` holds one JSON record per line, and `<name>.jsonl.index.json` maps
+the key of each record (e.g. the station name) to its byte offset and length.
+
+In compressed files (`<name>.jsonl.gz`) every record is a separate gzip member.
+The file as a whole is still a valid gzip stream of JSON lines, and each record can
+be decompressed on its own from its offset.
+"""
+import gzip
+import json
+import pathlib
+from types import TracebackType
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+import pandas as pd
+
+from .json_stream import JSONStreamReader
+
+# (offset, length) of a record in a JSON lines file, in bytes
+Span = Tuple[int, int]
+
+GZIP_COMPRESS_LEVEL = 6
+
+
+def index_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(f"{path.name}.index.json")
+
+
+def is_compressed(path: pathlib.Path) -> bool:
+    return path.suffix == ".gz"
+
+
+def dataframe_records(df: pd.DataFrame, key_column: str) -> Iterator[Tuple[str, str]]:
+    """
+    Serialize the rows of `df` with a single `to_json` call,
+    and pair each of them with its value in `key_column`.
+    """
+    if df.empty:
+        return iter(())
+    records = df.to_json(orient="records", lines=True).rstrip("\n").split("\n")
+    return zip(df[key_column], records)
+
+
+def write_jsonl(
+    path: pathlib.Path, records: Iterable[Tuple[str, str]], compress: bool = False
+) -> None:
+    """
+    Write the records to `path`, one per line, and save their offsets
+    in the side index.
+
+    Parameters
+    ----------
+    path: the JSON lines file
+    records: (key, record serialized as JSON on a single line)
+    compress: compress every record as a separate gzip member
+    """
+    index: Dict[str, Span] = {}
+    offset = 0
+    with open(path, "wb") as f:
+        for key, record in records:
+            line = record.encode("utf-8") + b"\n"
+            if compress:
+                line = gzip.compress(line, GZIP_COMPRESS_LEVEL, mtime=0)
+            f.write(line)
+            index[key] = (offset, len(line))
+            offset += len(line)
+
+    with open(index_path(path), "w") as f:
+        json.dump(index, f)
+
+
+class JSONLinesReader:
+    """
+    Reads the records of a JSON lines file written by `write_jsonl`,
+    either all in order or by key. Files with a `.gz` suffix are decompressed.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.compressed = is_compressed(path)
+        with open(index_path(path), "r") as f:
+            self.index: Dict[str, Span] = {
+                key: (span[0], span[1]) for key, span in json.load(f).items()
+            }
+        self._file = open(path, "rb")
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "JSONLinesReader":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __iter__(self) -> Iterator[Any]:
+        """
+        Stream all the records, in the file order.
+        """
+        yield from iter_jsonl(self.path)
+
+    def keys(self) -> List[str]:
+        return list(self.index)
+
+    def get(self, key: str) -> Any:
+        """
+        Read the record with the given key.
+
+        Raises
+        ------
+        KeyError: if there is no record with the given key
+        """
+        offset, length = self.index[key]
+        self._file.seek(offset)
+        line = self._file.read(length)
+        if self.compressed:
+            line = gzip.decompress(line)
+        return json.loads(line)
+
+
+def iter_jsonl(path: pathlib.Path) -> Iterator[Any]:
+    """
+    Stream the records of a JSON lines file, decompressing it if it ends in `.gz`.
+    """
+    with (gzip.open(path, "rb") if is_compressed(path) else open(path, "rb")) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def iter_records(path: pathlib.Path) -> Iterator[Any]:
+    """
+    Stream the records of either a JSON lines file or a JSON array file
+    (e.g. the legacy `stations.json`).
+    """
+    if ".jsonl" in path.suffixes:
+        yield from iter_jsonl(path)
+    else:
+        with open(path, "r") as f:
+            yield from JSONStreamReader(f).iter_array()
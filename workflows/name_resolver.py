@@ -0,0 +1,223 @@
+"""
+Local resolver of the names verified in the stations, which are often found again
+in the summary report index.
+
+A name is resolved locally if its normalized canonical name is the canonical name
+of a verified species of `species.json` (written by the upstream stages, never by
+the summary report index workflow); otherwise it is left to gnverifier.
+
+With `fuzzy`, the names are also kept in a BK-tree, which finds the names within a
+small edit (Levenshtein) distance of a name without comparing it with all of them.
+As names one letter apart are often different taxa, a name is only resolved to a
+near name if that name is the only nearest one, and has the same genus if the name
+is a binomial. Every fuzzy match is logged.
+"""
+import json
+import logging
+import pathlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .timing import timings
+
+logger = logging.getLogger("Name Resolver")
+
+WORK_DIR = pathlib.Path("./data")
+VERIFIED_SPECIES_PATHS = [WORK_DIR / "Oceans1876" / "species.json"]
+
+# (minimum name length, maximum edit distance) of the fuzzy matches, longest first.
+# Shorter names are only resolved by exact matches.
+MAX_DISTANCES = [(15, 2), (6, 1)]
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+def max_distance(name: str) -> int:
+    for min_length, distance in MAX_DISTANCES:
+        if len(name) >= min_length:
+            return distance
+    return 0
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """
+    BK-tree of strings under the Levenshtein distance. Every node keeps its children
+    by their distance to it, so a search within distance d of a string s only visits
+    the children whose distance is within d of the node's distance to s.
+    """
+
+    def __init__(self) -> None:
+        # node: (word, children by distance)
+        self._root: Optional[Tuple[str, Dict[int, Any]]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, word: str) -> None:
+        if self._root is None:
+            self._root = (word, {})
+            self._size = 1
+            return
+
+        node = self._root
+        while True:
+            distance = levenshtein(word, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (word, {})
+                self._size += 1
+                return
+            node = node[1][distance]
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        Return the (distance, word) of the words within `max_distance` of `word`,
+        nearest first.
+        """
+        if self._root is None:
+            return []
+
+        found = []
+        nodes = [self._root]
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = levenshtein(word, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        return sorted(found)
+
+
+class LocalNameResolver:
+    """
+    Resolves names to the verification results (`bestResult`) of the same
+    verified names, or with `fuzzy`, of the nearest one. It is thread-safe.
+    """
+
+    def __init__(self, fuzzy: bool = False) -> None:
+        self.fuzzy = fuzzy
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        # normalized canonical name -> best result
+        self._results: Dict[str, dict] = {}
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    @classmethod
+    def from_files(
+        cls, paths: List[pathlib.Path] = VERIFIED_SPECIES_PATHS, fuzzy: bool = False
+    ) -> "LocalNameResolver":
+        """
+        Load the verified species of the files, if they exist: whole verifications
+        (`species.json`) or best results (`index_species_verified.json`).
+        """
+        resolver = cls(fuzzy)
+        for path in paths:
+            if not path.exists():
+                continue
+            with open(path, "r") as f:
+                species = json.load(f)["species"]
+            for result in species.values():
+                resolver.add(result.get("bestResult", result))
+        logger.info(f"Loaded {len(resolver)} verified names")
+        return resolver
+
+    def add(self, best_result: Dict[str, Any]) -> None:
+        """
+        Add a verified name, unless its canonical name is already known.
+        """
+        name = best_result.get("matchedCanonicalSimple")
+        if not name or not best_result.get("recordId"):
+            return
+        key = normalize_name(name)
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = best_result
+                if self.fuzzy:
+                    self._tree.add(key)
+
+    def _fuzzy_match(self, key: str) -> Optional[Tuple[int, str]]:
+        """
+        Return the (distance, name) of the verified name nearest to `key`, if it is
+        the only nearest one and, for a binomial `key`, has the same genus.
+        """
+        matches = self._tree.search(key, max_distance(key))
+        if not matches or (len(matches) > 1 and matches[1][0] == matches[0][0]):
+            return None
+        distance, word = matches[0]
+        genus = key.split()[0]
+        if " " in key and word.split()[0] != genus:
+            return None
+        return distance, word
+
+    def resolve(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a verification (with `bestResult`, like gnverifier's) of `name`,
+        or None if it was not verified (and, with `fuzzy`, has no single nearest
+        verified name of the same genus).
+        """
+        key = normalize_name(name)
+        with self._lock:
+            match = (0, key) if key in self._results else None
+            if match is None and self.fuzzy:
+                match = self._fuzzy_match(key)
+            if match is None:
+                self.misses += 1
+                timings.count("local resolver misses")
+                return None
+            distance, word = match
+            self.hits += 1
+            timings.count("local resolver hits")
+            if distance:
+                self.fuzzy_hits += 1
+                timings.count("local resolver fuzzy hits")
+            best_result = self._results[word]
+
+        if distance:
+            logger.info(
+                f"Fuzzy match: {name} -> {best_result['matchedCanonicalSimple']} "
+                f"({best_result['recordId']}, distance {distance})"
+            )
+        return {
+            "name": name,
+            "matchType": "Fuzzy" if distance else "Exact",
+            "editDistance": distance,
+            "bestResult": best_result,
+        }
+
+    def log_hit_rate(self) -> None:
+        total = self.hits + self.misses
+        if total:
+            logger.info(
+                f"Resolved {self.hits} of {total} names locally "
+                f"({self.hits / total:.1%}, {self.fuzzy_hits} fuzzy), "
+                f"{self.misses} sent to gnverifier"
+            )
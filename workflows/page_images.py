@@ -0,0 +1,335 @@
+"""
+Loading of the page images of the summary report index.
+
+`prefetch_pages` decodes the next pages in background threads (OpenCV releases
+the GIL while decoding), while the current page is processed. The time the
+processing waits for a page is reported as the "image decode wait" stage.
+
+`PageImageStore` keeps the cropped, grayscale pages in one uint8 file
+(`data/tmp/page_images/pages.u8`), which is memory-mapped, so the pages are
+read without decoding the PNGs and are shared by all the processes reading them
+through the OS page cache. The offset and shape of each page are saved in
+`pages_index.json`. `python -m workflows.page_images build` builds the store,
+and it is rebuilt when it is loaded if the PNGs have changed. The store is built
+and loaded under a lock (`pages.u8.lock`), so the processes sharing it (e.g. the
+shards of `process-species`) build it only once, and never read it half-written.
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import cv2 as cv
+import numpy as np
+
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Page Images")
+
+WORK_DIR = pathlib.Path("./data")
+PAGE_IMAGES_PATH = WORK_DIR / "HathiTrust" / "sec.6 v.2" / "images"
+PAGE_STORE_PATH = WORK_DIR / "tmp" / "page_images" / "pages.u8"
+PAGE_STORE_INDEX_PATH = WORK_DIR / "tmp" / "page_images" / "pages_index.json"
+
+# The pages of the summary report index
+INDEX_PAGES = range(739, 849)
+
+# Margins (top, bottom, left, right) of white space cropped from the pages
+PAGE_CROP = (350, 350, 200, 150)
+
+# Number of pages decoded ahead of the processed one
+PREFETCH_PAGES = 2
+# Maximum size of the decoded pages held at once (processed and prefetched)
+PREFETCH_MAX_BYTES = 512 * 1024 * 1024
+
+
+def read_page_image(
+    page_number: int, images_path: pathlib.Path = PAGE_IMAGES_PATH
+) -> Optional[np.ndarray]:
+    """
+    Decode the (BGR) image of the page, or return None if it cannot be read.
+    """
+    with stage("image decode"):
+        return cv.imread(str(images_path / f"{page_number:08}.png"))
+
+
+def crop_page(img: np.ndarray) -> np.ndarray:
+    """
+    Remove part of the white space on the edges.
+    """
+    top, bottom, left, right = PAGE_CROP
+    h, w = img.shape[:2]
+    return img[top : h - bottom, left : w - right]
+
+
+def read_cropped_page(
+    page_number: int, images_path: pathlib.Path = PAGE_IMAGES_PATH
+) -> Optional[np.ndarray]:
+    img = read_page_image(page_number, images_path)
+    return None if img is None else crop_page(img)
+
+
+def prefetch_pages(
+    page_numbers: Sequence[int],
+    load: Callable[[int], Optional[np.ndarray]] = read_page_image,
+    prefetch: int = PREFETCH_PAGES,
+    max_bytes: int = PREFETCH_MAX_BYTES,
+) -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+    """
+    Yield the page numbers and their images, in order, loading up to `prefetch`
+    pages ahead in background threads.
+
+    Parameters
+    ----------
+    page_numbers: the pages to load
+    load: loads the image of a page
+    prefetch: number of pages loaded ahead (0 loads each page when it is needed)
+    max_bytes: the pages are not loaded ahead if, estimated with the largest page so
+        far, the pages held at once would take more memory than this
+        (the next page is always loaded ahead)
+    """
+    if prefetch <= 0:
+        for page_number in page_numbers:
+            with stage("image decode wait"):
+                img = load(page_number)
+            yield page_number, img
+        return
+
+    pending: Deque[Tuple[int, Future]] = deque()
+    next_page = 0
+    page_bytes = 0
+
+    def fill(executor: ThreadPoolExecutor, held: int) -> None:
+        nonlocal next_page
+        while (
+            next_page < len(page_numbers)
+            and len(pending) < prefetch + 1 - held
+            and (not pending or (len(pending) + 1 + held) * page_bytes <= max_bytes)
+        ):
+            page_number = page_numbers[next_page]
+            pending.append((page_number, executor.submit(load, page_number)))
+            next_page += 1
+
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        try:
+            fill(executor, 0)
+            while pending:
+                page_number, future = pending.popleft()
+                with stage("image decode wait"):
+                    img = future.result()
+                if img is not None:
+                    page_bytes = max(page_bytes, img.nbytes)
+                # Load the next pages while this one is processed.
+                fill(executor, 1)
+                yield page_number, img
+                del img
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def fingerprint_page_images(
+    page_numbers: Iterable[int], images_path: pathlib.Path = PAGE_IMAGES_PATH
+) -> str:
+    """
+    Hash the page numbers, and the sizes and modification times of their images.
+    """
+    sha = hashlib.sha256()
+    for page_number in page_numbers:
+        image_path = images_path / f"{page_number:08}.png"
+        if image_path.exists():
+            stat = os.stat(image_path)
+            sha.update(f"{page_number}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        else:
+            sha.update(f"{page_number}:missing\n".encode())
+    return sha.hexdigest()
+
+
+@contextmanager
+def page_store_lock(store_path: pathlib.Path = PAGE_STORE_PATH) -> Iterator[None]:
+    """
+    Hold an exclusive lock of the store, shared by all the processes using it.
+    """
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(store_path.with_name(f"{store_path.name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def replace_atomically(path: pathlib.Path, mode: str = "wb") -> Iterator[IO[Any]]:
+    """
+    Yield a temporary file next to `path`, which then replaces `path`.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def page_store_up_to_date(
+    page_numbers: Sequence[int] = INDEX_PAGES,
+    images_path: pathlib.Path = PAGE_IMAGES_PATH,
+    store_path: pathlib.Path = PAGE_STORE_PATH,
+    index_path: pathlib.Path = PAGE_STORE_INDEX_PATH,
+) -> bool:
+    if not store_path.exists() or not index_path.exists():
+        return False
+    with open(index_path, "r") as f:
+        fingerprint = json.load(f).get("fingerprint")
+    return fingerprint == fingerprint_page_images(page_numbers, images_path)
+
+
+def build_page_store(
+    page_numbers: Sequence[int] = INDEX_PAGES,
+    images_path: pathlib.Path = PAGE_IMAGES_PATH,
+    store_path: pathlib.Path = PAGE_STORE_PATH,
+    index_path: pathlib.Path = PAGE_STORE_INDEX_PATH,
+) -> None:
+    """
+    Decode, crop and convert the pages to grayscale, and save them in `store_path`,
+    with their offsets and shapes in `index_path`.
+
+    Both files are replaced atomically, the index last. The caller must hold
+    `page_store_lock`.
+    """
+    pages: Dict[str, List[int]] = {}
+    offset = 0
+
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    with replace_atomically(store_path) as f:
+        for page_number, img in prefetch_pages(
+            page_numbers, lambda p: read_cropped_page(p, images_path)
+        ):
+            if img is None:
+                logger.warning(f"Could not read the image of page {page_number}")
+                continue
+            with stage("grayscale"):
+                img_gray = np.ascontiguousarray(cv.cvtColor(img, cv.COLOR_BGR2GRAY))
+            f.write(img_gray.tobytes())
+            pages[str(page_number)] = [offset, *img_gray.shape]
+            offset += img_gray.nbytes
+
+    with replace_atomically(index_path, "w") as f:
+        json.dump(
+            {
+                "fingerprint": fingerprint_page_images(page_numbers, images_path),
+                "pages": pages,
+            },
+            f,
+        )
+
+    logger.info(f"Saved {len(pages)} pages ({offset} bytes) to {store_path}")
+
+
+class PageImageStore:
+    """
+    Read-only, memory-mapped view of the cropped grayscale pages.
+    """
+
+    def __init__(
+        self,
+        store_path: pathlib.Path = PAGE_STORE_PATH,
+        index_path: pathlib.Path = PAGE_STORE_INDEX_PATH,
+    ):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+
+        # page number -> (offset, height, width)
+        self.pages: Dict[int, Tuple[int, int, int]] = {
+            int(page): (offset, height, width)
+            for page, (offset, height, width) in index["pages"].items()
+        }
+        # Empty files cannot be memory-mapped.
+        self.buffer: np.ndarray = (
+            np.memmap(store_path, dtype=np.uint8, mode="r")
+            if os.stat(store_path).st_size
+            else np.empty(0, dtype=np.uint8)
+        )
+
+    @classmethod
+    def load(
+        cls,
+        page_numbers: Sequence[int] = INDEX_PAGES,
+        images_path: pathlib.Path = PAGE_IMAGES_PATH,
+        store_path: pathlib.Path = PAGE_STORE_PATH,
+        index_path: pathlib.Path = PAGE_STORE_INDEX_PATH,
+    ) -> "PageImageStore":
+        """
+        Open the store, building it first if it is missing or out of date.
+        """
+        with page_store_lock(store_path):
+            with stage("page store check"):
+                up_to_date = page_store_up_to_date(
+                    page_numbers, images_path, store_path, index_path
+                )
+
+            if not up_to_date:
+                with stage("page store build"):
+                    build_page_store(page_numbers, images_path, store_path, index_path)
+
+            # The memory map keeps the file it was opened with, even if it is
+            # replaced later.
+            return cls(store_path, index_path)
+
+    def __contains__(self, page_number: int) -> bool:
+        return page_number in self.pages
+
+    def page(self, page_number: int) -> Optional[np.ndarray]:
+        """
+        Return a (height, width) view of the cropped grayscale page,
+        or None if it is not in the store.
+        """
+        if page_number not in self.pages:
+            return None
+        offset, height, width = self.pages[page_number]
+        return self.buffer[offset : offset + height * width].reshape(height, width)
+
+    def iter_pages(
+        self, page_numbers: Iterable[int]
+    ) -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+        for page_number in page_numbers:
+            yield page_number, self.page(page_number)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build", help="Save the cropped grayscale pages in the memory-mapped store"
+    )
+    add_profile_argument(build_parser)
+    args = parser.parse_args()
+
+    with profile("page_images_build", args.profile), page_store_lock():
+        build_page_store()
+    timings.save(TIMINGS_PATH / "page_images_timings.json")
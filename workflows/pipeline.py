@@ -0,0 +1,400 @@
+"""
+Runs the workflows in dependency order, skipping the ones that are up to date.
+
+Every stage declares the files it reads and writes, and the stages it runs after:
+
+    process_stations -> remove_invalid_species -> create_test_data
+                                               -> plymouth_update
+    update_data_sources, remove_invalid_species -> species_index_process
+        -> species_index_verify -> species_index_extra
+    plymouth_clean
+    species_index_extra, remove_invalid_species, plymouth_* -> taxonomy_store
+    species_index_verify, remove_invalid_species -> inverted_indexes
+
+A stage is up to date if its command and the content hashes of its inputs are the
+same as after its last successful run, and all its outputs exist. The hashes are
+saved in `data/tmp/pipeline_state.json`, along with the size and modification
+time of every hashed file, so unchanged files are not hashed again.
+The inputs are hashed after the stage runs, as some stages update their inputs in
+place (e.g. `remove_invalid_species`).
+
+Stages run in their own process (`python -m workflows.<module>`), and the stages
+that do not depend on each other run in parallel. The duration of every stage is
+saved in `data/tmp/pipeline_timings.json`. With `run --profile`, every stage runs
+with `--profile`, and saves its own profile in `data/tmp/profiles`.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Sequence, Set
+
+from .timing import stage, timings
+from .utils import hash_file
+
+logger = logging.getLogger("Pipeline")
+
+WORK_DIR = pathlib.Path("./data")
+STATE_PATH = WORK_DIR / "tmp" / "pipeline_state.json"
+TIMINGS_PATH = WORK_DIR / "tmp" / "pipeline_timings.json"
+
+
+class Stage(NamedTuple):
+    name: str
+    module: str
+    args: List[str]
+    # Glob patterns, relative to the project root
+    inputs: List[str]
+    outputs: List[str]
+    dependencies: List[str] = []
+    # Stages with remote inputs always run (they only fetch what has changed).
+    always_run: bool = False
+
+    @property
+    def command(self) -> List[str]:
+        return [sys.executable, "-m", f"workflows.{self.module}", *self.args]
+
+
+STAGES = [
+    Stage(
+        "update_data_sources",
+        "update_data_sources",
+        [],
+        inputs=[],
+        outputs=["data/Oceans1876/data_sources.json"],
+        always_run=True,
+    ),
+    Stage(
+        "process_stations",
+        "process_stations",
+        [],
+        inputs=[
+            "data/HathiTrust/stations.csv",
+            "data/HathiTrust/*/texts/*.txt",
+            "data/RAMM/stations.csv",
+        ],
+        outputs=[
+            "data/Oceans1876/stations.json",
+            "data/Oceans1876/species.json",
+            "data/Oceans1876/stations_manifest.json",
+            "data/Oceans1876/temperature_profiles.npz",
+            "data/Oceans1876/stations_spatial_index.npz",
+        ],
+    ),
+    Stage(
+        "remove_invalid_species",
+        "remove_invalid_species",
+        [],
+        inputs=[
+            "data/Oceans1876/invalid_species_names.json",
+            "data/Oceans1876/stations.json",
+            "data/Oceans1876/species.json",
+        ],
+        outputs=["data/Oceans1876/remove_invalid_species_report.json"],
+        dependencies=["process_stations"],
+    ),
+    Stage(
+        "species_index_process",
+        "process_summary_report_species_index",
+        ["process-species"],
+        # The names verified in the stations (species.json) are resolved locally.
+        # The stage's own outputs are not inputs, or it would never be up to date.
+        inputs=[
+            "data/Oceans1876/data_sources.json",
+            "data/HathiTrust/sec.6 v.2/images/*.png",
+            "data/Oceans1876/species.json",
+        ],
+        outputs=[
+            "data/Oceans1876/index_species.json",
+            "data/Oceans1876/index_species_verified.json",
+            "data/Oceans1876/index_species_verified_extra.json",
+        ],
+        dependencies=["update_data_sources", "remove_invalid_species"],
+    ),
+    Stage(
+        "species_index_verify",
+        "process_summary_report_species_index",
+        ["verify-species"],
+        inputs=[
+            "data/Oceans1876/data_sources.json",
+            "data/Oceans1876/index_species.json",
+            "data/Oceans1876/index_species_verified.json",
+            "data/Oceans1876/species.json",
+        ],
+        outputs=["data/Oceans1876/index_species_verified.json"],
+        dependencies=["species_index_process"],
+    ),
+    Stage(
+        "species_index_extra",
+        "process_summary_report_species_index",
+        ["species-extra"],
+        inputs=[
+            "data/Oceans1876/data_sources.json",
+            "data/Oceans1876/index_species_verified.json",
+            "data/Oceans1876/index_species_verified_extra.json",
+        ],
+        outputs=["data/Oceans1876/index_species_verified_extra.json"],
+        dependencies=["species_index_verify"],
+    ),
+    Stage(
+        "create_test_data",
+        "create_test_data",
+        [],
+        inputs=["data/Oceans1876/stations.json", "data/Oceans1876/species.json"],
+        outputs=[
+            "data/Oceans1876_test/stations.json",
+            "data/Oceans1876_test/species.json",
+        ],
+        dependencies=["remove_invalid_species"],
+    ),
+    Stage(
+        "plymouth_clean",
+        "plymouth",
+        ["--clean"],
+        inputs=["data/Plymouth/all_species.csv"],
+        outputs=["data/Plymouth/all_species_updated.csv"],
+    ),
+    Stage(
+        "plymouth_update",
+        "plymouth",
+        ["--update"],
+        inputs=[
+            "data/Oceans1876/stations.json",
+            "data/Plymouth/summary_species.csv",
+        ],
+        outputs=["data/Plymouth/summary_species_updated.csv"],
+        dependencies=["remove_invalid_species"],
+    ),
+    Stage(
+        "inverted_indexes",
+        "inverted_indexes",
+        [],
+        inputs=["data/Oceans1876/index_species.json", "data/Oceans1876/stations.json"],
+        outputs=["data/Oceans1876/inverted_indexes.npz"],
+        dependencies=["species_index_verify", "remove_invalid_species"],
+    ),
+    Stage(
+        "taxonomy_store",
+        "taxonomy_store",
+        ["update"],
+        inputs=[
+            "data/Oceans1876/species.json",
+            "data/Oceans1876/stations.json",
+            "data/Oceans1876/index_species.json",
+            "data/Oceans1876/index_species_verified.json",
+            "data/Oceans1876/index_species_verified_extra.json",
+            "data/Plymouth/all_species_updated.csv",
+            "data/Plymouth/summary_species_updated.csv",
+        ],
+        outputs=["data/Oceans1876/taxonomy.db"],
+        dependencies=[
+            "species_index_extra",
+            "remove_invalid_species",
+            "plymouth_clean",
+            "plymouth_update",
+        ],
+    ),
+]
+
+
+class PipelineState:
+    """
+    The input hashes of the last successful run of every stage,
+    and a cache of file hashes by (size, modification time).
+    """
+
+    def __init__(self, path: pathlib.Path = STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        state: Dict[str, Any] = {}
+        if path.exists():
+            with open(path, "r") as f:
+                state = json.load(f)
+        self.stages: Dict[str, str] = state.get("stages", {})
+        # path -> [size, mtime_ns, sha256]
+        self.files: Dict[str, List[Any]] = state.get("files", {})
+
+    def file_hash(self, path: pathlib.Path) -> str:
+        stat = os.stat(path)
+        with self._lock:
+            cached = self.files.get(str(path))
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            timings.count("file hash cache hits")
+            return cached[2]
+
+        with stage("file hash"):
+            digest = hash_file(path)
+        with self._lock:
+            self.files[str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def stage_key(self, pipeline_stage: Stage) -> str:
+        """
+        Hash the stage command and the paths and contents of its inputs.
+        """
+        sha = hashlib.sha256(json.dumps(pipeline_stage.command[1:]).encode())
+        for pattern in pipeline_stage.inputs:
+            sha.update(f"\n{pattern}".encode())
+            for path in sorted(pathlib.Path(".").glob(pattern)):
+                sha.update(f"\n{path}:{self.file_hash(path)}".encode())
+        return sha.hexdigest()
+
+    def is_up_to_date(self, pipeline_stage: Stage) -> bool:
+        if pipeline_stage.always_run:
+            return False
+        outputs_exist = all(
+            any(pathlib.Path(".").glob(pattern)) for pattern in pipeline_stage.outputs
+        )
+        return outputs_exist and self.stages.get(pipeline_stage.name) == self.stage_key(
+            pipeline_stage
+        )
+
+    def record(self, pipeline_stage: Stage) -> None:
+        key = self.stage_key(pipeline_stage)
+        with self._lock:
+            self.stages[pipeline_stage.name] = key
+            self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"stages": self.stages, "files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def select_stages(names: Sequence[str], stages: List[Stage] = STAGES) -> List[Stage]:
+    """
+    Return the given stages and the stages they depend on, in declaration order.
+    All stages are returned if `names` is empty.
+    """
+    if not names:
+        return stages
+
+    stages_by_name = {s.name: s for s in stages}
+    selected: Set[str] = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in stages_by_name:
+            raise ValueError(f"Unknown stage: {name}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(stages_by_name[name].dependencies)
+    return [s for s in stages if s.name in selected]
+
+
+def run_stage(
+    pipeline_stage: Stage,
+    state: PipelineState,
+    force: bool,
+    dry_run: bool,
+    profile: bool = False,
+) -> str:
+    """
+    Run the stage unless it is up to date, with `--profile` if `profile` is set.
+
+    Returns
+    -------
+    status of the stage: "up to date", "outdated" or "always runs" (dry run),
+    "done" or "failed"
+    """
+    if not force and state.is_up_to_date(pipeline_stage):
+        logger.info(f"{pipeline_stage.name} is up to date")
+        return "up to date"
+    if dry_run:
+        return "always runs" if pipeline_stage.always_run else "outdated"
+
+    # The flag is not part of the command hashed in the state.
+    command = (
+        [*pipeline_stage.command, "--profile"] if profile else pipeline_stage.command
+    )
+    logger.info(f"Running {pipeline_stage.name}: {' '.join(command)}")
+    with stage(f"stage {pipeline_stage.name}"):
+        result = subprocess.run(command)
+    if result.returncode:
+        logger.error(f"{pipeline_stage.name} failed with exit code {result.returncode}")
+        return "failed"
+
+    state.record(pipeline_stage)
+    return "done"
+
+
+def run_pipeline(
+    names: Sequence[str] = (),
+    force: bool = False,
+    workers: int = 1,
+    dry_run: bool = False,
+    state_path: pathlib.Path = STATE_PATH,
+    profile: bool = False,
+) -> Dict[str, str]:
+    """
+    Run the given stages (and their dependencies), or all of them.
+
+    Parameters
+    ----------
+    names: names of the stages to run, all of them if empty
+    force: run the stages even if they are up to date
+    workers: number of stages that can run at the same time
+    dry_run: only report which stages are outdated. As their inputs may be
+        updated by the stages they depend on, the stages after an outdated one
+        are reported as "blocked".
+    state_path: where the hashes of the last successful runs are saved
+    profile: run the stages with `--profile`
+
+    Returns
+    -------
+    stage name -> status
+    """
+    stages = select_stages(names)
+    state = PipelineState(state_path)
+    statuses: Dict[str, str] = {}
+    running: Dict[Future, Stage] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(statuses) < len(stages):
+            for pipeline_stage in stages:
+                if (
+                    pipeline_stage.name in statuses
+                    or pipeline_stage in running.values()
+                ):
+                    continue
+                dependencies = [
+                    statuses.get(d)
+                    for d in pipeline_stage.dependencies
+                    if any(s.name == d for s in stages)
+                ]
+                if any(d in ("failed", "blocked", "outdated") for d in dependencies):
+                    if not dry_run:
+                        logger.warning(f"{pipeline_stage.name} is blocked")
+                    statuses[pipeline_stage.name] = "blocked"
+                elif all(
+                    d in ("up to date", "always runs", "done") for d in dependencies
+                ):
+                    running[
+                        executor.submit(
+                            run_stage, pipeline_stage, state, force, dry_run, profile
+                        )
+                    ] = pipeline_stage
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                statuses[running.pop(future).name] = future.result()
+
+    timings.count("stages run", sum(s == "done" for s in statuses.values()))
+    timings.count("stages skipped", sum(s == "up to date" for s in statuses.values()))
+    state.save()
+    return statuses
+
+
+def log_statuses(statuses: Dict[str, str]) -> None:
+    for pipeline_stage in STAGES:
+        if pipeline_stage.name in statuses:
+            logger.info(f"{pipeline_stage.name}: {statuses[pipeline_stage.name]}")
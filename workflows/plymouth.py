@@ -1,14 +1,22 @@
 import argparse
 import logging
-from typing import Dict, List
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
 
 from .gnames import GNames
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Plymouth")
 
+# Global Names data source id of WoRMS
+WORMS_DATA_SOURCE = "9"
+
 taxa_priorities = [
     "phylum",
     "class",
@@ -17,8 +25,113 @@ taxa_priorities = [
 ]
 
 
-def clean_data() -> None:
-    all_species = pd.read_csv("data/Plymouth/all_species.csv", keep_default_na=False)
+def worms_taxa(verified_species: pd.DataFrame) -> pd.Series:
+    """
+    Derive the taxa of the verified species from their classification:
+    the first taxon whose rank contains the highest priority in `taxa_priorities`.
+
+    Parameters
+    ----------
+    verified_species: WoRMS best results, with `classificationRanks` and
+        `classificationPath` columns
+
+    Returns
+    -------
+    taxa, aligned with `verified_species` (NaN if there is none)
+    """
+    classified = verified_species[
+        verified_species["classificationPath"].fillna("").astype(bool)
+    ]
+    ranks = classified["classificationRanks"].str.split("|").explode()
+    taxa = classified["classificationPath"].str.split("|").explode()
+    # Pair the ranks and taxa by their position, like `zip`
+    ranks.index = [ranks.index, ranks.groupby(level=0).cumcount()]
+    taxa.index = [taxa.index, taxa.groupby(level=0).cumcount()]
+    classification = pd.concat(
+        {"rank": ranks.str.lower(), "taxon": taxa}, axis=1, join="inner"
+    ).sort_index()
+
+    species_taxa = pd.Series(np.nan, index=verified_species.index, dtype=object)
+    for tp in taxa_priorities:
+        matches = classification[
+            classification["rank"].str.contains(tp, regex=False, na=False)
+        ]
+        species_taxa = species_taxa.combine_first(
+            matches.groupby(level=0)["taxon"].first()
+        )
+    return species_taxa
+
+
+def add_worms_columns(
+    gnames: GNames, species: pd.DataFrame, names: pd.Series, workers: int = 1
+) -> None:
+    """
+    Verify the distinct species names against WoRMS in batches,
+    and set the `WoRMS ID` and `WoRMS Taxa` columns of `species` from the results.
+
+    Parameters
+    ----------
+    gnames: GNames instance
+    species: Plymouth species
+    names: species names to verify, aligned with `species`
+    workers: maximum number of parallel gnverifier calls
+    """
+    distinct_names = list(dict.fromkeys(names))
+    verified_species = gnames.verify_batch(distinct_names, [WORMS_DATA_SOURCE], workers)
+
+    best_results = pd.DataFrame.from_records(
+        [verified_species[name].get("bestResult") or {} for name in distinct_names],
+        index=distinct_names,
+        columns=["recordId", "classificationRanks", "classificationPath"],
+    )
+    for name in best_results.index[best_results["recordId"].isna()]:
+        logger.warning(f"Species not found: {name}")
+
+    species["WoRMS ID"] = names.map(best_results["recordId"])
+    species["WoRMS Taxa"] = names.map(worms_taxa(best_results))
+
+
+class SpeciesIndex:
+    """
+    Index of a list of processed species by their lower-cased names.
+    Removed species are only dropped from the list by `apply_removals`,
+    so the positions in the index stay valid until then.
+    """
+
+    def __init__(self, species: List[dict]):
+        self.species = species
+        self.positions: Dict[str, Deque[int]] = {}
+        for position, sp in enumerate(species):
+            self.positions.setdefault(sp["name"].lower(), deque()).append(position)
+        self.removed: Set[int] = set()
+
+    def find(self, *names: str) -> Optional[int]:
+        """
+        Return the position of the first species with any of the given names,
+        or None if there is none.
+        """
+        positions = [self.positions[n][0] for n in names if self.positions.get(n)]
+        return min(positions) if positions else None
+
+    def remove(self, position: int) -> None:
+        self.positions[self.species[position]["name"].lower()].remove(position)
+        self.removed.add(position)
+
+    def apply_removals(self) -> None:
+        if self.removed:
+            self.species[:] = [
+                sp
+                for position, sp in enumerate(self.species)
+                if position not in self.removed
+            ]
+            self.removed = set()
+
+
+def clean_data(workers: int = 1) -> None:
+    with stage("csv read"):
+        all_species = pd.read_csv(
+            "data/Plymouth/all_species.csv", keep_default_na=False
+        )
 
     all_species["Genus"] = all_species["Genus"].apply(
         lambda x: x.strip().replace(" ", "").capitalize()
@@ -28,45 +141,27 @@ def clean_data() -> None:
     all_species["WoRMS ID"] = None
     all_species["WoRMS Taxa"] = None
 
-    gnames = GNames()
+    add_worms_columns(
+        GNames(),
+        all_species,
+        all_species["Genus"] + " " + all_species["Species"],
+        workers,
+    )
 
-    for idx, species_row in all_species.iterrows():
-        sp = f"{species_row['Genus']} {species_row['Species']}"
-        logger.info(f"Processing {idx} - {sp}")
-        verified_species = gnames.verify(sp, ["9"]).get("bestResult")
-        if verified_species:
-            all_species.at[idx, "WoRMS ID"] = verified_species["recordId"]
-            if verified_species.get("classificationPath"):
-                classification_path = verified_species["classificationPath"].split("|")
-                classification_ranks = verified_species["classificationRanks"].split(
-                    "|"
-                )
-                for tp in taxa_priorities:
-                    try:
-                        (_rank, taxa) = next(
-                            filter(
-                                lambda x: tp in x[0].lower(),
-                                zip(classification_ranks, classification_path),
-                            )
-                        )
-                        all_species.at[idx, "WoRMS Taxa"] = taxa
-                        break
-                    except StopIteration:
-                        continue
-        else:
-            logger.warning(f"Species not found: {idx} - {sp}")
-
-    all_species.to_csv("data/Plymouth/all_species_updated.csv", index=False)
-
-
-def update_data() -> None:
+    with stage("csv write"):
+        all_species.to_csv("data/Plymouth/all_species_updated.csv", index=False)
+
+
+def update_data(workers: int = 1) -> None:
     gnames = GNames()
 
-    processed_stations = pd.read_json("data/Oceans1876/stations.json")
+    with stage("json read"):
+        processed_stations = pd.read_json("data/Oceans1876/stations.json")
 
-    plymouth_species = pd.read_csv(
-        "data/Plymouth/summary_species.csv", keep_default_na=False
-    )
+    with stage("csv read"):
+        plymouth_species = pd.read_csv(
+            "data/Plymouth/summary_species.csv", keep_default_na=False
+        )
 
     # This can be either Plymouth or Oceans1876
     plymouth_species["Source"] = "Plymouth"
@@ -84,8 +179,18 @@ def update_data() -> None:
         lambda x: " ".join(x).lower(), axis=1
     )
 
+    # The processed species of each station. Stations groups are matched by their
+    # first station, and the groups sharing it share its list of species.
+    stations_species: Dict[str, Any] = {}
+    for station, species in zip(
+        processed_stations["Station"], processed_stations["Species"]
+    ):
+        stations_species.setdefault(station, species)
+
     # A cache of species for each stations' group
     processed_stations_species: Dict[str, List[dict]] = {}
+    # Name indexes of the species lists, by the id of the list
+    species_indexes: Dict[int, SpeciesIndex] = {}
 
     # The following two are used to keep track of changes for processed_species
     added_species: Dict[str, List[str]] = {}
@@ -98,50 +203,52 @@ def update_data() -> None:
             species = species_row["sp_concat"]
 
             stations_group = species_row["Stations Group"]
-            station_processed_species = processed_stations_species.setdefault(
-                stations_group,
-                (
-                    processed_stations[
-                        processed_stations["Station"] == stations_group.split(",")[0]
-                    ]
-                    .iloc[0]
-                    .Species
+            if stations_group not in processed_stations_species:
+                processed_stations_species[stations_group] = (
+                    stations_species[stations_group.split(",")[0]] or []
                 )
-                or [],
-            )
-
-            try:
-                # Find Plymouth species in processed species
-                (idx, sp) = next(
-                    (
-                        (idx, sp)
-                        for idx, sp in enumerate(station_processed_species)
-                        if (sp["name"].lower() == taxa or sp["name"].lower() == species)
-                    )
+            station_processed_species = processed_stations_species[stations_group]
+            if id(station_processed_species) not in species_indexes:
+                species_indexes[id(station_processed_species)] = SpeciesIndex(
+                    station_processed_species
                 )
-                if sp["name"].lower() == taxa:
-                    # Delete this species from the list of species for this station
-                    station_processed_species.pop(idx)
-                    deleted_species.add(sp["recordId"])
-            except StopIteration:
+            species_index = species_indexes[id(station_processed_species)]
+
+            # Find Plymouth species in processed species
+            position = species_index.find(taxa, species)
+            if position is None:
                 # Plymouth species not found in processed species
                 added_species.setdefault(stations_group, []).append(
                     species.capitalize()
                 )
+            elif station_processed_species[position]["name"].lower() == taxa:
+                # Delete this species from the list of species for this station
+                species_index.remove(position)
+                deleted_species.add(station_processed_species[position]["recordId"])
+
+    for species_index in species_indexes.values():
+        species_index.apply_removals()
 
     # Update Plymouth species with processed species
+    plymouth_species_keys = set(
+        zip(plymouth_species["Stations Group"], plymouth_species["sp_concat"])
+    )
+    # Position of the first and last rows of each stations group
+    stations_group_rows: Dict[str, Tuple[int, int]] = {}
+    for position, stations_group in enumerate(plymouth_species["Stations Group"]):
+        first_row = stations_group_rows.get(stations_group, (position, position))[0]
+        stations_group_rows[stations_group] = (first_row, position)
+
+    # The missing species are collected first and inserted together,
+    # after the last row of their stations group
+    new_rows: List[pd.Series] = []
+    new_rows_positions: List[float] = []
     for stations_group, species in processed_stations_species.items():
+        first_row, last_row = stations_group_rows[stations_group]
         for sp in species:
-            plymouth_sp = plymouth_species[
-                (plymouth_species["Stations Group"] == stations_group)
-                & (plymouth_species["sp_concat"] == sp["name"].lower())
-            ]
-            if plymouth_sp.empty:
+            if (stations_group, sp["name"].lower()) not in plymouth_species_keys:
                 # Insert species in Plymouth dataset
-                stations_group_rows = plymouth_species[
-                    plymouth_species["Stations Group"] == stations_group
-                ]
-                new_row = stations_group_rows.iloc[0].copy()
+                new_row = plymouth_species.iloc[first_row].copy()
                 sp["Taxa"] = ""
                 sp["sp_concat"] = sp["name"]
                 sp_list = sp["name"].split(" ")
@@ -154,40 +261,30 @@ def update_data() -> None:
                 new_row["depth (fathoms)"] = ""
                 new_row["Source"] = "Oceans1876"
 
-                plymouth_species.loc[stations_group_rows.index[-1] + 0.5] = new_row
-                plymouth_species = plymouth_species.sort_index().reset_index(drop=True)
-
-    for idx, species_row in plymouth_species.iterrows():
-        logger.info(f"Processing {idx} - {species_row['sp_concat']}")
-        verified_species = gnames.verify(
-            species_row["sp_concat"].capitalize(), ["9"]
-        ).get("bestResult")
-        if verified_species:
-            plymouth_species.at[idx, "WoRMS ID"] = verified_species["recordId"]
-            if verified_species.get("classificationPath"):
-                classification_path = verified_species["classificationPath"].split("|")
-                classification_ranks = verified_species["classificationRanks"].split(
-                    "|"
-                )
-                for tp in taxa_priorities:
-                    try:
-                        (_rank, taxa) = next(
-                            filter(
-                                lambda x: tp in x[0].lower(),
-                                zip(classification_ranks, classification_path),
-                            )
-                        )
-                        plymouth_species.at[idx, "WoRMS Taxa"] = taxa
-                        break
-                    except StopIteration:
-                        continue
-        else:
-            logger.warning(f"Species not found: {idx} - {species_row}")
-
-    plymouth_species.drop(["sp_concat"], axis=1).to_csv(
-        "data/Plymouth/summary_species_updated.csv", index=False
+                new_rows.append(new_row)
+                new_rows_positions.append(last_row + 0.5)
+                plymouth_species_keys.add((stations_group, new_row["sp_concat"]))
+
+    if new_rows:
+        positions: List[float] = [*range(len(plymouth_species)), *new_rows_positions]
+        plymouth_species = (
+            pd.concat([plymouth_species, pd.DataFrame(new_rows)], ignore_index=True)
+            .iloc[np.argsort(positions, kind="stable")]
+            .reset_index(drop=True)
+        )
+
+    add_worms_columns(
+        gnames,
+        plymouth_species,
+        plymouth_species["sp_concat"].str.capitalize(),
+        workers,
     )
 
+    with stage("csv write"):
+        plymouth_species.drop(["sp_concat"], axis=1).to_csv(
+            "data/Plymouth/summary_species_updated.csv", index=False
+        )
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -199,10 +296,22 @@ if __name__ == "__main__":
         "--update",
         action="store_true",
     )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of parallel gnverifier calls",
+    )
+    add_profile_argument(parser)
     args = parser.parse_args()
 
-    if args.clean:
-        clean_data()
+    with profile("plymouth", args.profile):
+        if args.clean:
+            clean_data(args.workers)
+
+        if args.update:
+            update_data(args.workers)
 
-    if args.update:
-        update_data()
+    if args.clean or args.update:
+        timings.save(TIMINGS_PATH / "plymouth_timings.json")
@@ -9,18 +9,28 @@ This script handles the following:
 import argparse
 import json
 import logging
+import os
 import pathlib
 import re
 import sys
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Dict, List, Tuple
 
-import fuzzysearch
-import numpy as np
 import pandas as pd
 
 from data.schemas.species.global_names import GNMetadata
 
 from .gnames import GNames
+from .hathitrust_corpus import HathiTrustCorpus, Span, parse_pages_range
+from .jsonl import dataframe_records, write_jsonl
+from .profiling import add_profile_argument, profile
+from .ramm import load_ramm_stations
+from .spatial_index import StationsSpatialIndex
+from .station_boundaries import locate_station_boundaries
+from .stations_manifest import build_stations_manifest, load_previous_run, save_manifest
+from .temperature_profiles import TemperatureProfiles
+from .timing import TIMINGS_PATH, stage, timings
 from .utils import PydanticJSONEncoder
 
 logging.basicConfig(level=logging.INFO)
@@ -34,280 +44,193 @@ DEBUG_OUTPUT_PATH = WORK_DIR / "tmp" / "stations"
 if not DEBUG_OUTPUT_PATH.exists():
     DEBUG_OUTPUT_PATH.mkdir(parents=True)
 
-RAMM_STATION_COLUMN_TYPES = {
-    "Station": "object",
-    "Sediment sample": "object",
-    "Latitude Degrees": "int64",
-    "Latitude Minutes": "int64",
-    "Latitude Seconds": "int64",
-    "North/South": "object",
-    "Longitude Degrees": "int64",
-    "Longitude Minutes": "int64",
-    "Longitude Seconds": "int64",
-    "East/West": "object",
-    "Decimal Longitude": "float64",
-    "Decimal Latitude": "float64",
-    "Location": "object",
-    "FAOarea": "int64",
-    "Water body": "object",
-    "Sea Area": "object",
-    "Place": "object",
-    "Date": "object",
-    "Gear": "object",
-    "Depth (fathoms)": "float64",
-    "Bottom water temperature (C)": "float64",
-    "Bottom temp (F)": "float64",
-    "Bottom water depth D (fathoms)": "float64",
-    "Specific Gravity at bottom": "float64",
-    "Surface temp (C)": "float64",
-    "Surface temp (F)": "float64",
-    "Specific Gravity at surface": "float64",
-    "Temp (F) at 10 Fathoms": "float64",
-    "Temp (F) at 20 Fathoms": "float64",
-    "Temp (F) at 25 Fathoms": "float64",
-    "Temp (F) at 30 Fathoms": "float64",
-    "Temp (F) at 40 Fathoms": "float64",
-    "Temp (F) at 50 Fathoms": "float64",
-    "Temp (F) at 60 Fathoms": "float64",
-    "Temp (F) at 70 Fathoms": "float64",
-    "Temp (F) at 75 Fathoms": "float64",
-    "Temp (F) at 80 Fathoms": "float64",
-    "Temp (F) at 90 Fathoms": "float64",
-    "Temp (F) at 100 Fathoms": "float64",
-    "Temp (F) at 110 Fathoms": "float64",
-    "Temp (F) at 120 Fathoms": "float64",
-    "Temp (F) at 125 Fathoms": "float64",
-    "Temp (F) at 130 Fathoms": "float64",
-    "Temp (F) at 140 Fathoms": "float64",
-    "Temp (F) at 150 Fathoms": "float64",
-    "Temp (F) at 160 Fathoms": "float64",
-    "Temp (F) at 170 Fathoms": "float64",
-    "Temp (F) at 175 Fathoms": "float64",
-    "Temp (F) at 180 Fathoms": "float64",
-    "Temp (F) at 190 Fathoms": "float64",
-    "Temp (F) at 200 Fathoms": "float64",
-    "Temp (F) at 225 Fathoms": "float64",
-    "Temp (F) at 250 Fathoms": "float64",
-    "Temp (F) at 275 Fathoms": "float64",
-    "Temp (F) at 300 Fathoms": "float64",
-    "Temp (F) at 400 Fathoms": "float64",
-    "Temp (F) at 500 Fathoms": "float64",
-    "Temp (F) at 600 Fathoms": "float64",
-    "Temp (F) at 700 Fathoms": "float64",
-    "Temp (F) at 800 Fathoms": "float64",
-    "Temp (F) at 900 Fathoms": "float64",
-    "Temp (F) at 1000 Fathoms": "float64",
-    "Temp (F) at 1100 Fathoms": "float64",
-    "Temp (F) at 1200 Fathoms": "float64",
-    "Temp (F) at 1300 Fathoms": "float64",
-    "Temp (F) at 1330 Fathoms": "float64",
-    "Temp (F) at 1400 Fathoms": "float64",
-    "Temp (F) at 1450 Fathoms": "float64",
-    "Temp (F) at 1500 Fathoms": "float64",
-    "Temp (F) at 1530 Fathoms": "float64",
-    "Temp (F) at 1580 Fathoms": "float64",
-    "Temp (F) at 1600 Fathoms": "float64",
-    "Temp (F) at 1650 Fathoms": "float64",
-    "Temp (F) at 1700 Fathoms": "float64",
-    "Temp (F) at 1725 Fathoms": "float64",
-    "Temp (F) at 1730 Fathoms": "float64",
-    "Temp (F) at 1775 Fathoms": "float64",
-    "Temp (F) at 1780 Fathoms": "float64",
-    "Temp (F) at 1800 Fathoms": "float64",
-    "Temp (F) at 1825 Fathoms": "float64",
-    "Temp (F) at 1850 Fathoms": "float64",
-    "Temp (F) at 1900 Fathoms": "float64",
-    "Temp (F) at 1915 Fathoms": "float64",
-    "Temp (F) at 1980 Fathoms": "float64",
-    "Temp (F) at 2000 Fathoms": "float64",
-    "Temp (F) at 2025 Fathoms": "float64",
-    "Temp (F) at 2100 Fathoms": "float64",
-    "Temp (F) at 2125 Fathoms": "float64",
-    "Temp (F) at 2180 Fathoms": "float64",
-    "Temp (F) at 2200 Fathoms": "float64",
-    "Temp (F) at 2225 Fathoms": "float64",
-    "Temp (F) at 2270 Fathoms": "float64",
-    "Temp (F) at 2300 Fathoms": "float64",
-    "Temp (F) at 2325 Fathoms": "float64",
-    "Temp (F) at 2400 Fathoms": "float64",
-    "Temp (F) at 2425 Fathoms": "float64",
-    "Temp (F) at 2440 Fathoms": "float64",
-    "Temp (F) at 2500 Fathoms": "float64",
-    "Temp (F) at 2525 Fathoms": "float64",
-    "Temp (F) at 2600 Fathoms": "float64",
-    "Temp (F) at 2625 Fathoms": "float64",
-    "Temp (F) at 2650 Fathoms": "float64",
-    "Temp (F) at 2675 Fathoms": "float64",
-    "Temp (F) at 2700 Fathoms": "float64",
-    "Temp (F) at 2775 Fathoms": "float64",
-    "Temp (F) at 2800 Fathoms": "float64",
-    "Temp (F) at 2900 Fathoms": "float64",
-}
-
-
-def run(debug: bool = False) -> None:
-    gnames = GNames()
-
-    # Load all columns as string, i.e. dtype="object"
-    ramm_stations = pd.read_csv(WORK_DIR / "RAMM" / "stations.csv", dtype="object")
-    # Fix RAMM stations data types
-    for column in ramm_stations.columns:
-        # Replace all empty strings with np.nan
-        ramm_stations[column].replace(r"^\s*$", np.nan, regex=True, inplace=True)
-
-        # If the target column type is not string, update its type
-        if RAMM_STATION_COLUMN_TYPES[column] != "object":
-            try:
-                ramm_stations[column] = ramm_stations[column].astype(
-                    RAMM_STATION_COLUMN_TYPES[column]
-                )
-            except ValueError as e:
-                sys.exit(f"Error in column {column}: {e}")
-
-    hathitrust_stations = pd.read_csv(WORK_DIR / "HathiTrust" / "stations.csv").dropna()
-    hathitrust_stations["Range"] = hathitrust_stations["Range"].apply(json.loads)
-
-    # Cache the texts based on stations' text identifiers
-    stations_texts: Dict[str, List[str]] = {}
-
-    def update_previous_station_text(
-        current_idx: int,
-        current_page: str,
-        current_text: str,
-        current_station_start_index: int,
-    ) -> None:
-        """
-        This is called when a new station is found. At this point,
-        we need to trim the text that belongs to the new
-        station from the previous station, if they shared a page.
-        The previous station text is updated directly in `hathitrust_stations`.
-
-        Parameters
-        ----------
-        current_idx: row number for the current station in the loaded dataframe
-        current_page: start page of the current station
-        current_text: full text of the first page of the current station
-        current_station_start_index: where the current station text
-            starts in the current page (i.e. `current_text`)
-
-        """
-        previous_station = hathitrust_stations.loc[current_idx - 1]
-
-        if previous_station["Range"][-1][-1].split("-")[-1] == current_page:
-            # Only update if the end page of the previous station is the same
-            # as the start page of the current station
-            previous_station_text_identifier = previous_station["Text Identifier"]
-            if previous_station_text_identifier in stations_texts:
-                # Get the offset value for the previous station in the current page
-                previous_station_text = stations_texts[previous_station_text_identifier]
-
-                previous_station_text_last_section = previous_station_text[-1]
-
-                previous_station_start_index = current_text.find(
-                    previous_station_text_last_section
-                )
-                previous_station_end_index = (
-                    current_station_start_index - previous_station_start_index
-                )
 
-                previous_station_text_last_section_updated = (
-                    previous_station_text_last_section[:previous_station_end_index]
-                )
+def extract_stations_texts(
+    hathitrust_stations: pd.DataFrame, corpus: HathiTrustCorpus
+) -> Dict[str, str]:
+    """
+    Extract the stations' texts from the HathiTrust corpus.
+
+    The start of every station is located at once (see `station_boundaries`),
+    then each station's text runs from its start to the start of the next station,
+    if they share a page, or to the end of its page range.
+
+    Parameters
+    ----------
+    hathitrust_stations: HathiTrust stations, with their page ranges parsed
+    corpus: the HathiTrust corpus
+
+    Returns
+    -------
+    station text identifier -> station text
+    """
+    # Page files are numbered from zero.
+    boundaries = locate_station_boundaries(
+        corpus,
+        {
+            station["Text Identifier"]: (
+                station["Range"][0][0],
+                parse_pages_range(station["Range"][0][1])[0] - 1,
+            )
+            for _, station in hathitrust_stations.iterrows()
+        },
+        STATION_NAMES_MAX_LEVENSHTEIN_DISTANCE,
+    )
 
-                previous_station_text[-1] = previous_station_text_last_section_updated
-            else:
-                logger.warning(
-                    f"Previous station does not have text: "
-                    f"{previous_station['Station']}"
-                )
+    # The texts are stored as spans of the corpus, cached based on
+    # stations' text identifiers, until all the stations are split.
+    stations_spans: Dict[str, List[Span]] = {}
 
-    station_text_identifier = None
-    page_text = None
-    for idx, station in hathitrust_stations.iterrows():
+    previous_station = None
+    for _, station in hathitrust_stations.iterrows():
         station_text_identifier = station["Text Identifier"]
         logger.info(f"Processing {station_text_identifier}")
 
-        if station_text_identifier not in stations_texts:
-            station_text = []
+        if station_text_identifier not in stations_spans:
+            station_spans = []
+            boundary = boundaries[station_text_identifier]
 
             for section_idx, (section, pages) in enumerate(station["Range"]):
-                # Each section page range (`pages`) is a string
-                # in the following format: "<start>-<end>"
-                pages_range = [int(p) for p in pages.split("-")]
-                if len(pages_range) == 1:
-                    pages_range.append(pages_range[0])
-                pages_range[1] += 1
-                for page_idx, page in enumerate(range(*pages_range)):
-                    filename = (
-                        WORK_DIR
-                        / "HathiTrust"
-                        / section
-                        / "texts"
-                        / f"{page - 1:08}.txt"
-                    )
-                    try:
-                        with open(filename, "r") as f:
-                            page_text = f.read()
-
-                        if section_idx == 0 and page_idx == 0:
-                            # First page of range contains the station text identifier
-                            results = fuzzysearch.find_near_matches(
-                                station_text_identifier,
-                                page_text,
-                                max_l_dist=STATION_NAMES_MAX_LEVENSHTEIN_DISTANCE,
+                start_page, end_page = parse_pages_range(pages)
+                for page in range(start_page - 1, end_page):
+                    if corpus.page_span(section, page) is None:
+                        logger.warning(
+                            "File does not exist: "
+                            f"{WORK_DIR / 'HathiTrust' / section / 'texts'}"
+                            f"/{page:08}.txt"
+                        )
+
+                if section_idx == 0:
+                    # First page of range contains the station text identifier
+                    if boundary:
+                        page_offset, page_length = corpus.pages[section][boundary.page]
+                        station_spans.append(
+                            (
+                                boundary.offset,
+                                page_offset + page_length - boundary.offset,
                             )
-                            if results:
-                                results.sort(key=lambda r: r.dist)
-                                station_text.append(page_text[results[0].start :])
-
-                                if idx > 0:
-                                    # On the first page of a station section,
-                                    # update the previous station and remove
-                                    # the part that belongs to the new station
-                                    update_previous_station_text(
-                                        idx, str(page), page_text, results[0].start
-                                    )
-                            else:
-                                logger.warning(
-                                    f"Could not find the station name in page: "
-                                    f"{station_text_identifier} - {filename}"
-                                )
-                        else:
-                            station_text.append(page_text)
-                    except FileNotFoundError:
-                        logger.warning(f"File does not exist: {filename}")
-
-            stations_texts[station_text_identifier] = station_text
-
-    if station_text_identifier and page_text:
-        stations_texts[station_text_identifier].append(page_text)
-
-    hathitrust_stations["Text"] = hathitrust_stations["Text Identifier"].map(
-        lambda text_id: "\n".join(stations_texts[text_id])
-    )
-
-    all_species_by_record_id: Dict[
-        str, Dict[str, Any]
-    ] = {}  # Holds all species across all stations by record id
-    stations_species = {}  # Holds species by stations' text identifier
-
-    for (text_identifier, text_list) in stations_texts.items():
-        text_str = "\n".join(text_list)
-        stations_texts[text_identifier] = text_str.split("\n")
+                        )
+                    elif corpus.page_span(section, start_page - 1):
+                        logger.warning(
+                            f"Could not find the station name in page: "
+                            f"{station_text_identifier} - "
+                            f"{section}/{start_page - 1:08}"
+                        )
+                    start_page += 1
+
+                section_span = corpus.range_span(section, start_page - 1, end_page - 1)
+                if section_span:
+                    station_spans.append(section_span)
+
+            stations_spans[station_text_identifier] = station_spans
+
+            if boundary and previous_station is not None:
+                # Remove the part that belongs to this station from the previous
+                # station, if the previous station ends on this station's first page.
+                previous_section, previous_pages = previous_station["Range"][-1]
+                previous_station_spans = stations_spans[
+                    previous_station["Text Identifier"]
+                ]
+                if previous_station_spans and (
+                    previous_section,
+                    parse_pages_range(previous_pages)[1] - 1,
+                ) == (boundary.section, boundary.page):
+                    offset, length = previous_station_spans[-1]
+                    previous_station_spans[-1] = (
+                        offset,
+                        min(length, max(0, boundary.offset - offset)),
+                    )
 
-        logger.info(f"Getting species for {text_identifier}")
+        previous_station = station
+
+    if previous_station is not None:
+        # The last station is not trimmed by any other station,
+        # and its full last page is appended to it once more.
+        last_section, last_pages = previous_station["Range"][-1]
+        start_page, end_page = parse_pages_range(last_pages)
+        last_page_spans = corpus.page_spans(last_section, start_page - 1, end_page - 1)
+        if last_page_spans:
+            stations_spans[previous_station["Text Identifier"]].append(
+                last_page_spans[-1]
+            )
 
-        # Use gnfinder to parse species from station text without verification
-        station_species = gnames.extract(text_str)
+    with stage("page read"):
+        return {
+            text_identifier: "\n".join(corpus.text(span) for span in spans)
+            for text_identifier, spans in stations_spans.items()
+        }
+
+
+def extract_stations_species(
+    gnames: GNames, stations_texts: Dict[str, str], workers: int = 1
+) -> Tuple[Dict[str, List[dict]], Dict[str, dict]]:
+    """
+    Parse and verify the species in the stations' texts.
+
+    The stations do not depend on each other, so gnfinder runs on up to `workers`
+    stations in parallel. The distinct names found in all the stations are then
+    verified together in batches.
+
+    Parameters
+    ----------
+    gnames: GNames instance
+    stations_texts: station text identifier -> station text
+    workers: maximum number of parallel gnfinder/gnverifier calls
+
+    Returns
+    -------
+    species by stations' text identifier, and their verification by name
+    """
+    logger.info(f"Getting species for {len(stations_texts)} stations")
+
+    # Use gnfinder to parse species from station texts without verification
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        stations_species = dict(
+            zip(stations_texts, executor.map(gnames.extract, stations_texts.values()))
+        )
 
-        stations_species[text_identifier] = station_species
+    # Use gnverifier to verify the distinct parsed species
+    verified_species_by_name = gnames.verify_batch(
+        (
+            species["name"]
+            for station_species in stations_species.values()
+            for species in station_species
+        ),
+        workers=workers,
+    )
 
-        # Use gnverifier to verify the parsed species,
-        # if they are not already in `all_species_by_name`
+    return stations_species, verified_species_by_name
+
+
+def merge_stations_species(
+    stations_species: Dict[str, List[dict]],
+    verified_species_by_name: Dict[str, dict],
+    previous_species_by_record_id: Dict[str, dict],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Collect the verified species of all stations by their record id,
+    in the stations' order, so the result does not depend on the number of workers.
+    If a record id is matched by several names, an exact match is preferred.
+
+    Parameters
+    ----------
+    stations_species: species by stations' text identifier
+    verified_species_by_name: verification of the newly parsed species by name
+    previous_species_by_record_id: verified species of the previous run,
+        used for the species carried forward from the previous run
+    """
+    all_species_by_record_id: Dict[str, Dict[str, Any]] = {}
+
+    for station_species in stations_species.values():
         for species in station_species:
-            verified_species = gnames.verify(species["name"])
-            record_id = verified_species.get("bestResult", {}).get("recordId", None)
-            if record_id:
+            if species["name"] in verified_species_by_name:
+                verified_species = verified_species_by_name[species["name"]]
+                record_id = verified_species.get("bestResult", {}).get("recordId", None)
+            else:
+                record_id = species.get("recordId")
+                verified_species = previous_species_by_record_id.get(record_id, {})
+
+            if record_id and verified_species:
                 species["recordId"] = record_id
                 if record_id in all_species_by_record_id:
                     if (
@@ -318,6 +241,111 @@ def run(debug: bool = False) -> None:
                 else:
                     all_species_by_record_id[record_id] = verified_species
 
+    return all_species_by_record_id
+
+
+def stations_output_path(output_format: str, compress: bool) -> pathlib.Path:
+    """
+    Return the path of the updated RAMM stations, which are saved either as
+    a JSON array ("json") or as JSON lines ("jsonl"), optionally gzip-compressed.
+    """
+    if output_format == "jsonl":
+        return WORK_DIR / "Oceans1876" / f"stations.jsonl{'.gz' if compress else ''}"
+    return WORK_DIR / "Oceans1876" / "stations.json"
+
+
+def save_debug_stations(ramm_stations: pd.DataFrame, debug_format: str) -> None:
+    """
+    Save every station separately in `DEBUG_OUTPUT_PATH`.
+
+    Parameters
+    ----------
+    ramm_stations: the updated RAMM stations
+    debug_format: "files" for one JSON file per station, or "jsonl" for
+        a single `stations.jsonl` file with an index of the stations' offsets
+    """
+    with stage("debug write"):
+        if debug_format == "jsonl":
+            write_jsonl(
+                DEBUG_OUTPUT_PATH / "stations.jsonl",
+                dataframe_records(ramm_stations, "Station"),
+            )
+        else:
+            for idx, station in ramm_stations.iterrows():
+                station.to_json(
+                    DEBUG_OUTPUT_PATH / f"{idx+1:03}_{station.Station}.json", indent=2
+                )
+
+
+def run(
+    debug: bool = False,
+    workers: int = 1,
+    full: bool = False,
+    debug_format: str = "files",
+    output_format: str = "json",
+    compress: bool = False,
+) -> None:
+    gnames = GNames()
+
+    stations_path = stations_output_path(output_format, compress)
+
+    with stage("ramm load"):
+        try:
+            ramm_stations = load_ramm_stations()
+        except ValueError as e:
+            sys.exit(str(e))
+
+    hathitrust_stations = pd.read_csv(WORK_DIR / "HathiTrust" / "stations.csv").dropna()
+    hathitrust_stations["Range"] = hathitrust_stations["Range"].apply(json.loads)
+
+    with HathiTrustCorpus.load() as corpus:
+        stations_texts = extract_stations_texts(hathitrust_stations, corpus)
+        manifest = build_stations_manifest(
+            gnames.app_versions,
+            hathitrust_stations,
+            ramm_stations,
+            corpus,
+            stations_texts,
+            stations_path,
+        )
+
+    hathitrust_stations["Text"] = hathitrust_stations["Text Identifier"].map(
+        stations_texts
+    )
+
+    # Only reprocess the stations whose inputs changed since the previous run
+    previous_stations_species, previous_species_by_record_id = (
+        ({}, {}) if full else load_previous_run(manifest)
+    )
+    changed_stations_texts = {
+        text_identifier: text
+        for text_identifier, text in stations_texts.items()
+        if text_identifier not in previous_stations_species
+    }
+    logger.info(
+        f"{len(stations_texts) - len(changed_stations_texts)} stations are "
+        "unchanged since the previous run"
+    )
+
+    new_stations_species, verified_species_by_name = extract_stations_species(
+        gnames, changed_stations_texts, workers
+    )
+    stations_species = {
+        text_identifier: new_stations_species[text_identifier]
+        if text_identifier in new_stations_species
+        else previous_stations_species[text_identifier]
+        for text_identifier in stations_texts
+    }
+    all_species_by_record_id = merge_stations_species(
+        stations_species, verified_species_by_name, previous_species_by_record_id
+    )
+
+    with stage("temperature profiles write"):
+        TemperatureProfiles.from_ramm_stations(ramm_stations).save()
+
+    with stage("spatial index write"):
+        StationsSpatialIndex.from_ramm_stations(ramm_stations).save()
+
     # Rename temp columns so they can be aggregated into one column
     fathom_temp_f = ramm_stations.filter(regex="Temp(.*)")
     ramm_stations.drop(columns=fathom_temp_f.columns, inplace=True)
@@ -346,30 +374,47 @@ def run(debug: bool = False) -> None:
     )
 
     # Save the updated RAMM data
-    ramm_stations.to_json(
-        WORK_DIR / "Oceans1876" / "stations.json", orient="records", indent=2
-    )
+    with stage("json write"):
+        if output_format == "jsonl":
+            write_jsonl(
+                stations_path, dataframe_records(ramm_stations, "Station"), compress
+            )
+        else:
+            ramm_stations.to_json(stations_path, orient="records", indent=2)
+
+    # The debug output is written in the background, while the rest is saved.
+    with ExitStack() as exit_stack:
+        debug_write = None
+        if debug:
+            debug_writer = exit_stack.enter_context(ThreadPoolExecutor(max_workers=1))
+            debug_write = debug_writer.submit(
+                save_debug_stations, ramm_stations, debug_format
+            )
 
-    if debug:
-        for idx, station in ramm_stations.iterrows():
-            station.to_json(
-                DEBUG_OUTPUT_PATH / f"{idx+1:03}_{station.Station}.json", indent=2
+        # Save all species data
+        with stage("json write"), open(
+            WORK_DIR / "Oceans1876" / "species.json", "w"
+        ) as f:
+            json.dump(
+                {
+                    "metadata": GNMetadata(
+                        gnfinder=gnames.app_versions["gnfinder"],
+                        gnverifier=gnames.app_versions["gnverifier"],
+                    ),
+                    "species": all_species_by_record_id,
+                },
+                f,
+                indent=2,
+                cls=PydanticJSONEncoder,
             )
 
-    # Save all species data
-    with open(WORK_DIR / "Oceans1876" / "species.json", "w") as f:
-        json.dump(
-            {
-                "metadata": GNMetadata(
-                    gnfinder=gnames.app_versions["gnfinder"],
-                    gnverifier=gnames.app_versions["gnverifier"],
-                ),
-                "species": all_species_by_record_id,
-            },
-            f,
-            indent=2,
-            cls=PydanticJSONEncoder,
-        )
+        save_manifest(manifest)
+
+        if debug_write is not None:
+            with stage("debug write wait"):
+                debug_write.result()
+
+    timings.save(TIMINGS_PATH / "stations_timings.json")
 
 
 if __name__ == "__main__":
@@ -380,6 +425,49 @@ if __name__ == "__main__":
         action="store_true",
         help="Enable debug logging",
     )
+    parser.add_argument(
+        "--debug-format",
+        choices=["files", "jsonl"],
+        default="files",
+        help="Save the debug output as one JSON file per station, "
+        "or as a single JSON lines file with an index",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of parallel gnfinder/gnverifier calls",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Reprocess all stations, even if their inputs did not change",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "jsonl"],
+        default="json",
+        help="Save the stations as a JSON array (stations.json), or as JSON lines "
+        "with an index of the stations' offsets (stations.jsonl)",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress the JSON lines stations with gzip (stations.jsonl.gz)",
+    )
+    add_profile_argument(parser)
     args = parser.parse_args()
 
-    run(args.debug)
+    if args.compress and args.format != "jsonl":
+        parser.error("--compress requires --format jsonl")
+
+    with profile("process_stations", args.profile):
+        run(
+            args.debug,
+            args.workers,
+            args.full,
+            args.debug_format,
+            args.format,
+            args.compress,
+        )
@@ -11,13 +11,24 @@ import re
 import sys
 import threading
 import time
-from typing import Any, Dict, List, Optional, Tuple, Union, cast
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import cv2 as cv
 import numpy as np
 import pytesseract
 import requests
-from pydantic import ValidationError, parse_file_as
+from pydantic import ValidationError, parse_file_as, parse_obj_as
 
 from data.schemas.data_sources import DataSource, DataSources
 from data.schemas.species.cv import (
@@ -43,6 +54,17 @@ from data.schemas.species.species_index import (
 )
 
 from .gnames import GNames
+from .name_resolver import LocalNameResolver
+from .page_images import (
+    INDEX_PAGES,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_PAGES,
+    PageImageStore,
+    prefetch_pages,
+    read_cropped_page,
+)
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timed, timings
 from .utils import PydanticJSONEncoder
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
@@ -50,7 +72,6 @@ logger = logging.getLogger("Species Extractor")
 
 WORK_DIR = pathlib.Path("./data")
 DATA_SOURCES_FILE_PATH = WORK_DIR / "Oceans1876" / "data_sources.json"
-DATA_PATH = WORK_DIR / "HathiTrust" / "sec.6 v.2" / "images"
 OUTPUT_PATH = WORK_DIR / "Oceans1876"
 
 DEBUG_OUTPUT_PATH = WORK_DIR / "tmp" / "ocr"
@@ -58,15 +79,220 @@ if not DEBUG_OUTPUT_PATH.exists():
     DEBUG_OUTPUT_PATH.mkdir(parents=True)
 
 
-INDEX_PAGES = range(739, 849)
-
 EXTRA_INFO_DATA_SOURCES = ["9", "181"]  # WoRMS  # IRMNG
 
+# With adaptive OCR, lines read from the raw column with a lower mean word
+# confidence (0-100), or that cannot be parsed, are read again denoised,
+# then binarized.
+ADAPTIVE_OCR_MIN_CONFIDENCE = 80
+
+
+SHARDS_PATH = WORK_DIR / "tmp" / "shards"
+
+T = TypeVar("T")
+
+
+def parse_pages(pages: str) -> List[int]:
+    """
+    Parse a list of pages and page ranges, e.g. "739-760,800".
+    """
+    page_numbers: List[int] = []
+    for pages_range in pages.split(","):
+        start, _, end = pages_range.partition("-")
+        page_numbers.extend(range(int(start), int(end or start) + 1))
+    return page_numbers
+
+
+def field(obj: Any, name: str) -> Any:
+    """
+    Get a field of a model, or of its dict (e.g. loaded from index_species.json).
+    """
+    return obj[name] if isinstance(obj, dict) else getattr(obj, name)
+
+
+def order_by_matches(records: Dict[str, T], genera: List[Any]) -> Dict[str, T]:
+    """
+    Order the records (by record id) by the first genus or species matched with
+    them, and then the others by record id. Their order then does not depend on
+    the order in which the verifications finished.
+    """
+    ordered: Dict[str, T] = {}
+    for genus in genera:
+        for taxon in [genus, *field(genus, "species")]:
+            record_id = field(taxon, "matched_species")
+            if record_id in records:
+                ordered.setdefault(record_id, records[record_id])
+    for record_id in sorted(records):
+        ordered.setdefault(record_id, records[record_id])
+    return ordered
+
+
+def save_species_index(
+    metadata: GNMetadata,
+    species: List[Any],
+    species_verified: Dict[str, GNVerifierMatchedSpecies],
+    unverified_lines: Optional[List[SpeciesIndexDebug]] = None,
+) -> None:
+    """
+    Save the genera and species of the index, their verifications,
+    and optionally the lines that could not be parsed.
+    """
+    with stage("json write"):
+        with open(OUTPUT_PATH / "index_species.json", "w") as f:
+            json.dump(
+                {"metadata": metadata, "species": species},
+                f,
+                indent=2,
+                cls=PydanticJSONEncoder,
+            )
+
+        with open(OUTPUT_PATH / "index_species_verified.json", "w") as f:
+            json.dump(
+                {"metadata": metadata, "species": species_verified},
+                f,
+                indent=2,
+                cls=PydanticJSONEncoder,
+            )
+
+        if unverified_lines is not None:
+            with open(OUTPUT_PATH / "index_species_errors.json", "w") as f:
+                json.dump(unverified_lines, f, indent=2, cls=PydanticJSONEncoder)
+
+
+def save_species_extra(
+    metadata: Dict[str, int], species_verified_extra: Dict[str, SpeciesExtraInfo]
+) -> None:
+    with stage("json write"), open(
+        OUTPUT_PATH / "index_species_verified_extra.json", "w"
+    ) as f:
+        json.dump(
+            {"metadata": metadata, "species": species_verified_extra},
+            f,
+            indent=2,
+            cls=PydanticJSONEncoder,
+        )
+
+
+def shard_path(pages: Sequence[int], shard: Optional[Tuple[int, int]]) -> pathlib.Path:
+    if shard:
+        return SHARDS_PATH / f"index_species_shard-{shard[0]}-of-{shard[1]}.json"
+    return SHARDS_PATH / f"index_species_pages-{min(pages)}-{max(pages)}.json"
+
+
+def merge_shards(shard_paths: List[pathlib.Path]) -> None:
+    """
+    Merge the outputs of `process-species` runs on parts of the pages
+    (see `SpeciesProcessor.save_shard`) into the outputs of a run on all of them.
+
+    The lines are processed column by column, and a genus never continues in the
+    next column, so the genera and the unparsed lines of the shards only need to be
+    put back in page and column order. The verifications are de-duplicated by
+    record id and ordered as in a single run, and the metadata is the one of the
+    shard with the first page.
+    """
+    if not shard_paths:
+        sys.exit(f"No shard files to merge (by default, the shards in {SHARDS_PATH})")
+
+    with stage("json read"):
+        path_shards = []
+        for path in shard_paths:
+            with open(path, "r") as f:
+                path_shards.append((path, json.load(f)))
+    path_shards.sort(key=lambda path_shard: min(path_shard[1]["pages"], default=0))
+    shards = [shard for _, shard in path_shards]
+
+    # page -> shard file
+    pages: Dict[int, pathlib.Path] = {}
+    for path, shard in path_shards:
+        overlap = sorted(set(pages).intersection(shard["pages"]))
+        if overlap:
+            sys.exit(
+                f"Pages {overlap} of {path} are also in "
+                f"{', '.join(sorted({str(pages[page]) for page in overlap}))}"
+            )
+        pages.update((page, path) for page in shard["pages"])
+    missing_pages = sorted(set(INDEX_PAGES) - set(pages))
+    if missing_pages:
+        logger.warning(f"Pages {missing_pages} are not in any shard")
+
+    def page_order(debug: SpeciesIndexDebug) -> Tuple[int, int]:
+        return debug.page, debug.column
+
+    species = sorted(
+        parse_obj_as(
+            List[SpeciesIndexGenus], [g for shard in shards for g in shard["species"]]
+        ),
+        key=lambda genus: page_order(genus.debug),
+    )
+    unverified_lines = sorted(
+        parse_obj_as(
+            List[SpeciesIndexDebug], [e for shard in shards for e in shard["errors"]]
+        ),
+        key=page_order,
+    )
+    species_verified: Dict[str, GNVerifierMatchedSpecies] = {}
+    species_verified_extra: Dict[str, SpeciesExtraInfo] = {}
+    for shard in shards:
+        for record_id, verified in shard["species_verified"].items():
+            if record_id not in species_verified:
+                species_verified[record_id] = GNVerifierMatchedSpecies(**verified)
+        for record_id, extra in shard["species_verified_extra"].items():
+            if record_id not in species_verified_extra:
+                species_verified_extra[record_id] = SpeciesExtraInfo(**extra)
+
+    save_species_index(
+        parse_obj_as(GNMetadata, shards[0]["metadata"]),
+        species,
+        order_by_matches(species_verified, species),
+        unverified_lines,
+    )
+    save_species_extra(
+        {
+            "missing": sum(
+                shard["species_verified_extra_metadata"]["missing"] for shard in shards
+            )
+        },
+        order_by_matches(species_verified_extra, species),
+    )
+    logger.info(f"Merged {len(shards)} shards ({len(pages)} pages)")
+
+
+def to_bgr(img: np.ndarray) -> np.ndarray:
+    """
+    Return a BGR copy of the image, to draw in colors on it.
+    """
+    return cv.cvtColor(img, cv.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
+
 
 class SpeciesProcessor:
-    def __init__(self, debug: bool = False):
+    def __init__(
+        self,
+        debug: bool = False,
+        local_resolver: bool = True,
+        adaptive_ocr: bool = False,
+        prefetch: int = PREFETCH_PAGES,
+        prefetch_max_bytes: int = PREFETCH_MAX_BYTES,
+        page_store: bool = False,
+        fuzzy_local_resolver: bool = False,
+    ):
         self.gnames = GNames()
         self.debug = debug
+        self.adaptive_ocr = adaptive_ocr
+        # Pages decoded ahead in the background, and the memory cap of the pages
+        self.prefetch = prefetch
+        self.prefetch_max_bytes = prefetch_max_bytes
+        # Read the pages from the memory-mapped page store instead of the PNGs
+        self.page_store = page_store
+        # Number of OCRed lines, and of lines that needed denoising (adaptive OCR)
+        self.ocr_lines = 0
+        self.expensive_ocr_lines = 0
+        # The names verified in the stations are resolved locally before calling
+        # gnverifier, and with `fuzzy_local_resolver`, the names near them too.
+        self.name_resolver = (
+            LocalNameResolver.from_files(fuzzy=fuzzy_local_resolver)
+            if local_resolver
+            else None
+        )
         self.data_sources = parse_file_as(DataSources, DATA_SOURCES_FILE_PATH)
         self.species: List[SpeciesIndexGenus] = []
         self.species_verified: Dict[str, GNVerifierMatchedSpecies] = {}
@@ -76,35 +302,53 @@ class SpeciesProcessor:
         self.species_verification_threads: List[threading.Thread] = []
         self.species_extra_threads: List[threading.Thread] = []
 
-    def process_species(self) -> None:
+    def process_species(
+        self,
+        page_numbers: Sequence[int] = INDEX_PAGES,
+        output_shard_path: Optional[pathlib.Path] = None,
+    ) -> None:
+        """
+        Process the given pages of the index. If `output_shard_path` is given,
+        the results are saved there, to be merged with the other shards
+        (see `merge_shards`), instead of the output files.
+        """
         start_time = time.time()
 
         try:
-            for page_number in INDEX_PAGES:
-                logger.info(f"Processing page {page_number}")
-                img_path = DATA_PATH / f"{page_number:08}.png"
-
-                img = cv.imread(str(img_path))
-                h, w, _ = img.shape
+            # The pages are cropped (see `page_images.crop_page`), and either
+            # BGR (decoded from the PNGs) or grayscale (from the page store).
+            pages: Iterable[Tuple[int, Optional[np.ndarray]]]
+            if self.page_store:
+                pages = PageImageStore.load(INDEX_PAGES).iter_pages(page_numbers)
+            else:
+                pages = prefetch_pages(
+                    page_numbers,
+                    read_cropped_page,
+                    self.prefetch,
+                    self.prefetch_max_bytes,
+                )
 
-                # Remove part of the white space on the edges.
-                img_cropped = img[350 : h - 350, 200 : w - 150]
-                h_cropped, w_cropped, _ = img_cropped.shape
+            for page_number, img_cropped in pages:
+                logger.info(f"Processing page {page_number}")
+                if img_cropped is None:
+                    logger.warning(f"Could not read the image of page {page_number}")
+                    continue
 
-                # Detect edges
-                img_edged = cv.Canny(img_cropped, 100, 200)
+                with stage("canny/contours"):
+                    # Detect edges
+                    img_edged = cv.Canny(img_cropped, 100, 200)
 
-                # Use a wide kernel(W: 65, H: 20) to turn the main text
-                # on the page into one big blob.
-                img_dilated = cv.dilate(
-                    img_edged,
-                    cv.getStructuringElement(cv.MORPH_RECT, (65, 20)),
-                    iterations=1,
-                )
+                    # Use a wide kernel(W: 65, H: 20) to turn the main text
+                    # on the page into one big blob.
+                    img_dilated = cv.dilate(
+                        img_edged,
+                        cv.getStructuringElement(cv.MORPH_RECT, (65, 20)),
+                        iterations=1,
+                    )
 
-                img_contours, _ = cv.findContours(
-                    img_dilated, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE
-                )
+                    img_contours, _ = cv.findContours(
+                        img_dilated, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE
+                    )
 
                 # Find the biggest contour, which should be the main text.
                 max_area = 0
@@ -123,23 +367,26 @@ class SpeciesProcessor:
                     br_y : br_y + br_height, br_x : br_x + br_width
                 ]
 
-                # Detect edges on the cropped image.
-                img_text_canny = cv.Canny(img_text_cropped, 100, 200)
+                with stage("canny/contours"):
+                    # Detect edges on the cropped image.
+                    img_text_canny = cv.Canny(img_text_cropped, 100, 200)
 
-                # Dilate the objects with a narrow and tall kernel (W: 1, H: 30)
-                # to separate the columns and the lines in between them.
-                img_text_dilated = cv.dilate(
-                    img_text_canny,
-                    cv.getStructuringElement(cv.MORPH_RECT, (1, 30)),
-                    iterations=1,
-                )
+                    # Dilate the objects with a narrow and tall kernel (W: 1, H: 30)
+                    # to separate the columns and the lines in between them.
+                    img_text_dilated = cv.dilate(
+                        img_text_canny,
+                        cv.getStructuringElement(cv.MORPH_RECT, (1, 30)),
+                        iterations=1,
+                    )
 
-                # Find the contours on the dilated img_text.
-                # The bottom 100 pixels are cropped to avoid merging of some texts
-                # at the bottom into the columns.
-                text_contours, _ = cv.findContours(
-                    img_text_dilated[:-100, :], cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE
-                )
+                    # Find the contours on the dilated img_text.
+                    # The bottom 100 pixels are cropped to avoid merging of some
+                    # texts at the bottom into the columns.
+                    text_contours, _ = cv.findContours(
+                        img_text_dilated[:-100, :],
+                        cv.RETR_EXTERNAL,
+                        cv.CHAIN_APPROX_SIMPLE,
+                    )
 
                 # Order the text_contours by area and remove the biggest 3,
                 # which should be the main columns.
@@ -184,15 +431,16 @@ class SpeciesProcessor:
                     separator_lines.append((topmost, bottommost))
 
                 # Rotate the image by mean of the two slopes.
-                rotation_matrix = cv.getRotationMatrix2D(
-                    (br_width // 2, br_height // 2), np.mean(slopes), 1
-                )
-                img_text_rotated = cv.warpAffine(
-                    img_text_cropped,
-                    rotation_matrix,
-                    (br_width, br_height),
-                    borderValue=(255, 255, 255),
-                )
+                with stage("rotation"):
+                    rotation_matrix = cv.getRotationMatrix2D(
+                        (br_width // 2, br_height // 2), np.mean(slopes), 1
+                    )
+                    img_text_rotated = cv.warpAffine(
+                        img_text_cropped,
+                        rotation_matrix,
+                        (br_width, br_height),
+                        borderValue=(255, 255, 255),
+                    )
 
                 # Sort the separator lines by their x-coordinate (from left to right).
                 separator_lines.sort(key=lambda l: (l[0][0], l[1][0]))
@@ -243,10 +491,24 @@ class SpeciesProcessor:
         except Exception as e:
             logger.exception(e)
 
-        self.save_verified_species(save_errors=True)
-        self.save_verified_species_extra()
+        if self.adaptive_ocr and self.ocr_lines:
+            logger.info(
+                f"{self.expensive_ocr_lines} of {self.ocr_lines} lines "
+                f"({self.expensive_ocr_lines / self.ocr_lines:.1%}) needed denoising"
+            )
+
+        if output_shard_path:
+            self.save_shard(output_shard_path, page_numbers)
+        else:
+            self.save_verified_species(save_errors=True)
+            self.save_verified_species_extra()
 
         logger.info(f"Total processing time: {time.time() - start_time}")
+        timings.save(
+            output_shard_path.with_name(f"{output_shard_path.stem}_timings.json")
+            if output_shard_path
+            else TIMINGS_PATH / "index_species_timings.json"
+        )
 
     @staticmethod
     def get_contour_extremities(
@@ -264,39 +526,50 @@ class SpeciesProcessor:
     ) -> None:
         logger.info(f"\tProcessing column {column_number}")
 
-        # Reduce noise.
-        column_denoised = cv.fastNlMeansDenoising(column, None, 7, 21)
+        column_denoised: Optional[np.ndarray] = None
+        if self.adaptive_ocr:
+            # Only the lines that are not read well are denoised (see `read_line`),
+            # and a median blur is enough to find the lines.
+            with stage("median blur"):
+                column_smoothed = cv.medianBlur(column, 5)
+        else:
+            # Reduce noise.
+            with stage("denoise"):
+                column_denoised = cv.fastNlMeansDenoising(column, None, 7, 21)
+            column_smoothed = column_denoised
 
         # Detect edges.
-        column_edges = cv.Canny(column_denoised, 100, 200)
+        with stage("canny/contours"):
+            column_edges = cv.Canny(column_smoothed, 100, 200)
 
         # Find the first column that has text.
         start_column = (
             cv.reduce(column_edges, 0, cv.REDUCE_SUM, dtype=cv.CV_32S) > 2000
         ).argmax()
 
-        h, w, _ = column.shape
+        h, w = column.shape[:2]
 
-        # Dilated the image with a rectangle of size (w / 5, h)
-        # to discover the lines with text. w/5 is a safe value for this purpose.
-        column_dilated = cv.dilate(
-            column_edges,
-            cv.getStructuringElement(cv.MORPH_RECT, (column.shape[1] // 5, 1)),
-            iterations=1,
-        )
+        with stage("canny/contours"):
+            # Dilated the image with a rectangle of size (w / 5, h)
+            # to discover the lines with text. w/5 is a safe value for this purpose.
+            column_dilated = cv.dilate(
+                column_edges,
+                cv.getStructuringElement(cv.MORPH_RECT, (column.shape[1] // 5, 1)),
+                iterations=1,
+            )
 
-        # Find the contours of the text lines. Only do this on the left side
-        # of the image to avoid some noises on the right side.
-        contours, _ = cv.findContours(
-            column_dilated[:, : column.shape[1] // 2],
-            cv.RETR_EXTERNAL,
-            cv.CHAIN_APPROX_SIMPLE,
-        )
+            # Find the contours of the text lines. Only do this on the left side
+            # of the image to avoid some noises on the right side.
+            contours, _ = cv.findContours(
+                column_dilated[:, : column.shape[1] // 2],
+                cv.RETR_EXTERNAL,
+                cv.CHAIN_APPROX_SIMPLE,
+            )
 
         # Sort the contours by their y-coordinate (from top to bottom).
         contours = sorted(contours, key=lambda c: cv.boundingRect(c)[1])
 
-        img_debug = column_denoised.copy() if self.debug else None
+        img_debug = to_bgr(column_smoothed) if self.debug else None
 
         current_genus = None
         current_genus_synonym = None
@@ -329,9 +602,8 @@ class SpeciesProcessor:
 
                 # If the contour start x is less than 2/3 of the start column,
                 # it's a genus. 2/3 is a safe value for this purpose.
-                extracted_text = self.process_line(column_denoised[c_y : c_y + c_h, :])
-                processed_line = self.process_text(
-                    extracted_text, SpeciesIndexLineType.GENUS
+                processed_line = self.read_line(
+                    column, column_denoised, c_y, c_h, SpeciesIndexLineType.GENUS
                 )
 
                 debug_info.texts.append(processed_line.text)
@@ -394,9 +666,8 @@ class SpeciesProcessor:
                     )
 
                 # Otherwise, it's a species, or continuation of previous genus.
-                extracted_text = self.process_line(column_denoised[c_y : c_y + c_h, :])
-                processed_line = self.process_text(
-                    extracted_text, SpeciesIndexLineType.SPECIES
+                processed_line = self.read_line(
+                    column, column_denoised, c_y, c_h, SpeciesIndexLineType.SPECIES
                 )
 
                 debug_info.texts.append(processed_line.text)
@@ -480,10 +751,65 @@ class SpeciesProcessor:
                 img_debug,
             )
 
-    def process_line(self, line: np.ndarray) -> str:
-        text: str = pytesseract.image_to_string(line, config="--psm 7")
+    def read_line(
+        self,
+        column: np.ndarray,
+        column_denoised: Optional[np.ndarray],
+        c_y: int,
+        c_h: int,
+        line_type: SpeciesIndexLineType,
+    ) -> SpeciesIndexProcessedLine:
+        """
+        OCR and parse the line at rows `c_y:c_y + c_h` of the column.
+
+        Without adaptive OCR, the line is read from the denoised column.
+        With adaptive OCR (`column_denoised` is None), it is read from the raw column
+        first, and only if its confidence is below `ADAPTIVE_OCR_MIN_CONFIDENCE` or
+        it cannot be parsed, it is read again denoised, and then binarized.
+        The best reading is kept: parsed first, then the most confident.
+        """
+        self.ocr_lines += 1
+        if column_denoised is not None:
+            return self.process_text(
+                self.process_line(column_denoised[c_y : c_y + c_h, :]), line_type
+            )
 
-        # Clean up the text.
+        def read(line: np.ndarray) -> Tuple[bool, float, SpeciesIndexProcessedLine]:
+            text, confidence = self.process_line_with_confidence(line)
+            processed_line = self.process_text(text, line_type)
+            parsed = (
+                processed_line.type != SpeciesIndexLineType.ERROR
+                and not processed_line.need_verification
+            )
+            return parsed, confidence, processed_line
+
+        line = column[c_y : c_y + c_h, :]
+        best = read(line)
+        if best[0] and best[1] >= ADAPTIVE_OCR_MIN_CONFIDENCE:
+            return best[2]
+
+        self.expensive_ocr_lines += 1
+        timings.count("adaptive ocr denoised lines")
+        with stage("denoise"):
+            line_denoised = cv.fastNlMeansDenoising(line, None, 7, 21)
+        best = max(best, read(line_denoised), key=lambda r: r[:2])
+        if best[0] and best[1] >= ADAPTIVE_OCR_MIN_CONFIDENCE:
+            return best[2]
+
+        timings.count("adaptive ocr binarized lines")
+        with stage("binarize"):
+            _, line_binarized = cv.threshold(
+                cv.cvtColor(line_denoised, cv.COLOR_BGR2GRAY)
+                if line_denoised.ndim == 3
+                else line_denoised,
+                0,
+                255,
+                cv.THRESH_BINARY + cv.THRESH_OTSU,
+            )
+        return max(best, read(line_binarized), key=lambda r: r[:2])[2]
+
+    @staticmethod
+    def clean_text(text: str) -> str:
         # Replace em-dashes with hyphens.
         # Remove left and right single quotes.
         return (
@@ -493,6 +819,35 @@ class SpeciesProcessor:
             .replace("\u2019", "")
         )
 
+    @timed("ocr")
+    def process_line(self, line: np.ndarray) -> str:
+        text: str = pytesseract.image_to_string(line, config="--psm 7")
+
+        # Clean up the text.
+        return self.clean_text(text)
+
+    @timed("ocr")
+    def process_line_with_confidence(self, line: np.ndarray) -> Tuple[str, float]:
+        """
+        OCR the line, and return its text and the mean confidence of its words
+        (0 if no word was recognized).
+        """
+        data = pytesseract.image_to_data(
+            line, config="--psm 7", output_type=pytesseract.Output.DICT
+        )
+        words = [
+            (word, float(confidence))
+            for word, confidence in zip(data["text"], data["conf"])
+            if word.strip() and float(confidence) >= 0
+        ]
+        if not words:
+            return "", 0.0
+        return (
+            self.clean_text(" ".join(word for word, _ in words)),
+            sum(confidence for _, confidence in words) / len(words),
+        )
+
+    @timed("text parsing")
     def process_text(
         self, text: str, line_type: SpeciesIndexLineType
     ) -> SpeciesIndexProcessedLine:
@@ -573,6 +928,8 @@ class SpeciesProcessor:
 
     def retry_text_processing(self) -> None:
         self.load_species()
+        # The verifications of the names that are not processed again are kept.
+        self.load_verified_species()
 
         for genus in self.species:
             debug_info: SpeciesIndexDebug = genus.debug
@@ -655,7 +1012,15 @@ class SpeciesProcessor:
     def verify_species(
         self, name: str, species: Union[SpeciesIndexGenus, SpeciesIndexSpecies]
     ) -> None:
-        verified_species = self.gnames.verify(name)
+        verified_species = (
+            self.name_resolver.resolve(name) if self.name_resolver else None
+        )
+        if verified_species is None:
+            # The new verifications are not added to the resolver, so the results
+            # do not depend on the order of the verifications, or on the pages
+            # processed before (see `merge_shards`).
+            verified_species = self.gnames.verify(name)
+
         result = verified_species.get("bestResult")
         if result:
             record_id = result.get("recordId")
@@ -736,7 +1101,8 @@ class SpeciesProcessor:
             if not records_url:
                 continue
 
-            resp = requests.get(records_url)
+            with stage("http enrichment"):
+                resp = requests.get(records_url)
             if resp.status_code == 200:
                 data = resp.json()
                 if len(data):
@@ -771,7 +1137,8 @@ class SpeciesProcessor:
                             "synonyms_by_id",
                         )
                         if synonyms_url:
-                            resp = requests.get(synonyms_url)
+                            with stage("http enrichment"):
+                                resp = requests.get(synonyms_url)
                             if resp.status_code == 200:
                                 data = resp.json()
                                 if len(data):
@@ -786,7 +1153,8 @@ class SpeciesProcessor:
                             "vernaculars_by_id",
                         )
                         if vernaculars_url:
-                            resp = requests.get(vernaculars_url)
+                            with stage("http enrichment"):
+                                resp = requests.get(vernaculars_url)
                             if resp.status_code == 200:
                                 data = resp.json()
                                 if len(data):
@@ -808,6 +1176,8 @@ class SpeciesProcessor:
 
     def retry_missing_verifications(self) -> None:
         self.load_species()
+        # The new verifications are added to the previous ones.
+        self.load_verified_species()
 
         total_processed = 0
 
@@ -859,7 +1229,9 @@ class SpeciesProcessor:
             )
 
         with open(OUTPUT_PATH / "index_species.json", "r") as f:
-            self.species = json.load(f)["species"]
+            self.species = parse_obj_as(
+                List[SpeciesIndexGenus], json.load(f)["species"]
+            )
 
     def load_verified_species(self) -> None:
         self.species_verified = parse_file_as(
@@ -870,42 +1242,59 @@ class SpeciesProcessor:
         for thread in self.species_verification_threads:
             thread.join()
 
-        metadata = GNMetadata(gnverifier=self.gnames.app_versions["gnverifier"])
+        if self.name_resolver:
+            self.name_resolver.log_hit_rate()
 
-        with open(OUTPUT_PATH / "index_species.json", "w") as f:
-            json.dump(
-                {"metadata": metadata, "species": self.species},
-                f,
-                indent=2,
-                cls=PydanticJSONEncoder,
-            )
+        save_species_index(
+            GNMetadata(gnverifier=self.gnames.app_versions["gnverifier"]),
+            self.species,
+            order_by_matches(self.species_verified, self.species),
+            self.unverified_lines if save_errors else None,
+        )
 
-        with open(OUTPUT_PATH / "index_species_verified.json", "w") as f:
-            json.dump(
-                {"metadata": metadata, "species": self.species_verified},
-                f,
-                indent=2,
-                cls=PydanticJSONEncoder,
-            )
+    def save_verified_species_extra(self) -> None:
+        for thread in self.species_extra_threads:
+            thread.join()
 
-        if save_errors:
-            with open(OUTPUT_PATH / "index_species_errors.json", "w") as f:
-                json.dump(self.unverified_lines, f, indent=2, cls=PydanticJSONEncoder)
+        save_species_extra(
+            self.species_verified_extra_metadata,
+            order_by_matches(self.species_verified_extra, self.species),
+        )
 
-    def save_verified_species_extra(self) -> None:
+    def save_shard(self, path: pathlib.Path, page_numbers: Sequence[int]) -> None:
+        """
+        Save the results of processing part of the pages, to be merged with
+        `merge_shards`.
+        """
+        for thread in self.species_verification_threads:
+            thread.join()
         for thread in self.species_extra_threads:
             thread.join()
 
-        with open(OUTPUT_PATH / "index_species_verified_extra.json", "w") as f:
+        if self.name_resolver:
+            self.name_resolver.log_hit_rate()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with stage("json write"), open(path, "w") as f:
             json.dump(
                 {
-                    "metadata": self.species_verified_extra_metadata,
-                    "species": self.species_verified_extra,
+                    "pages": list(page_numbers),
+                    "metadata": GNMetadata(
+                        gnverifier=self.gnames.app_versions["gnverifier"]
+                    ),
+                    "species": self.species,
+                    "species_verified": self.species_verified,
+                    "species_verified_extra_metadata": (
+                        self.species_verified_extra_metadata
+                    ),
+                    "species_verified_extra": self.species_verified_extra,
+                    "errors": self.unverified_lines,
                 },
                 f,
                 indent=2,
                 cls=PydanticJSONEncoder,
             )
+        logger.info(f"Saved the shard of {len(page_numbers)} pages to {path}")
 
     def save_intermediate_images(
         self,
@@ -914,7 +1303,7 @@ class SpeciesProcessor:
         text_contour: np.ndarray,
         text_contour_bbox: Tuple[int, int, int, int],
     ) -> None:
-        img_debug = img.copy()
+        img_debug = to_bgr(img)
 
         # Draw the bounding rectangle around the main text blob (red).
         br_x, br_y, br_width, br_height = text_contour_bbox
@@ -949,10 +1338,70 @@ if __name__ == "__main__":
         action="store_true",
         help="Saves processed images in `data/tmp` for visual inspection",
     )
+    parser.add_argument(
+        "--adaptive-ocr",
+        action="store_true",
+        help="Only denoise (or binarize) the index lines that are not read "
+        "confidently from the raw scan (process-species)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=PREFETCH_PAGES,
+        help="Number of pages decoded ahead in the background (process-species)",
+    )
+    parser.add_argument(
+        "--prefetch-max-mb",
+        type=int,
+        default=PREFETCH_MAX_BYTES // (1024 * 1024),
+        help="Maximum memory of the decoded pages held at once, in MB "
+        "(process-species)",
+    )
+    parser.add_argument(
+        "--page-store",
+        action="store_true",
+        help="Read the cropped grayscale pages from the memory-mapped page store "
+        "(built if needed, see `workflows.page_images`) instead of the PNGs "
+        "(process-species)",
+    )
+    parser.add_argument(
+        "--no-local-resolver",
+        action="store_true",
+        help="Verify all names with gnverifier, instead of resolving the names "
+        "verified in the stations (species.json) locally",
+    )
+    parser.add_argument(
+        "--fuzzy-local-resolver",
+        action="store_true",
+        help="Also resolve the names within a small edit distance of a single name "
+        "verified in the stations (of the same genus) locally. Every fuzzy match "
+        "is logged",
+    )
     parser_subcommands = parser.add_subparsers(dest="subcommand")
-    parser_subcommands.add_parser(
+    process_species_args = parser_subcommands.add_parser(
         "process-species", help="Process the index and extract species"
     )
+    process_species_args.add_argument(
+        "--pages",
+        type=parse_pages,
+        help="Only process these pages, e.g. 739-760,800, and save the results "
+        "as a shard in `data/tmp/shards`",
+    )
+    process_species_args.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="Only process every N-th page, starting with the I-th (from 0), and "
+        "save the results as a shard in `data/tmp/shards`",
+    )
+    merge_args = parser_subcommands.add_parser(
+        "merge", help="Merge the shards of process-species runs"
+    )
+    merge_args.add_argument(
+        "shards",
+        nargs="*",
+        type=pathlib.Path,
+        help="Shard files (default: all the shards in `data/tmp/shards`)",
+    )
     parser_subcommands.add_parser(
         "process-text",
         help="Process the extracted texts stored in index_species.json",
@@ -970,20 +1419,67 @@ if __name__ == "__main__":
     #     action="store_true",
     #     help="Only get data for species without extra info",
     # )
+    for subcommand_parser in parser_subcommands.choices.values():
+        add_profile_argument(subcommand_parser)
 
     args = parser.parse_args()
     command = args.subcommand
 
+    if not command:
+        parser.print_help()
+        sys.exit()
+
     if args.debug:
         logger.setLevel(logging.DEBUG)
 
-    if not command:
-        parser.print_help()
-    elif command == "process-species":
-        SpeciesProcessor(args.debug).process_species()
-    elif command == "process-text":
-        SpeciesProcessor(args.debug).retry_text_processing()
-    elif command == "verify-species":
-        SpeciesProcessor(args.debug).retry_missing_verifications()
-    elif command == "species-extra":
-        SpeciesProcessor(args.debug).retry_verified_species_extra()
+    page_numbers: Sequence[int] = INDEX_PAGES
+    shard: Optional[Tuple[int, int]] = None
+    if command == "process-species":
+        if args.pages:
+            page_numbers = args.pages
+        if args.shard:
+            shard_match = re.fullmatch(r"(\d+)/(\d+)", args.shard)
+            if not shard_match or int(shard_match[1]) >= int(shard_match[2]):
+                parser.error("--shard must be I/N, with 0 <= I < N")
+            shard = (int(shard_match[1]), int(shard_match[2]))
+            page_numbers = page_numbers[shard[0] :: shard[1]]
+
+    with profile(f"process_summary_report_species_index-{command}", args.profile):
+        if command == "process-species":
+            SpeciesProcessor(
+                args.debug,
+                not args.no_local_resolver,
+                args.adaptive_ocr,
+                args.prefetch,
+                args.prefetch_max_mb * 1024 * 1024,
+                args.page_store,
+                args.fuzzy_local_resolver,
+            ).process_species(
+                page_numbers,
+                shard_path(page_numbers, shard) if args.pages or shard else None,
+            )
+        elif command == "merge":
+            merge_shards(
+                args.shards or sorted(SHARDS_PATH.glob("index_species_*[0-9].json"))
+            )
+        elif command == "process-text":
+            SpeciesProcessor(
+                args.debug,
+                not args.no_local_resolver,
+                fuzzy_local_resolver=args.fuzzy_local_resolver,
+            ).retry_text_processing()
+        elif command == "verify-species":
+            SpeciesProcessor(
+                args.debug,
+                not args.no_local_resolver,
+                fuzzy_local_resolver=args.fuzzy_local_resolver,
+            ).retry_missing_verifications()
+        elif command == "species-extra":
+            SpeciesProcessor(
+                args.debug,
+                not args.no_local_resolver,
+                fuzzy_local_resolver=args.fuzzy_local_resolver,
+            ).retry_verified_species_extra()
+
+    if command != "process-species":
+        timings.save(TIMINGS_PATH / f"index_species_{command}_timings.json")
@@ -0,0 +1,91 @@
+"""
+Shared `--profile` support for the workflow entry points.
+
+`profile` runs a block under cProfile. Threads started while the profiler is active
+get their own profiler, and all of them are merged into one pstats file and a sorted
+text summary in `data/tmp/profiles/<name>-<timestamp>.{pstats,txt}`.
+
+`add_profile_argument` adds `--profile` to the parser of each (sub)command, so it
+is always given last, e.g. `python -m workflows.taxonomy_store update --profile`.
+"""
+import argparse
+import cProfile
+import logging
+import pathlib
+import pstats
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List
+
+logger = logging.getLogger("Profiling")
+
+PROFILES_PATH = pathlib.Path("./data") / "tmp" / "profiles"
+
+PROFILE_SUMMARY_LINES = 100
+
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and save the stats in `data/tmp/profiles`",
+    )
+
+
+@contextmanager
+def profile(name: str, enabled: bool = True) -> Iterator[None]:
+    """
+    Profile the enclosed block and save the results under `PROFILES_PATH`.
+
+    Parameters
+    ----------
+    name: name of the profiled (sub)command, used as the file name prefix
+    enabled: if False, the block runs without profiling
+    """
+    if not enabled:
+        yield
+        return
+
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    basename = PROFILES_PATH / f"{name}-{timestamp}"
+
+    thread_profilers: List[cProfile.Profile] = []
+    thread_profilers_lock = threading.Lock()
+    original_thread_run = threading.Thread.run
+
+    def profiled_thread_run(thread: threading.Thread) -> None:
+        thread_profiler = cProfile.Profile()
+        thread_profiler.enable()
+        try:
+            original_thread_run(thread)
+        finally:
+            thread_profiler.disable()
+            with thread_profilers_lock:
+                thread_profilers.append(thread_profiler)
+
+    threading.Thread.run = profiled_thread_run  # type: ignore
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        threading.Thread.run = original_thread_run  # type: ignore
+
+        stats = pstats.Stats(profiler)
+        with thread_profilers_lock:
+            for thread_profiler in thread_profilers:
+                stats.add(thread_profiler)
+
+        stats.dump_stats(f"{basename}.pstats")
+        with open(f"{basename}.txt", "w") as f:
+            pstats.Stats(f"{basename}.pstats", stream=f).strip_dirs().sort_stats(
+                pstats.SortKey.CUMULATIVE
+            ).print_stats(PROFILE_SUMMARY_LINES)
+
+        logger.info(
+            f"Profile saved to {basename}.pstats ({len(thread_profilers)} threads)"
+        )
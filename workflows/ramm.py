@@ -0,0 +1,233 @@
+"""
+Loads the RAMM stations (`data/RAMM/stations.csv`) with their column types.
+
+The CSV is parsed and typed in one vectorized pass over the whole frame.
+The typed frame is saved as a snapshot in `data/tmp/ramm`, keyed by the hash of
+the CSV and of the column types, so later runs and other tools load the snapshot
+instead of parsing the CSV again, until either of them changes.
+
+The snapshot can also be built manually with `python -m workflows.ramm`.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .profiling import add_profile_argument, profile
+from .timing import stage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("RAMM")
+
+WORK_DIR = pathlib.Path("./data")
+RAMM_STATIONS_PATH = WORK_DIR / "RAMM" / "stations.csv"
+SNAPSHOTS_PATH = WORK_DIR / "tmp" / "ramm"
+
+RAMM_STATION_COLUMN_TYPES = {
+    "Station": "object",
+    "Sediment sample": "object",
+    "Latitude Degrees": "int64",
+    "Latitude Minutes": "int64",
+    "Latitude Seconds": "int64",
+    "North/South": "object",
+    "Longitude Degrees": "int64",
+    "Longitude Minutes": "int64",
+    "Longitude Seconds": "int64",
+    "East/West": "object",
+    "Decimal Longitude": "float64",
+    "Decimal Latitude": "float64",
+    "Location": "object",
+    "FAOarea": "int64",
+    "Water body": "object",
+    "Sea Area": "object",
+    "Place": "object",
+    "Date": "object",
+    "Gear": "object",
+    "Depth (fathoms)": "float64",
+    "Bottom water temperature (C)": "float64",
+    "Bottom temp (F)": "float64",
+    "Bottom water depth D (fathoms)": "float64",
+    "Specific Gravity at bottom": "float64",
+    "Surface temp (C)": "float64",
+    "Surface temp (F)": "float64",
+    "Specific Gravity at surface": "float64",
+    "Temp (F) at 10 Fathoms": "float64",
+    "Temp (F) at 20 Fathoms": "float64",
+    "Temp (F) at 25 Fathoms": "float64",
+    "Temp (F) at 30 Fathoms": "float64",
+    "Temp (F) at 40 Fathoms": "float64",
+    "Temp (F) at 50 Fathoms": "float64",
+    "Temp (F) at 60 Fathoms": "float64",
+    "Temp (F) at 70 Fathoms": "float64",
+    "Temp (F) at 75 Fathoms": "float64",
+    "Temp (F) at 80 Fathoms": "float64",
+    "Temp (F) at 90 Fathoms": "float64",
+    "Temp (F) at 100 Fathoms": "float64",
+    "Temp (F) at 110 Fathoms": "float64",
+    "Temp (F) at 120 Fathoms": "float64",
+    "Temp (F) at 125 Fathoms": "float64",
+    "Temp (F) at 130 Fathoms": "float64",
+    "Temp (F) at 140 Fathoms": "float64",
+    "Temp (F) at 150 Fathoms": "float64",
+    "Temp (F) at 160 Fathoms": "float64",
+    "Temp (F) at 170 Fathoms": "float64",
+    "Temp (F) at 175 Fathoms": "float64",
+    "Temp (F) at 180 Fathoms": "float64",
+    "Temp (F) at 190 Fathoms": "float64",
+    "Temp (F) at 200 Fathoms": "float64",
+    "Temp (F) at 225 Fathoms": "float64",
+    "Temp (F) at 250 Fathoms": "float64",
+    "Temp (F) at 275 Fathoms": "float64",
+    "Temp (F) at 300 Fathoms": "float64",
+    "Temp (F) at 400 Fathoms": "float64",
+    "Temp (F) at 500 Fathoms": "float64",
+    "Temp (F) at 600 Fathoms": "float64",
+    "Temp (F) at 700 Fathoms": "float64",
+    "Temp (F) at 800 Fathoms": "float64",
+    "Temp (F) at 900 Fathoms": "float64",
+    "Temp (F) at 1000 Fathoms": "float64",
+    "Temp (F) at 1100 Fathoms": "float64",
+    "Temp (F) at 1200 Fathoms": "float64",
+    "Temp (F) at 1300 Fathoms": "float64",
+    "Temp (F) at 1330 Fathoms": "float64",
+    "Temp (F) at 1400 Fathoms": "float64",
+    "Temp (F) at 1450 Fathoms": "float64",
+    "Temp (F) at 1500 Fathoms": "float64",
+    "Temp (F) at 1530 Fathoms": "float64",
+    "Temp (F) at 1580 Fathoms": "float64",
+    "Temp (F) at 1600 Fathoms": "float64",
+    "Temp (F) at 1650 Fathoms": "float64",
+    "Temp (F) at 1700 Fathoms": "float64",
+    "Temp (F) at 1725 Fathoms": "float64",
+    "Temp (F) at 1730 Fathoms": "float64",
+    "Temp (F) at 1775 Fathoms": "float64",
+    "Temp (F) at 1780 Fathoms": "float64",
+    "Temp (F) at 1800 Fathoms": "float64",
+    "Temp (F) at 1825 Fathoms": "float64",
+    "Temp (F) at 1850 Fathoms": "float64",
+    "Temp (F) at 1900 Fathoms": "float64",
+    "Temp (F) at 1915 Fathoms": "float64",
+    "Temp (F) at 1980 Fathoms": "float64",
+    "Temp (F) at 2000 Fathoms": "float64",
+    "Temp (F) at 2025 Fathoms": "float64",
+    "Temp (F) at 2100 Fathoms": "float64",
+    "Temp (F) at 2125 Fathoms": "float64",
+    "Temp (F) at 2180 Fathoms": "float64",
+    "Temp (F) at 2200 Fathoms": "float64",
+    "Temp (F) at 2225 Fathoms": "float64",
+    "Temp (F) at 2270 Fathoms": "float64",
+    "Temp (F) at 2300 Fathoms": "float64",
+    "Temp (F) at 2325 Fathoms": "float64",
+    "Temp (F) at 2400 Fathoms": "float64",
+    "Temp (F) at 2425 Fathoms": "float64",
+    "Temp (F) at 2440 Fathoms": "float64",
+    "Temp (F) at 2500 Fathoms": "float64",
+    "Temp (F) at 2525 Fathoms": "float64",
+    "Temp (F) at 2600 Fathoms": "float64",
+    "Temp (F) at 2625 Fathoms": "float64",
+    "Temp (F) at 2650 Fathoms": "float64",
+    "Temp (F) at 2675 Fathoms": "float64",
+    "Temp (F) at 2700 Fathoms": "float64",
+    "Temp (F) at 2775 Fathoms": "float64",
+    "Temp (F) at 2800 Fathoms": "float64",
+    "Temp (F) at 2900 Fathoms": "float64",
+}
+
+
+def parse_ramm_stations(csv: bytes) -> pd.DataFrame:
+    """
+    Parse the RAMM stations CSV and set the types of its columns.
+    Empty and whitespace-only values are missing values.
+
+    Raises
+    ------
+    ValueError: if a column is unknown or its values do not match its type
+    """
+    # Load all columns as string, i.e. dtype="object"
+    ramm_stations = pd.read_csv(io.BytesIO(csv), dtype="object")
+
+    for column in ramm_stations.columns:
+        if column not in RAMM_STATION_COLUMN_TYPES:
+            raise ValueError(f"Error in column {column}: unknown column")
+
+    ramm_stations = ramm_stations.replace(r"^\s*$", np.nan, regex=True)
+
+    column_types = {
+        column: RAMM_STATION_COLUMN_TYPES[column]
+        for column in ramm_stations.columns
+        if RAMM_STATION_COLUMN_TYPES[column] != "object"
+    }
+    try:
+        return ramm_stations.astype(column_types)
+    except (TypeError, ValueError):
+        # Find the offending column for the error message.
+        for column, column_type in column_types.items():
+            try:
+                ramm_stations[column].astype(column_type)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Error in column {column}: {e}") from e
+        raise
+
+
+def snapshot_key(csv: bytes) -> str:
+    sha = hashlib.sha256(csv)
+    sha.update(json.dumps(RAMM_STATION_COLUMN_TYPES, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def load_ramm_stations(
+    ramm_stations_path: pathlib.Path = RAMM_STATIONS_PATH,
+    snapshots_path: pathlib.Path = SNAPSHOTS_PATH,
+) -> pd.DataFrame:
+    """
+    Load the typed RAMM stations from their snapshot,
+    parsing the CSV and saving a new snapshot first if it is missing or stale.
+
+    Raises
+    ------
+    ValueError: if a column is unknown or its values do not match its type
+    """
+    with open(ramm_stations_path, "rb") as f:
+        csv = f.read()
+
+    snapshot_path = (
+        snapshots_path / f"{ramm_stations_path.stem}-{snapshot_key(csv)}.pkl"
+    )
+    if snapshot_path.exists():
+        with stage("ramm snapshot read"):
+            return pd.read_pickle(snapshot_path)
+
+    with stage("ramm parse"):
+        ramm_stations = parse_ramm_stations(csv)
+
+    with stage("ramm snapshot write"):
+        snapshots_path.mkdir(parents=True, exist_ok=True)
+        # Only the snapshot of the current CSV is kept.
+        for stale_snapshot in snapshots_path.glob(f"{ramm_stations_path.stem}-*.pkl"):
+            stale_snapshot.unlink()
+        tmp_path = snapshot_path.with_suffix(".tmp")
+        ramm_stations.to_pickle(tmp_path)
+        os.replace(tmp_path, snapshot_path)
+
+    logger.info(f"Saved the typed RAMM stations snapshot to {snapshot_path}")
+
+    return ramm_stations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile("ramm", args.profile):
+        try:
+            load_ramm_stations()
+        except ValueError as e:
+            sys.exit(str(e))
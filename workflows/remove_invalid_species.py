@@ -1,37 +1,199 @@
+"""
+Removes the species listed in `data/Oceans1876/invalid_species_names.json`
+from the stations and species data.
+
+The stations and species files are streamed record by record, filtered against
+a set of the normalized invalid names, and replaced atomically once they are
+written in full. The number of species removed from each station is saved in
+`data/Oceans1876/remove_invalid_species_report.json`.
+"""
+import argparse
 import json
+import logging
+import os
+import pathlib
+import tempfile
+from typing import Any, Dict, Iterator, Set, Tuple
+
+from .json_stream import JSONStreamReader, JSONStreamWriter
+from .jsonl import index_path, is_compressed, iter_records, write_jsonl
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Remove Invalid Species")
+
+WORK_DIR = pathlib.Path("./data")
+INVALID_SPECIES_NAMES_PATH = WORK_DIR / "Oceans1876" / "invalid_species_names.json"
+STATIONS_PATH = WORK_DIR / "Oceans1876" / "stations.json"
+SPECIES_PATH = WORK_DIR / "Oceans1876" / "species.json"
+REPORT_PATH = WORK_DIR / "Oceans1876" / "remove_invalid_species_report.json"
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a species name for comparison:
+    collapse whitespace and ignore case.
+    """
+    return " ".join(name.split()).casefold()
+
+
+def load_invalid_species_names(
+    path: pathlib.Path = INVALID_SPECIES_NAMES_PATH,
+) -> Set[str]:
+    with open(path, "r") as f:
+        return {normalize_name(name) for name in json.load(f)}
+
+
+def is_valid(species: Dict[str, Any], invalid_species_names: Set[str]) -> bool:
+    return normalize_name(species["name"]) not in invalid_species_names
+
 
+def temporary_path(path: pathlib.Path) -> pathlib.Path:
+    """
+    Create an empty temporary file next to `path`,
+    so it can replace `path` atomically.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    os.close(fd)
+    # Keep the permissions of the replaced file, not the private ones of mkstemp.
+    os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+    return pathlib.Path(tmp_path)
 
-def remove_invalid_species() -> None:
-    with open("data/Oceans1876/invalid_species_names.json", "r") as f:
-        invalid_species_names = json.load(f)
 
-    with open("data/Oceans1876/stations.json", "r") as f:
-        stations = json.load(f)
+def filter_stations(
+    invalid_species_names: Set[str],
+    stations_path: pathlib.Path = STATIONS_PATH,
+) -> Dict[str, int]:
+    """
+    Remove the invalid species from every station.
+    JSON arrays (`stations.json`) and JSON lines (`stations.jsonl[.gz]`) are supported.
 
-    for station in stations:
-        invalid_species = []
-        for species in station["Species"]:
-            if species["name"] in invalid_species_names:
-                invalid_species.append(species)
-        for species in invalid_species:
-            station["Species"].remove(species)
+    Returns
+    -------
+    station name -> number of removed species
+    """
+    removed: Dict[str, int] = {}
 
-    with open("data/Oceans1876/stations.json", "w") as f:
-        json.dump(stations, f, indent=4)
+    def filtered_stations() -> Iterator[Dict[str, Any]]:
+        for station in iter_records(stations_path):
+            if station["Species"] is not None:
+                species = [
+                    sp
+                    for sp in station["Species"]
+                    if is_valid(sp, invalid_species_names)
+                ]
+                removed[station["Station"]] = len(station["Species"]) - len(species)
+                station["Species"] = species
+            yield station
 
-    with open("data/Oceans1876/species.json", "r") as f:
-        species = json.load(f)
+    tmp_path = temporary_path(stations_path)
+    try:
+        if ".jsonl" in stations_path.suffixes:
+            write_jsonl(
+                tmp_path,
+                ((s["Station"], json.dumps(s)) for s in filtered_stations()),
+                is_compressed(stations_path),
+            )
+            os.replace(index_path(tmp_path), index_path(stations_path))
+        else:
+            with open(tmp_path, "w") as f:
+                writer = JSONStreamWriter(f)
+                writer.begin_array()
+                for station in filtered_stations():
+                    writer.value(station)
+                writer.end()
+        os.replace(tmp_path, stations_path)
+    finally:
+        for path in (tmp_path, index_path(tmp_path)):
+            if path.exists():
+                path.unlink()
 
-    invalid_species = []
-    for record_id, sp in species["species"].items():
-        if sp["name"] in invalid_species_names:
-            invalid_species.append(record_id)
-    for record_id in invalid_species:
-        del species["species"][record_id]
+    return removed
 
-    with open("data/Oceans1876/species.json", "w") as f:
-        json.dump(species, f, indent=4)
+
+def filter_species(
+    invalid_species_names: Set[str], species_path: pathlib.Path = SPECIES_PATH
+) -> int:
+    """
+    Remove the invalid species from the species data.
+
+    Returns
+    -------
+    number of removed species
+    """
+    removed = 0
+
+    def filtered_species(
+        reader: JSONStreamReader,
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        nonlocal removed
+        for record_id in reader.iter_object():
+            species = reader.value()
+            if is_valid(species, invalid_species_names):
+                yield record_id, species
+            else:
+                removed += 1
+
+    tmp_path = temporary_path(species_path)
+    try:
+        with open(species_path, "r") as src, open(tmp_path, "w") as dst:
+            reader = JSONStreamReader(src)
+            writer = JSONStreamWriter(dst)
+            writer.begin_object()
+            for key in reader.iter_object():
+                if key == "species":
+                    writer.begin_object(key)
+                    for record_id, species in filtered_species(reader):
+                        writer.value(species, record_id)
+                    writer.end()
+                else:
+                    writer.value(reader.value(), key)
+            writer.end()
+        os.replace(tmp_path, species_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return removed
+
+
+def remove_invalid_species(
+    stations_path: pathlib.Path = STATIONS_PATH,
+    species_path: pathlib.Path = SPECIES_PATH,
+) -> None:
+    with stage("json read"):
+        invalid_species_names = load_invalid_species_names()
+
+    with stage("stations filter"):
+        removed_by_station = filter_stations(invalid_species_names, stations_path)
+    for station, removed in removed_by_station.items():
+        if removed:
+            logger.info(f"Removed {removed} invalid species from station {station}")
+
+    with stage("species filter"):
+        removed_species = filter_species(invalid_species_names, species_path)
+    logger.info(
+        f"Removed {sum(removed_by_station.values())} invalid species from "
+        f"{sum(1 for r in removed_by_station.values() if r)} stations, "
+        f"and {removed_species} from {species_path}"
+    )
+
+    with stage("json write"), open(REPORT_PATH, "w") as f:
+        json.dump(removed_by_station, f, indent=2)
 
 
 if __name__ == "__main__":
-    remove_invalid_species()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stations",
+        type=pathlib.Path,
+        default=STATIONS_PATH,
+        help="Stations file, either a JSON array or JSON lines (optionally gzipped)",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile("remove_invalid_species", args.profile):
+        remove_invalid_species(args.stations)
+    timings.save(TIMINGS_PATH / "remove_invalid_species_timings.json")
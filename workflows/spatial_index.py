@@ -0,0 +1,329 @@
+"""
+Spatial index over the stations' positions (`Decimal Latitude/Longitude`).
+
+`process_stations` saves the positions bucketed in a regular latitude/longitude grid
+in `data/Oceans1876/stations_spatial_index.npz`: the stations are sorted by grid cell,
+and `cell_offsets` gives the range of each cell's stations, so the stations of any
+cell are one slice. An STRtree (`geopandas` spatial index) is built over the points
+when the index is loaded.
+
+Bounding box lookups use the STRtree, and k-nearest lookups visit the grid cells in
+the order of their minimum (great-circle) distance to the query point.
+
+`python -m workflows.spatial_index benchmark` compares both with a linear scan.
+"""
+import argparse
+import logging
+import math
+import pathlib
+import time
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+from .profiling import add_profile_argument, profile
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Spatial Index")
+
+WORK_DIR = pathlib.Path("./data")
+SPATIAL_INDEX_PATH = WORK_DIR / "Oceans1876" / "stations_spatial_index.npz"
+
+GRID_CELL_DEGREES = 5.0
+EARTH_RADIUS_KM = 6371.0088
+
+
+def wrap_lon(lon: float) -> float:
+    """
+    Wrap a longitude into [-180, 180).
+    """
+    return (lon + 180) % 360 - 180
+
+
+def haversine_km(
+    lat1: Any, lon1: Any, lat2: np.ndarray, lon2: np.ndarray
+) -> np.ndarray:
+    """
+    Great-circle distance in km between (lat1, lon1) and each of (lat2, lon2).
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class StationsSpatialIndex:
+    """
+    The stations' positions, bucketed in a grid of `cell_degrees` cells.
+
+    `stations`, `lat` and `lon` are sorted by grid cell, and the stations in cell
+    `c` (row `c // cols`, from latitude -90, and column `c % cols`, from
+    longitude -180) are `cell_offsets[c]:cell_offsets[c + 1]`.
+    """
+
+    def __init__(
+        self,
+        stations: np.ndarray,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        cell_degrees: float = GRID_CELL_DEGREES,
+    ):
+        self.cell_degrees = cell_degrees
+        self.rows = math.ceil(180 / cell_degrees)
+        self.cols = math.ceil(360 / cell_degrees)
+
+        cells = self.cell(lat, lon)
+        order = np.argsort(cells, kind="stable")
+        self.stations = stations[order]
+        self.lat = lat[order]
+        self.lon = lon[order]
+        self.cells = cells[order]
+        self.cell_offsets = np.searchsorted(
+            self.cells, np.arange(self.rows * self.cols + 1)
+        )
+
+        self._sindex: Optional[Any] = None
+
+    def cell(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        rows = np.clip(((lat + 90) // self.cell_degrees).astype(int), 0, self.rows - 1)
+        cols = ((lon + 180) // self.cell_degrees).astype(int) % self.cols
+        return rows * self.cols + cols
+
+    @classmethod
+    def from_ramm_stations(cls, ramm_stations: pd.DataFrame) -> "StationsSpatialIndex":
+        """
+        Index the (typed) RAMM stations that have a position.
+        """
+        positioned = ramm_stations.dropna(
+            subset=["Decimal Latitude", "Decimal Longitude"]
+        )
+        return cls(
+            positioned["Station"].to_numpy(dtype=str),
+            positioned["Decimal Latitude"].to_numpy(dtype=np.float64),
+            positioned["Decimal Longitude"].to_numpy(dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, path: pathlib.Path = SPATIAL_INDEX_PATH) -> "StationsSpatialIndex":
+        with np.load(path) as index:
+            return cls(
+                index["stations"],
+                index["lat"],
+                index["lon"],
+                float(index["cell_degrees"]),
+            )
+
+    def save(self, path: pathlib.Path = SPATIAL_INDEX_PATH) -> None:
+        np.savez_compressed(
+            path,
+            stations=self.stations,
+            lat=self.lat,
+            lon=self.lon,
+            cell_degrees=self.cell_degrees,
+            cell_offsets=self.cell_offsets,
+        )
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    @property
+    def sindex(self) -> Any:
+        """
+        STRtree over the stations' points (x = longitude, y = latitude).
+        """
+        if self._sindex is None:
+            self._sindex = gpd.GeoSeries(gpd.points_from_xy(self.lon, self.lat)).sindex
+        return self._sindex
+
+    def bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        """
+        Return the names of the stations within the bounding box (inclusive).
+        The box crosses the antimeridian if `min_lon` > `max_lon`
+        (e.g. from 170 to -170), and is then queried as two boxes.
+        """
+        if min_lon <= max_lon:
+            boxes = [box(min_lon, min_lat, max_lon, max_lat)]
+        else:
+            boxes = [
+                box(min_lon, min_lat, 180, max_lat),
+                box(-180, min_lat, max_lon, max_lat),
+            ]
+        indices = np.unique(
+            np.concatenate([self.sindex.query(b) for b in boxes]).astype(np.intp)
+        )
+        return self.stations[indices]
+
+    def nearest(
+        self, lat: float, lon: float, k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the names of the `k` stations nearest to the given position,
+        and their great-circle distances in km, nearest first.
+        """
+        k = min(k, len(self))
+        if not k:
+            return self.stations[:0], np.empty(0)
+
+        # The k-th distance to the stations of the nearest cells (by their minimum
+        # distance to the position) bounds the k-th nearest distance: only the cells
+        # whose minimum distance is within it can hold the k nearest stations.
+        cells = np.flatnonzero(np.diff(self.cell_offsets))
+        bounds = self._cell_min_distances_km(cells, lat, lon)
+        order = np.argsort(bounds, kind="stable")
+        cells, bounds = cells[order], bounds[order]
+
+        counts = np.cumsum(self.cell_offsets[cells + 1] - self.cell_offsets[cells])
+        first_cells = int(np.searchsorted(counts, k)) + 1
+        candidates = self._cells_stations(cells[:first_cells])
+        distances = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        max_distance = np.partition(distances, k - 1)[k - 1]
+
+        candidates = self._cells_stations(
+            cells[: np.searchsorted(bounds, max_distance, side="right")]
+        )
+        distances = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        nearest = np.argsort(distances, kind="stable")[:k]
+        return self.stations[candidates[nearest]], distances[nearest]
+
+    def _cells_stations(self, cells: np.ndarray) -> np.ndarray:
+        """
+        Return the indices of the stations in the given cells.
+        """
+        return np.concatenate(
+            [
+                np.arange(self.cell_offsets[cell], self.cell_offsets[cell + 1])
+                for cell in cells
+            ]
+        )
+
+    def _cell_min_distances_km(
+        self, cells: np.ndarray, lat: float, lon: float
+    ) -> np.ndarray:
+        """
+        Lower bounds of the great-circle distances between the position and any
+        point of the given cells.
+
+        A point whose latitude differs by at least dlat, or whose longitude differs
+        by at least dlon, is at least dlat, or asin(cos(lat) * sin(min(dlon, 90))),
+        away (in radians).
+        """
+        rows, cols = np.divmod(cells, self.cols)
+        min_lats = rows * self.cell_degrees - 90
+        min_lons = cols * self.cell_degrees - 180
+
+        dlat = np.maximum(
+            np.maximum(min_lats - lat, lat - min_lats - self.cell_degrees), 0
+        )
+
+        # Longitude distance to the nearest edge of each cell, on the circle
+        to_min = (min_lons - lon) % 360
+        to_max = (lon - min_lons - self.cell_degrees) % 360
+        inside = to_min + to_max > 360
+        dlon = np.where(inside, 0, np.minimum(to_min, to_max))
+
+        lon_bounds = np.arcsin(
+            np.cos(np.radians(lat)) * np.sin(np.radians(np.minimum(dlon, 90)))
+        )
+        return EARTH_RADIUS_KM * np.maximum(np.radians(dlat), lon_bounds)
+
+    def linear_bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        """
+        Same as `bbox`, scanning all the stations (for benchmarks).
+        """
+        in_lon_range = (
+            (self.lon >= min_lon) & (self.lon <= max_lon)
+            if min_lon <= max_lon
+            else (self.lon >= min_lon) | (self.lon <= max_lon)
+        )
+        return self.stations[
+            (self.lat >= min_lat) & (self.lat <= max_lat) & in_lon_range
+        ]
+
+    def linear_nearest(
+        self, lat: float, lon: float, k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same as `nearest`, computing the distances to all the stations (for benchmarks).
+        """
+        distances = haversine_km(lat, lon, self.lat, self.lon)
+        nearest = np.argsort(distances, kind="stable")[:k]
+        return self.stations[nearest], distances[nearest]
+
+
+def benchmark(
+    index: StationsSpatialIndex, queries: int = 1000, k: int = 5, seed: int = 0
+) -> None:
+    """
+    Time the bounding box and k-nearest lookups against linear scans over
+    random queries, and check that they return the same stations.
+    """
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-80, 80, queries)
+    lons = rng.uniform(-180, 180, queries)
+    sizes = rng.uniform(1, 30, queries)
+    # The boxes near the antimeridian wrap around it.
+    bboxes = [
+        (lat - size, wrap_lon(lon - size), lat + size, wrap_lon(lon + size))
+        for lat, lon, size in zip(lats, lons, sizes)
+    ]
+    index.sindex  # Build the STRtree outside the timings
+
+    def compare(
+        name: str,
+        lookup: Callable[..., Any],
+        linear_lookup: Callable[..., Any],
+        queries_args: Sequence[tuple],
+        stations: Callable[[Any], np.ndarray],
+    ) -> None:
+        start = time.perf_counter()
+        results = [lookup(*query_args) for query_args in queries_args]
+        index_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        linear_results = [linear_lookup(*query_args) for query_args in queries_args]
+        linear_time = time.perf_counter() - start
+
+        mismatches = sum(
+            not np.array_equal(np.sort(stations(r)), np.sort(stations(lr)))
+            for r, lr in zip(results, linear_results)
+        )
+        logger.info(
+            f"{name}: {queries} queries over {len(index)} stations, "
+            f"index {index_time * 1000:.1f}ms, linear scan {linear_time * 1000:.1f}ms, "
+            f"{mismatches} mismatches"
+        )
+
+    compare("bbox", index.bbox, index.linear_bbox, bboxes, lambda r: r)
+    compare(
+        f"{k}-nearest",
+        index.nearest,
+        index.linear_nearest,
+        [(lat, lon, k) for lat, lon in zip(lats, lons)],
+        # The nearest lookups return (stations, distances).
+        lambda r: r[0],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    benchmark_parser = subparsers.add_parser(
+        "benchmark", help="Compare the index lookups with linear scans"
+    )
+    benchmark_parser.add_argument("--queries", type=int, default=1000)
+    benchmark_parser.add_argument("-k", type=int, default=5)
+    benchmark_parser.add_argument("--seed", type=int, default=0)
+    add_profile_argument(benchmark_parser)
+    args = parser.parse_args()
+
+    with profile("spatial_index_benchmark", args.profile):
+        benchmark(StationsSpatialIndex.load(), args.queries, args.k, args.seed)
@@ -0,0 +1,186 @@
+"""
+Locates where each station's text starts in the HathiTrust corpus.
+
+All the station text identifiers are searched for together, in a single pass over
+the pages where they are expected to start. Each page is scanned once for the
+n-grams of all the identifiers expected on it, and only the regions with enough
+shared n-grams (q-gram lemma) are verified with an approximate (Levenshtein)
+substring search.
+"""
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .hathitrust_corpus import HathiTrustCorpus
+from .timing import stage
+
+NGRAM_SIZE = 2
+
+
+class Match(NamedTuple):
+    start: int  # inclusive, in characters
+    end: int  # exclusive, in characters
+    dist: int  # Levenshtein distance
+
+
+class StationBoundary(NamedTuple):
+    section: str
+    page: int  # page file number
+    offset: int  # where the station text starts in the corpus, in bytes
+    dist: int
+
+
+def best_approximate_match(
+    pattern: str, text: str, max_dist: int, text_offset: int = 0
+) -> Optional[Match]:
+    """
+    Find the occurrence of `pattern` in `text` with the smallest Levenshtein
+    distance (not more than `max_dist`). Ties are resolved by the earliest end.
+    The returned positions are shifted by `text_offset`.
+    """
+    pattern_length = len(pattern)
+    if not pattern_length:
+        return None
+
+    # Distances and start positions of the pattern prefixes
+    # for the text consumed so far (Sellers' algorithm).
+    distances = list(range(pattern_length + 1))
+    starts = [0] * (pattern_length + 1)
+    best = None
+
+    for text_idx, char in enumerate(text):
+        current_distances = [0] * (pattern_length + 1)
+        current_starts = [text_idx + 1] * (pattern_length + 1)
+        for i in range(1, pattern_length + 1):
+            current_distances[i] = distances[i - 1] + (pattern[i - 1] != char)
+            current_starts[i] = starts[i - 1]
+            if distances[i] + 1 < current_distances[i]:
+                current_distances[i] = distances[i] + 1
+                current_starts[i] = starts[i]
+            if current_distances[i - 1] + 1 < current_distances[i]:
+                current_distances[i] = current_distances[i - 1] + 1
+                current_starts[i] = current_starts[i - 1]
+
+        dist = current_distances[pattern_length]
+        if dist <= max_dist and (best is None or dist < best.dist):
+            best = Match(
+                current_starts[pattern_length] + text_offset,
+                text_idx + 1 + text_offset,
+                dist,
+            )
+            if not dist:
+                break
+
+        distances, starts = current_distances, current_starts
+
+    return best
+
+
+def locate_patterns(
+    text: str, patterns: Sequence[str], max_dist: int, ngram_size: int = NGRAM_SIZE
+) -> List[Optional[Match]]:
+    """
+    Find the best approximate match of every pattern in `text`,
+    scanning the text once for the n-grams of all the patterns.
+
+    An occurrence of a pattern of length m with at most k edits shares at least
+    m - n + 1 - k * n of the pattern's n-grams, all on diagonals
+    (text position - pattern position) within a band of width 2k.
+    Only the regions around such bands are verified. Patterns that are too short
+    for this bound to be positive are verified against the whole text.
+    """
+    ngrams: Dict[str, List[Tuple[int, int]]] = {}
+    thresholds = []
+    for pattern_idx, pattern in enumerate(patterns):
+        thresholds.append(len(pattern) - ngram_size + 1 - max_dist * ngram_size)
+        for i in range(len(pattern) - ngram_size + 1):
+            ngrams.setdefault(pattern[i : i + ngram_size], []).append((pattern_idx, i))
+
+    diagonals: List[List[int]] = [[] for _ in patterns]
+    for i in range(len(text) - ngram_size + 1):
+        for pattern_idx, pattern_position in ngrams.get(text[i : i + ngram_size], ()):
+            diagonals[pattern_idx].append(i - pattern_position)
+
+    matches: List[Optional[Match]] = []
+    for pattern_idx, pattern in enumerate(patterns):
+        if thresholds[pattern_idx] <= 0:
+            matches.append(best_approximate_match(pattern, text, max_dist))
+            continue
+
+        # Find the bands of diagonals with enough n-grams
+        # and merge their (overlapping) text regions.
+        pattern_diagonals = sorted(diagonals[pattern_idx])
+        regions: List[List[int]] = []
+        band_start = 0
+        for band_end, diagonal in enumerate(pattern_diagonals):
+            while diagonal - pattern_diagonals[band_start] > 2 * max_dist:
+                band_start += 1
+            if band_end - band_start + 1 >= thresholds[pattern_idx]:
+                region_start = max(0, pattern_diagonals[band_start] - max_dist)
+                region_end = diagonal + len(pattern) + max_dist
+                if regions and region_start <= regions[-1][1]:
+                    regions[-1][1] = max(regions[-1][1], region_end)
+                else:
+                    regions.append([region_start, region_end])
+
+        best = None
+        for region_start, region_end in regions:
+            match = best_approximate_match(
+                pattern, text[region_start:region_end], max_dist, region_start
+            )
+            if match and (best is None or match.dist < best.dist):
+                best = match
+        matches.append(best)
+
+    return matches
+
+
+def locate_station_boundaries(
+    corpus: HathiTrustCorpus,
+    stations: Dict[str, Tuple[str, int]],
+    max_dist: int,
+) -> Dict[str, Optional[StationBoundary]]:
+    """
+    Find where each station starts in the corpus.
+
+    Parameters
+    ----------
+    corpus: the HathiTrust corpus
+    stations: text identifier -> (section, page file number) of the page
+        where the station is expected to start
+    max_dist: maximum Levenshtein distance between a text identifier and its match
+
+    Returns
+    -------
+    text identifier -> boundary of the station,
+    or None if the text identifier was not found
+    """
+    stations_by_page: Dict[Tuple[str, int], List[str]] = {}
+    for text_identifier, start_page in stations.items():
+        stations_by_page.setdefault(start_page, []).append(text_identifier)
+
+    boundaries: Dict[str, Optional[StationBoundary]] = {
+        text_identifier: None for text_identifier in stations
+    }
+
+    # Visit the pages in the corpus order, so the corpus is read sequentially.
+    page_spans = {p: corpus.page_span(*p) for p in stations_by_page}
+    for (section, page), page_span in sorted(
+        page_spans.items(), key=lambda p: p[1] or (-1, 0)
+    ):
+        if page_span is None:
+            continue
+        page_text = corpus.text(page_span)
+        page_offset = page_span[0]
+        text_identifiers = stations_by_page[(section, page)]
+        with stage("station name search"):
+            matches = locate_patterns(page_text, text_identifiers, max_dist)
+        for text_identifier, match in zip(text_identifiers, matches):
+            if match:
+                boundaries[text_identifier] = StationBoundary(
+                    section,
+                    page,
+                    # The corpus offsets are in bytes, not characters.
+                    page_offset + len(page_text[: match.start].encode("utf-8")),
+                    match.dist,
+                )
+
+    return boundaries
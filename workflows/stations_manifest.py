@@ -0,0 +1,153 @@
+"""
+Manifest of the inputs used for each station by `process_stations`.
+
+For every station text identifier, the manifest records the hashes of the
+HathiTrust pages in its range, of its extracted text and of its RAMM rows.
+Together with the gnfinder/gnverifier versions, these decide which stations must be
+reprocessed on the next run. The species of the other stations are carried forward
+from the previous `stations.json` and `species.json`.
+"""
+import hashlib
+import json
+import logging
+import pathlib
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+from .hathitrust_corpus import HathiTrustCorpus, parse_pages_range
+from .jsonl import iter_records
+
+logger = logging.getLogger("Stations Manifest")
+
+WORK_DIR = pathlib.Path("./data")
+MANIFEST_PATH = WORK_DIR / "Oceans1876" / "stations_manifest.json"
+STATIONS_PATH = WORK_DIR / "Oceans1876" / "stations.json"
+SPECIES_PATH = WORK_DIR / "Oceans1876" / "species.json"
+
+# Bump this when a change in `process_stations` invalidates previous results.
+MANIFEST_VERSION = 1
+
+
+def build_stations_manifest(
+    app_versions: Dict[str, str],
+    hathitrust_stations: pd.DataFrame,
+    ramm_stations: pd.DataFrame,
+    corpus: HathiTrustCorpus,
+    stations_texts: Dict[str, str],
+    stations_path: pathlib.Path = STATIONS_PATH,
+) -> Dict[str, Any]:
+    """
+    Hash the inputs of every station.
+
+    Parameters
+    ----------
+    app_versions: gnfinder and gnverifier versions (see `GNames.app_versions`)
+    hathitrust_stations: HathiTrust stations, with their page ranges parsed
+    ramm_stations: typed RAMM stations
+    corpus: the HathiTrust corpus
+    stations_texts: station text identifier -> station text
+    stations_path: where the updated RAMM stations are saved
+    """
+    ramm_hashes = dict(
+        zip(
+            ramm_stations["Station"],
+            pd.util.hash_pandas_object(ramm_stations, index=False).map(
+                lambda h: f"{h:016x}"
+            ),
+        )
+    )
+
+    stations = {}
+    for text_identifier, rows in hathitrust_stations.groupby(
+        "Text Identifier", sort=False
+    ):
+        pages_hash = hashlib.sha256()
+        for section, pages in rows.iloc[0]["Range"]:
+            start_page, end_page = parse_pages_range(pages)
+            # Page files are numbered from zero.
+            for span in corpus.page_spans(section, start_page - 1, end_page - 1):
+                pages_hash.update(corpus.slice(span))
+
+        stations[text_identifier] = {
+            "pages": pages_hash.hexdigest(),
+            "text": hashlib.sha256(
+                stations_texts.get(text_identifier, "").encode("utf-8")
+            ).hexdigest(),
+            "ramm": hashlib.sha256(
+                "".join(ramm_hashes.get(s, "") for s in rows["Station"]).encode()
+            ).hexdigest(),
+        }
+
+    return {
+        "version": MANIFEST_VERSION,
+        "gnfinder": app_versions["gnfinder"],
+        "gnverifier": app_versions["gnverifier"],
+        "stations_path": str(stations_path),
+        "stations": stations,
+    }
+
+
+def load_previous_run(
+    manifest: Dict[str, Any],
+    manifest_path: pathlib.Path = MANIFEST_PATH,
+    species_path: pathlib.Path = SPECIES_PATH,
+) -> Tuple[Dict[str, List[dict]], Dict[str, dict]]:
+    """
+    Load the results of the previous run for the stations whose inputs
+    have not changed since then.
+    The previous stations are read from the file recorded in its manifest.
+
+    Returns
+    -------
+    species of the unchanged stations by their text identifier,
+    and all the previously verified species by record id
+    """
+    previous_manifest = None
+    if manifest_path.exists() and species_path.exists():
+        with open(manifest_path, "r") as f:
+            previous_manifest = json.load(f)
+    stations_path = pathlib.Path(
+        (previous_manifest or {}).get("stations_path", STATIONS_PATH)
+    )
+    if previous_manifest is None or not stations_path.exists():
+        logger.info("No previous run found, processing all stations")
+        return {}, {}
+
+    for key in ("version", "gnfinder", "gnverifier"):
+        if previous_manifest.get(key) != manifest[key]:
+            logger.info(
+                f"{key} changed from {previous_manifest.get(key)} to {manifest[key]}, "
+                "processing all stations"
+            )
+            return {}, {}
+
+    unchanged = {
+        text_identifier
+        for text_identifier, hashes in manifest["stations"].items()
+        if previous_manifest["stations"].get(text_identifier) == hashes
+    }
+
+    stations_species: Dict[str, List[dict]] = {}
+    for station in iter_records(stations_path):
+        hathitrust = station.get("HathiTrust")
+        if (
+            hathitrust
+            and hathitrust["Text Identifier"] in unchanged
+            and station.get("Species") is not None
+        ):
+            stations_species.setdefault(
+                hathitrust["Text Identifier"], station["Species"]
+            )
+
+    with open(species_path, "r") as f:
+        previous_species = json.load(f)["species"]
+
+    return stations_species, previous_species
+
+
+def save_manifest(
+    manifest: Dict[str, Any], manifest_path: pathlib.Path = MANIFEST_PATH
+) -> None:
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
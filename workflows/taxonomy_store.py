@@ -0,0 +1,738 @@
+"""
+SQLite store of the species data of all the workflows, in `data/Oceans1876/taxonomy.db`.
+
+The store is updated from the output files of the workflows (see `SOURCES`):
+- `species.json` and `index_species_verified.json` -> `verifications`
+- `stations.json` (the species of each station) -> `station_species`
+- `index_species.json` (genera and species of the summary report index) -> `index_taxa`
+- `index_species_verified_extra.json` -> `extra_info`, `extra_records`, `synonyms`
+  and `common_names`
+- the updated Plymouth CSVs -> `plymouth_species`
+
+Only the files that changed since the previous update are read, and only the rows
+that differ from the stored ones are written. Records are kept as JSON, along with
+indexed columns for record ids, stations and names, and their positions in the
+files. The layout of each JSON file (its indent, whether it escapes non-ASCII
+characters and ends with a newline) is stored too, so the files are exported back
+as they were.
+
+`python -m workflows.taxonomy_store update` updates the store,
+and `python -m workflows.taxonomy_store export` exports the files.
+"""
+import argparse
+import csv
+import json
+import logging
+import pathlib
+import re
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .jsonl import iter_records
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
+from .utils import hash_file
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("Taxonomy Store")
+
+WORK_DIR = pathlib.Path("./data")
+TAXONOMY_STORE_PATH = WORK_DIR / "Oceans1876" / "taxonomy.db"
+EXPORT_PATH = WORK_DIR / "tmp" / "taxonomy_export"
+
+# source name -> file
+SOURCES = {
+    "species": WORK_DIR / "Oceans1876" / "species.json",
+    "stations": WORK_DIR / "Oceans1876" / "stations.json",
+    "index_species": WORK_DIR / "Oceans1876" / "index_species.json",
+    "index_species_verified": WORK_DIR / "Oceans1876" / "index_species_verified.json",
+    "index_species_verified_extra": WORK_DIR
+    / "Oceans1876"
+    / "index_species_verified_extra.json",
+    "plymouth_all_species": WORK_DIR / "Plymouth" / "all_species_updated.csv",
+    "plymouth_summary_species": WORK_DIR / "Plymouth" / "summary_species_updated.csv",
+}
+
+# The list fields of the extra info, and their tables
+EXTRA_INFO_TABLES = {
+    "records": "extra_records",
+    "synonyms": "synonyms",
+    "common_names": "common_names",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    -- The file without its records (JSON), or the CSV columns
+    document TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    -- The `json_format` of the JSON files
+    format TEXT
+);
+
+CREATE TABLE IF NOT EXISTS verifications (
+    source TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    matched_name TEXT,
+    matched_canonical_name TEXT,
+    current_canonical_name TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (source, record_id)
+);
+CREATE INDEX IF NOT EXISTS verifications_record_id ON verifications (record_id);
+CREATE INDEX IF NOT EXISTS verifications_matched_canonical_name
+    ON verifications (matched_canonical_name);
+CREATE INDEX IF NOT EXISTS verifications_current_canonical_name
+    ON verifications (current_canonical_name);
+
+CREATE TABLE IF NOT EXISTS station_species (
+    station TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    record_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (station, position)
+);
+CREATE INDEX IF NOT EXISTS station_species_record_id ON station_species (record_id);
+CREATE INDEX IF NOT EXISTS station_species_name ON station_species (name);
+
+-- Genera have a species_position of -1.
+CREATE TABLE IF NOT EXISTS index_taxa (
+    genus_position INTEGER NOT NULL,
+    species_position INTEGER NOT NULL,
+    name TEXT,
+    record_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (genus_position, species_position)
+);
+CREATE INDEX IF NOT EXISTS index_taxa_record_id ON index_taxa (record_id);
+CREATE INDEX IF NOT EXISTS index_taxa_name ON index_taxa (name);
+
+CREATE TABLE IF NOT EXISTS extra_info (
+    record_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS extra_records (
+    record_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT,
+    scientific_name TEXT,
+    status TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (record_id, position)
+);
+CREATE INDEX IF NOT EXISTS extra_records_id ON extra_records (id);
+CREATE INDEX IF NOT EXISTS extra_records_scientific_name
+    ON extra_records (scientific_name);
+
+CREATE TABLE IF NOT EXISTS synonyms (
+    record_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT,
+    scientific_name TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (record_id, position)
+);
+CREATE INDEX IF NOT EXISTS synonyms_scientific_name ON synonyms (scientific_name);
+
+CREATE TABLE IF NOT EXISTS common_names (
+    record_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    language TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (record_id, position)
+);
+CREATE INDEX IF NOT EXISTS common_names_name ON common_names (name);
+
+CREATE TABLE IF NOT EXISTS plymouth_species (
+    source TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    genus TEXT,
+    species TEXT,
+    worms_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (source, row)
+);
+CREATE INDEX IF NOT EXISTS plymouth_species_worms_id ON plymouth_species (worms_id);
+CREATE INDEX IF NOT EXISTS plymouth_species_name ON plymouth_species (genus, species);
+"""
+
+Row = Tuple[Any, ...]
+
+
+def to_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def optional_str(value: Any) -> Optional[str]:
+    return None if value is None or value == "" else str(value)
+
+
+def json_format(text: str) -> Dict[str, Any]:
+    """
+    Return the layout of the JSON `text`: the `json.dump` arguments that write it
+    back as it is (`indent` and `ensure_ascii`), and whether it ends with a newline.
+    """
+    indent = re.match(r"[\[{]\n( *)", text)
+    return {
+        "indent": len(indent[1]) if indent else None,
+        "ensure_ascii": text.isascii(),
+        "newline": text.endswith("\n"),
+    }
+
+
+class TaxonomyStore:
+    """
+    Connection to the taxonomy store, with the updates from the workflows' files,
+    the lookups and the exports.
+    """
+
+    def __init__(self, path: pathlib.Path = TAXONOMY_STORE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+        # Stores created before the format column
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(sources)")
+        ]
+        if "format" not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE sources ADD COLUMN format TEXT")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "TaxonomyStore":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    # Updates
+
+    def _sync(
+        self,
+        table: str,
+        columns: Sequence[str],
+        key_count: int,
+        rows: Iterable[Row],
+        scope: Tuple[str, Row] = ("", ()),
+    ) -> int:
+        """
+        Make the rows of `table` within `scope` (a WHERE clause and its parameters)
+        the given ones, writing only the rows that changed.
+        The rows are identified by their first `key_count` columns.
+
+        Returns
+        -------
+        number of inserted, updated and deleted rows
+        """
+        where, params = scope
+        existing = {
+            row[:key_count]: row
+            for row in self.connection.execute(
+                f"SELECT {', '.join(columns)} FROM {table} {where}", params
+            )
+        }
+        changed = []
+        for row in rows:
+            if existing.pop(row[:key_count], None) != row:
+                changed.append(row)
+
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            changed,
+        )
+        self.connection.executemany(
+            f"DELETE FROM {table} WHERE "
+            + " AND ".join(f"{column} = ?" for column in columns[:key_count]),
+            existing.keys(),
+        )
+        return len(changed) + len(existing)
+
+    def _sync_verifications(self, source: str, species: Dict[str, dict]) -> int:
+        return self._sync(
+            "verifications",
+            [
+                "source",
+                "record_id",
+                "position",
+                "matched_name",
+                "matched_canonical_name",
+                "current_canonical_name",
+                "data",
+            ],
+            2,
+            (
+                (
+                    source,
+                    record_id,
+                    position,
+                    sp.get("matchedName"),
+                    sp.get("matchedCanonicalSimple"),
+                    sp.get("currentCanonicalSimple"),
+                    to_json(sp),
+                )
+                for position, (record_id, sp) in enumerate(species.items())
+            ),
+            ("WHERE source = ?", (source,)),
+        )
+
+    def _sync_station_species(self, stations: Iterator[dict]) -> int:
+        return self._sync(
+            "station_species",
+            ["station", "position", "name", "record_id", "data"],
+            2,
+            (
+                (
+                    station["Station"],
+                    position,
+                    sp.get("name"),
+                    sp.get("recordId"),
+                    to_json(sp),
+                )
+                for station in stations
+                for position, sp in enumerate(station.get("Species") or [])
+            ),
+        )
+
+    def _sync_index_taxa(self, genera: List[dict]) -> int:
+        def rows() -> Iterator[Row]:
+            for genus_position, genus in enumerate(genera):
+                species = genus.get("species")
+                yield (
+                    genus_position,
+                    -1,
+                    genus.get("genus"),
+                    genus.get("matched_species"),
+                    # The species are in their own rows.
+                    to_json(
+                        {**genus, "species": None if species is None else len(species)}
+                    ),
+                )
+                for species_position, sp in enumerate(species or []):
+                    yield (
+                        genus_position,
+                        species_position,
+                        f"{genus.get('genus')} {sp.get('species')}",
+                        sp.get("matched_species"),
+                        to_json(sp),
+                    )
+
+        return self._sync(
+            "index_taxa",
+            ["genus_position", "species_position", "name", "record_id", "data"],
+            2,
+            rows(),
+        )
+
+    def _sync_extra_info(self, extra_info: Dict[str, dict]) -> int:
+        # The list fields are in their own tables, and replaced by their length.
+        changes = self._sync(
+            "extra_info",
+            ["record_id", "position", "data"],
+            1,
+            (
+                (
+                    record_id,
+                    position,
+                    to_json(
+                        {
+                            k: len(v) if k in EXTRA_INFO_TABLES and v is not None else v
+                            for k, v in info.items()
+                        }
+                    ),
+                )
+                for position, (record_id, info) in enumerate(extra_info.items())
+            ),
+        )
+
+        def items(field: str) -> Iterator[Tuple[str, int, dict]]:
+            for record_id, info in extra_info.items():
+                for position, item in enumerate(info.get(field) or []):
+                    yield record_id, position, item
+
+        changes += self._sync(
+            "extra_records",
+            ["record_id", "position", "id", "scientific_name", "status", "data"],
+            2,
+            (
+                (
+                    record_id,
+                    position,
+                    optional_str(record.get("id")),
+                    record.get("scientificname"),
+                    record.get("status"),
+                    to_json(record),
+                )
+                for record_id, position, record in items("records")
+            ),
+        )
+        changes += self._sync(
+            "synonyms",
+            ["record_id", "position", "id", "scientific_name", "data"],
+            2,
+            (
+                (
+                    record_id,
+                    position,
+                    optional_str(synonym.get("id")),
+                    synonym.get("scientificname"),
+                    to_json(synonym),
+                )
+                for record_id, position, synonym in items("synonyms")
+            ),
+        )
+        changes += self._sync(
+            "common_names",
+            ["record_id", "position", "name", "language", "data"],
+            2,
+            (
+                (
+                    record_id,
+                    position,
+                    common_name.get("vernacular"),
+                    common_name.get("language_code"),
+                    to_json(common_name),
+                )
+                for record_id, position, common_name in items("common_names")
+            ),
+        )
+        return changes
+
+    def _sync_plymouth_species(self, source: str, rows: List[List[str]]) -> int:
+        columns = rows[0]
+        return self._sync(
+            "plymouth_species",
+            ["source", "row", "genus", "species", "worms_id", "data"],
+            2,
+            (
+                (
+                    source,
+                    row_number,
+                    values.get("Genus"),
+                    values.get("Species"),
+                    optional_str(values.get("WoRMS ID")),
+                    to_json(row),
+                )
+                for row_number, row in enumerate(rows[1:])
+                for values in [dict(zip(columns, row))]
+            ),
+            ("WHERE source = ?", (source,)),
+        )
+
+    def update_source(self, source: str, path: pathlib.Path) -> bool:
+        """
+        Update the records of `source` from `path`, if the file changed
+        since the previous update.
+
+        Returns
+        -------
+        whether the file changed
+        """
+        sha256 = hash_file(path)
+        is_json = source != "stations" and not source.startswith("plymouth")
+        previous = self.connection.execute(
+            "SELECT path, sha256, format IS NOT NULL FROM sources WHERE name = ?",
+            (source,),
+        ).fetchone()
+        # The JSON files stored without their format are read again.
+        if previous == (str(path), sha256, is_json):
+            logger.info(f"{path} has not changed")
+            return False
+
+        with stage(f"{source} read"):
+            document: Any
+            file_format = None
+            if source == "stations":
+                document = None
+                records: Any = iter_records(path)
+            elif source.startswith("plymouth"):
+                with open(path, "r", newline="") as f:
+                    records = list(csv.reader(f))
+                document = records[0]
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                file_format = json_format(text)
+                document = json.loads(text)
+                records = document["species"]
+                document["species"] = None
+
+        with stage(f"{source} write"), self.connection:
+            if source in ("species", "index_species_verified"):
+                changes = self._sync_verifications(source, records)
+            elif source == "stations":
+                changes = self._sync_station_species(records)
+            elif source == "index_species":
+                changes = self._sync_index_taxa(records)
+            elif source == "index_species_verified_extra":
+                changes = self._sync_extra_info(records)
+            else:
+                changes = self._sync_plymouth_species(source, records)
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sources "
+                "(name, path, sha256, document, updated_at, format) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    source,
+                    str(path),
+                    sha256,
+                    to_json(document),
+                    datetime.now().isoformat(),
+                    None if file_format is None else to_json(file_format),
+                ),
+            )
+
+        timings.count("rows written", changes)
+        logger.info(f"Updated {source} from {path} ({changes} rows changed)")
+        return True
+
+    def update(self, sources: Optional[Dict[str, pathlib.Path]] = None) -> None:
+        """
+        Update the store from the files of the given sources (default: `SOURCES`)
+        that exist.
+        """
+        for source, path in (sources or SOURCES).items():
+            if path.exists():
+                self.update_source(source, path)
+            else:
+                logger.warning(f"{path} does not exist, skipping {source}")
+
+    # Lookups
+
+    def _data(self, query: str, params: Row) -> List[dict]:
+        return [json.loads(data) for data, in self.connection.execute(query, params)]
+
+    def verification(
+        self, record_id: str, source: str = "species"
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the verification of `record_id` in `species.json` (`source`
+        "species") or in `index_species_verified.json` ("index_species_verified").
+        """
+        verifications = self._data(
+            "SELECT data FROM verifications WHERE source = ? AND record_id = ?",
+            (source, record_id),
+        )
+        return verifications[0] if verifications else None
+
+    def record_ids(self, name: str) -> List[str]:
+        """
+        Return the record ids that `name` was verified as, or found in a station
+        or the summary report index with, or that it is a synonym of.
+        """
+        return [
+            record_id
+            for record_id, in self.connection.execute(
+                """
+                SELECT record_id FROM verifications
+                WHERE matched_name = :name
+                    OR matched_canonical_name = :name
+                    OR current_canonical_name = :name
+                UNION SELECT record_id FROM station_species WHERE name = :name
+                UNION SELECT record_id FROM index_taxa WHERE name = :name
+                UNION SELECT record_id FROM synonyms WHERE scientific_name = :name
+                ORDER BY record_id
+                """,
+                {"name": name},
+            )
+            if record_id is not None
+        ]
+
+    def stations(self, record_id: str) -> List[str]:
+        """
+        Return the stations where `record_id` was found.
+        """
+        return [
+            station
+            for station, in self.connection.execute(
+                "SELECT DISTINCT station FROM station_species WHERE record_id = ? "
+                "ORDER BY station",
+                (record_id,),
+            )
+        ]
+
+    def station_species(self, station: str) -> List[Dict[str, Any]]:
+        return self._data(
+            "SELECT data FROM station_species WHERE station = ? ORDER BY position",
+            (station,),
+        )
+
+    def index_taxa(self, record_id: str) -> List[Dict[str, Any]]:
+        """
+        Return the genera and species of the summary report index matched
+        with `record_id` (the genera without their species).
+        """
+        return self._data(
+            "SELECT data FROM index_taxa WHERE record_id = ? "
+            "ORDER BY genus_position, species_position",
+            (record_id,),
+        )
+
+    def extra_info(self, record_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._data(
+            "SELECT data FROM extra_info WHERE record_id = ?", (record_id,)
+        )
+        if not rows:
+            return None
+        info = rows[0]
+        for field, table in EXTRA_INFO_TABLES.items():
+            if info.get(field) is not None:
+                info[field] = self._data(
+                    f"SELECT data FROM {table} WHERE record_id = ? ORDER BY position",
+                    (record_id,),
+                )
+        return info
+
+    def synonyms(self, record_id: str) -> List[Dict[str, Any]]:
+        return self._data(
+            "SELECT data FROM synonyms WHERE record_id = ? ORDER BY position",
+            (record_id,),
+        )
+
+    def common_names(self, record_id: str) -> List[Dict[str, Any]]:
+        return self._data(
+            "SELECT data FROM common_names WHERE record_id = ? ORDER BY position",
+            (record_id,),
+        )
+
+    def plymouth_species(self, worms_id: str) -> List[Dict[str, str]]:
+        """
+        Return the rows of the Plymouth CSVs with the given WoRMS ID, by column.
+        """
+        rows = []
+        for source, data in self.connection.execute(
+            "SELECT source, data FROM plymouth_species WHERE worms_id = ? "
+            "ORDER BY source, row",
+            (worms_id,),
+        ):
+            rows.append(dict(zip(self._document(source), json.loads(data))))
+        return rows
+
+    # Exports
+
+    def _document(self, source: str) -> Any:
+        row = self.connection.execute(
+            "SELECT document FROM sources WHERE name = ?", (source,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _export_records(self, source: str) -> Any:
+        if source in ("species", "index_species_verified"):
+            return {
+                record_id: json.loads(data)
+                for record_id, data in self.connection.execute(
+                    "SELECT record_id, data FROM verifications WHERE source = ? "
+                    "ORDER BY position",
+                    (source,),
+                )
+            }
+
+        if source == "index_species":
+            genera: List[dict] = []
+            for species_position, data in self.connection.execute(
+                "SELECT species_position, data FROM index_taxa "
+                "ORDER BY genus_position, species_position"
+            ):
+                if species_position == -1:
+                    genera.append(json.loads(data))
+                    if genera[-1].get("species") is not None:
+                        genera[-1]["species"] = []
+                else:
+                    genera[-1]["species"].append(json.loads(data))
+            return genera
+
+        extra_info = {
+            record_id: json.loads(data)
+            for record_id, data in self.connection.execute(
+                "SELECT record_id, data FROM extra_info ORDER BY position"
+            )
+        }
+        for field, table in EXTRA_INFO_TABLES.items():
+            for info in extra_info.values():
+                if info.get(field) is not None:
+                    info[field] = []
+            for record_id, data in self.connection.execute(
+                f"SELECT record_id, data FROM {table} ORDER BY record_id, position"
+            ):
+                extra_info[record_id][field].append(json.loads(data))
+        return extra_info
+
+    def export(self, output_path: pathlib.Path = EXPORT_PATH) -> None:
+        """
+        Export the JSON and CSV files of all the sources in the store,
+        except the stations, in `output_path`.
+        """
+        output_path.mkdir(parents=True, exist_ok=True)
+        for source, path, file_format in self.connection.execute(
+            "SELECT name, path, format FROM sources WHERE name != 'stations'"
+        ).fetchall():
+            export_path = output_path / pathlib.Path(path).name
+            with stage(f"{source} export"):
+                if source.startswith("plymouth"):
+                    with open(export_path, "w", newline="") as f:
+                        writer = csv.writer(f, lineterminator="\n")
+                        writer.writerow(self._document(source))
+                        writer.writerows(
+                            json.loads(data)
+                            for data, in self.connection.execute(
+                                "SELECT data FROM plymouth_species WHERE source = ? "
+                                "ORDER BY row",
+                                (source,),
+                            )
+                        )
+                else:
+                    document = self._document(source)
+                    document["species"] = self._export_records(source)
+                    layout = json.loads(file_format)
+                    with open(export_path, "w", encoding="utf-8") as f:
+                        json.dump(
+                            document,
+                            f,
+                            indent=layout["indent"],
+                            ensure_ascii=layout["ensure_ascii"],
+                        )
+                        if layout["newline"]:
+                            f.write("\n")
+            logger.info(f"Exported {source} to {export_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser(
+        "update", help="Update the store from the files that changed"
+    )
+    export_parser = subparsers.add_parser(
+        "export", help="Export the JSON and CSV files from the store"
+    )
+    export_parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        default=EXPORT_PATH,
+        help="Directory of the exported files",
+    )
+    add_profile_argument(update_parser)
+    add_profile_argument(export_parser)
+    args = parser.parse_args()
+
+    with profile(
+        f"taxonomy_store-{args.command}", args.profile
+    ), TaxonomyStore() as store:
+        if args.command == "update":
+            store.update()
+        else:
+            store.export(args.output)
+    timings.save(TIMINGS_PATH / f"taxonomy_store_{args.command}_timings.json")
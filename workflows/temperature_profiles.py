@@ -0,0 +1,153 @@
+"""
+Temperature profiles of the stations in long (sparse) columnar form.
+
+The RAMM stations have a "Temp (F) at <depth> Fathoms" column per depth, with
+".<n>" suffixes for repeated measurements at the same depth, and most of them are
+empty. Only the recorded temperatures are kept here, as parallel arrays of
+station index, depth (fathoms), duplicate suffix (0 for the first measurement)
+and temperature (F), sorted by station, depth and duplicate suffix.
+They are saved in `data/Oceans1876/temperature_profiles.npz`.
+"""
+import pathlib
+import re
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+WORK_DIR = pathlib.Path("./data")
+TEMPERATURE_PROFILES_PATH = WORK_DIR / "Oceans1876" / "temperature_profiles.npz"
+
+TEMP_COLUMN_PATTERN = re.compile(r"Temp \(F\) at (\d+) Fathoms(?:\.(\d+))?")
+
+
+def parse_temp_column(column: str) -> Tuple[int, int]:
+    """
+    Return the depth and the duplicate suffix of a "Temp (F) at <depth> Fathoms"
+    column. The suffix is 0 if the column has none.
+    """
+    match = TEMP_COLUMN_PATTERN.fullmatch(column)
+    if match is None:
+        raise ValueError(f"Not a temperature column: {column}")
+    depth, duplicate = match.groups()
+    return int(depth), int(duplicate or 0)
+
+
+class TemperatureProfiles:
+    """
+    The recorded temperatures of all stations, as NumPy arrays.
+
+    `station`, `depth`, `duplicate` and `temp` have one element per measurement.
+    `stations` holds the station names, indexed by `station`, and the measurements
+    of station `i` are `offsets[i]:offsets[i + 1]`.
+    """
+
+    def __init__(
+        self,
+        stations: np.ndarray,
+        station: np.ndarray,
+        depth: np.ndarray,
+        duplicate: np.ndarray,
+        temp: np.ndarray,
+    ):
+        self.stations = stations
+        self.station = station
+        self.depth = depth
+        self.duplicate = duplicate
+        self.temp = temp
+        self.offsets = np.searchsorted(station, np.arange(len(stations) + 1))
+
+    @classmethod
+    def from_ramm_stations(cls, ramm_stations: pd.DataFrame) -> "TemperatureProfiles":
+        """
+        Collect the recorded temperatures from the "Temp (F) at <depth> Fathoms"
+        columns of the (typed) RAMM stations.
+        """
+        temp_columns = [
+            c for c in ramm_stations.columns if TEMP_COLUMN_PATTERN.match(c)
+        ]
+        parsed_columns = np.array(
+            [parse_temp_column(c) for c in temp_columns], dtype=np.int32
+        ).reshape(-1, 2)
+        column_depths, column_duplicates = parsed_columns[:, 0], parsed_columns[:, 1]
+
+        temps = ramm_stations[temp_columns].to_numpy(dtype=np.float64)
+        station, column = np.nonzero(~np.isnan(temps))
+        station = station.astype(np.int32)
+        depth = column_depths[column]
+        duplicate = column_duplicates[column]
+        order = np.lexsort(np.stack((duplicate, depth, station)))
+
+        return cls(
+            ramm_stations["Station"].to_numpy(dtype=str),
+            station[order],
+            depth[order],
+            duplicate[order].astype(np.int8),
+            temps[station, column][order],
+        )
+
+    @classmethod
+    def load(
+        cls, path: pathlib.Path = TEMPERATURE_PROFILES_PATH
+    ) -> "TemperatureProfiles":
+        with np.load(path) as profiles:
+            return cls(
+                profiles["stations"],
+                profiles["station"],
+                profiles["depth"],
+                profiles["duplicate"],
+                profiles["temp"],
+            )
+
+    def save(self, path: pathlib.Path = TEMPERATURE_PROFILES_PATH) -> None:
+        np.savez_compressed(
+            path,
+            stations=self.stations,
+            station=self.station,
+            depth=self.depth,
+            duplicate=self.duplicate,
+            temp=self.temp,
+        )
+
+    def __len__(self) -> int:
+        return len(self.temp)
+
+    def profile(self, station: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the depths and temperatures recorded at the given station.
+        """
+        (indices,) = np.nonzero(self.stations == station)
+        if not len(indices):
+            raise KeyError(station)
+        measurements = slice(self.offsets[indices[0]], self.offsets[indices[0] + 1])
+        return self.depth[measurements], self.temp[measurements]
+
+    def select(
+        self,
+        min_depth: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        min_temp: Optional[float] = None,
+        max_temp: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Return the mask of the measurements within the given depth (fathoms)
+        and temperature (F) ranges (inclusive).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if min_depth is not None:
+            mask &= self.depth >= min_depth
+        if max_depth is not None:
+            mask &= self.depth <= max_depth
+        if min_temp is not None:
+            mask &= self.temp >= min_temp
+        if max_temp is not None:
+            mask &= self.temp <= max_temp
+        return mask
+
+    def at_depth(self, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the names of the stations with a temperature recorded at the given
+        depth, and the temperature recorded there (without the duplicates).
+        """
+        mask = (self.depth == depth) & (self.duplicate == 0)
+        return self.stations[self.station[mask]], self.temp[mask]
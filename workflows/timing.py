@@ -0,0 +1,139 @@
+"""
+Lightweight instrumentation for timing the named stages of a workflow.
+
+Stages are timed with the `stage` context manager or the `timed` decorator
+and aggregated in a process-wide `StageTimings` instance (`timings`).
+At the end of a run, `timings.save(path)` writes a JSON report with the count,
+total, mean, p50, p95 and max duration of every stage. The reports of the
+workflows are saved in `TIMINGS_PATH` (`data/tmp/timings`), outside of the
+published data.
+"""
+import functools
+import json
+import logging
+import pathlib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, TypeVar, cast
+
+logger = logging.getLogger("Timing")
+
+TIMINGS_PATH = pathlib.Path("./data") / "tmp" / "timings"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """
+    Return the q-th percentile (0 <= q <= 100) of an already sorted list,
+    using linear interpolation between the closest ranks.
+    """
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        position - lower
+    )
+
+
+class StageTimings:
+    """
+    Thread-safe collection of stage durations (in seconds) and counters.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._durations: Dict[str, List[float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._started_at = time.time()
+
+    def add(self, name: str, duration: float) -> None:
+        with self._lock:
+            self._durations.setdefault(name, []).append(duration)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increment a named counter, e.g. the number of cache hits for a stage.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timed(self, name: str) -> Callable[[F], F]:
+        """
+        Decorator version of `stage`.
+        """
+
+        def decorator(func: F) -> F:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.stage(name):
+                    return func(*args, **kwargs)
+
+            return cast(F, wrapper)
+
+        return decorator
+
+    def reset(self) -> None:
+        with self._lock:
+            self._durations = {}
+            self._counters = {}
+            self._started_at = time.time()
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            durations = {k: sorted(v) for k, v in self._durations.items()}
+            counters = dict(self._counters)
+
+        stages = {}
+        for name, values in durations.items():
+            total = sum(values)
+            stages[name] = {
+                "count": len(values),
+                "total": round(total, 6),
+                "mean": round(total / len(values), 6),
+                "p50": round(percentile(values, 50), 6),
+                "p95": round(percentile(values, 95), 6),
+                "max": round(values[-1], 6),
+            }
+
+        return {
+            "started_at": datetime.fromtimestamp(self._started_at).isoformat(),
+            "wall_time": round(time.time() - self._started_at, 6),
+            "stages": dict(
+                sorted(stages.items(), key=lambda s: s[1]["total"], reverse=True)
+            ),
+            "counters": counters,
+        }
+
+    def save(self, path: pathlib.Path) -> None:
+        """
+        Write the report to `path` as JSON and log a one-line summary per stage.
+        """
+        report = self.report()
+        for name, stats in report["stages"].items():
+            logger.info(
+                f"{name}: {stats['count']} calls, {stats['total']:.2f}s total, "
+                f"p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s"
+            )
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Stage timings saved to {path}")
+
+
+timings = StageTimings()
+stage = timings.stage
+timed = timings.timed
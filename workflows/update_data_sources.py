@@ -1,12 +1,24 @@
+"""
+Updates the data sources file (`data/Oceans1876/data_sources.json`)
+from Global Names API.
+
+The data sources are requested conditionally (ETag/If-Modified-Since), with the
+validators of the previous response saved in `data/tmp/data_sources_http_cache.json`.
+The file is only rewritten if a field of one of its data sources has changed.
+"""
+import argparse
 import json
 import logging
 import pathlib
+from typing import Any, Dict, List, Tuple
 
 import requests
 from pydantic import parse_file_as
 
 from data.schemas.data_sources import DataSources
 
+from .profiling import add_profile_argument, profile
+from .timing import TIMINGS_PATH, stage, timings
 from .utils import camelcase_to_snakecase
 
 logging.basicConfig(level=logging.INFO)
@@ -16,32 +28,140 @@ WORK_DIR = pathlib.Path("./data")
 
 DATASOURCE_URI = "https://verifier.globalnames.org/api/v1/data_sources"
 DATA_SOURCES_FILE_PATH = WORK_DIR / "Oceans1876" / "data_sources.json"
+HTTP_CACHE_PATH = WORK_DIR / "tmp" / "data_sources_http_cache.json"
+
+# data source id -> field -> (old value, new value)
+DataSourcesChanges = Dict[int, Dict[str, Tuple[Any, Any]]]
+
+
+def load_http_cache(path: pathlib.Path = HTTP_CACHE_PATH) -> Dict[str, Dict[str, str]]:
+    """
+    Load the ETag and Last-Modified headers of the previous responses, by URI.
+    """
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_http_cache(
+    http_cache: Dict[str, Dict[str, str]], path: pathlib.Path = HTTP_CACHE_PATH
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(http_cache, f, indent=2)
+
+
+def diff_data_sources(
+    local_data_sources: Dict[str, dict], remote_data_sources: List[dict]
+) -> DataSourcesChanges:
+    """
+    Compare the fields of the local data sources (as saved in the data sources file)
+    with the ones received from Global Names API.
+    Data sources that are not in the local file are ignored, as in the update.
+    """
+    changes: DataSourcesChanges = {}
+    for ds in remote_data_sources:
+        local_ds = local_data_sources.get(str(ds["id"]))
+        if local_ds is None:
+            continue
+        fields = {}
+        for k, v in ds.items():
+            field = camelcase_to_snakecase(k)
+            if field not in local_ds or local_ds[field] != v:
+                fields[field] = (local_ds.get(field), v)
+        if fields:
+            changes[ds["id"]] = fields
+    return changes
 
 
-def update_data_sources() -> None:
+def update_data_sources(
+    uri: str = DATASOURCE_URI,
+    force: bool = False,
+    data_sources_path: pathlib.Path = DATA_SOURCES_FILE_PATH,
+    http_cache_path: pathlib.Path = HTTP_CACHE_PATH,
+) -> None:
     """
-    Update the data sources file (`DATASOURCE_FILE_PATH`)
-    from Global Names API (`DATASOURCE_URI`).
+    Update the data sources file (`data_sources_path`)
+    from Global Names API (`uri`).
+
+    Parameters
+    ----------
+    uri: Global Names API data sources endpoint
+    force: request the data sources unconditionally
+    data_sources_path: the data sources file
+    http_cache_path: the validators of the previous responses
     """
-    data_sources = parse_file_as(DataSources, DATA_SOURCES_FILE_PATH)
+    http_cache = load_http_cache(http_cache_path)
+    validators = http_cache.get(uri, {})
+    headers = {}
+    if not force:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    with stage("http request"):
+        resp = requests.get(uri, headers=headers)
+
+    if resp.status_code == 304:
+        logger.info("Data sources are not modified since the previous update")
+        return
+    if resp.status_code != 200:
+        logger.warning(f"Received Status code: {resp.status_code} from the GNAMES API")
+        return
+
+    data_sources_list = resp.json()
 
-    resp = requests.get(DATASOURCE_URI)
-    if resp.status_code == 200:
-        data_sources_dict = resp.json()
-        for ds in data_sources_dict:
+    with stage("json read"), open(data_sources_path, "r") as f:
+        local_data_sources = json.load(f)
+
+    changes = diff_data_sources(local_data_sources, data_sources_list)
+    for ds_id, fields in changes.items():
+        logger.info(
+            f"Data source {ds_id} ({local_data_sources[str(ds_id)].get('title')}) "
+            f"changed: {', '.join(fields)}"
+        )
+
+    if changes:
+        data_sources = parse_file_as(DataSources, data_sources_path)
+        for ds in data_sources_list:
             if ds["id"] in data_sources:
                 for k, v in ds.items():
                     setattr(data_sources[ds["id"]], camelcase_to_snakecase(k), v)
 
-        with open(DATA_SOURCES_FILE_PATH, "w") as f:
+        with stage("json write"), open(data_sources_path, "w") as f:
             json.dump(
                 dict(map(lambda d: (d[0], d[1].dict()), data_sources.items())),
                 f,
                 indent=2,
             )
+        logger.info(f"Updated {len(changes)} data sources")
     else:
-        logger.warning(f"Received Status code: {resp.status_code} from the GNAMES API")
+        logger.info("No data source has changed")
+
+    http_cache[uri] = {
+        "etag": resp.headers.get("ETag", ""),
+        "last_modified": resp.headers.get("Last-Modified", ""),
+    }
+    save_http_cache(http_cache, http_cache_path)
 
 
 if __name__ == "__main__":
-    update_data_sources()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--uri",
+        default=DATASOURCE_URI,
+        help="Global Names API data sources endpoint",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Request the data sources even if they have not been modified",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile("update_data_sources", args.profile):
+        update_data_sources(args.uri, args.force)
+    timings.save(TIMINGS_PATH / "data_sources_timings.json")
@@ -1,5 +1,7 @@
+import hashlib
 import json
 import logging
+import pathlib
 import re
 from typing import Any
 
@@ -7,6 +9,8 @@ from pydantic import BaseModel
 
 logger = logging.getLogger("Utils")
 
+HASH_CHUNK_SIZE = 1 << 20
+
 
 def camelcase_to_snakecase(name: str) -> str:
     """
@@ -25,3 +29,14 @@ class PydanticJSONEncoder(json.JSONEncoder):
         if isinstance(obj, BaseModel):
             return obj.dict()
         return json.JSONEncoder.default(self, obj)
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """
+    Return the SHA-256 of the file's content.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()